@@ -0,0 +1,71 @@
+"""
+Report conversion throughput against file size for each compression
+policy, with both mesh layouts.
+
+The meshes and the columnar topology are synthetic, see
+bench_mesh_layout.py and bench_topology_layout.py, so OpenCascade is
+not needed.  Throughput and
+ratio are computed from the raw size of the mesh arrays.  The fast and zstd policies use
+hdf5plugin when it is installed and fall back to gzip otherwise.
+
+    python benchmarks/bench_compression.py --faces 2000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+
+from steptohdf5.core.compression import compression_policies, hdf5plugin
+from steptohdf5.core.hdf5_converter import (convert_topology_to_columnar_hdf5, convert_meshes_to_hdf5,
+                                            convert_meshes_to_concatenated_hdf5)
+
+from bench_mesh_layout import make_meshes
+from bench_topology_layout import make_topology_dict, read_all_datasets
+
+
+def write_file(path, topo_dict, meshes, mesh_writer, policy):
+    with h5py.File(path, "w") as hdf5_file:
+        convert_topology_to_columnar_hdf5(topo_dict, hdf5_file.create_group("topology"), policy)
+        mesh_writer(meshes, hdf5_file.create_group("mesh"), policy)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HDF5 compression policies.")
+    parser.add_argument("--faces", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    meshes = make_meshes(args.faces)
+    topo_dict = make_topology_dict(4 * args.faces)
+    raw_size = sum(m["vertices"].nbytes + m["faces"].nbytes for m in meshes)
+
+    if hdf5plugin is None:
+        print("hdf5plugin not installed, fast and zstd fall back to gzip")
+    print("%12s %8s %10s %10s %12s %12s %8s" % ("mesh layout", "policy", "write [s]", "read [s]", "MB/s", "size [kB]", "ratio"))
+    mesh_writers = [("faces", convert_meshes_to_hdf5), ("concatenated", convert_meshes_to_concatenated_hdf5)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.hdf5")
+        for layout, mesh_writer in mesh_writers:
+            for name, policy in compression_policies.items():
+                write_times = []
+                read_times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    write_file(path, topo_dict, meshes, mesh_writer, policy)
+                    write_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    with h5py.File(path, "r") as hdf5_file:
+                        read_all_datasets(hdf5_file)
+                    read_times.append(time.perf_counter() - start)
+
+                write_time = min(write_times)
+                size = os.path.getsize(path)
+                print("%12s %8s %10.3f %10.3f %12.1f %12.1f %8.2f" % (layout, name, write_time, min(read_times),
+                                                                   raw_size / write_time / 1e6, size / 1024, raw_size / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare write time and file size of the per-face mesh layout
+against the concatenated per-part mesh layout.
+
+The meshes are synthetic triangulated grids, one per face, shaped
+like the output of MeshBuilder.create_surface_meshes, so neither a
+STEP file nor OpenCascade is needed.
+
+    python benchmarks/bench_mesh_layout.py --faces 100 1000 10000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+from steptohdf5.core.hdf5_converter import convert_meshes_to_hdf5, convert_meshes_to_concatenated_hdf5
+
+
+def make_face_mesh(resolution, rng):
+    u, v = np.meshgrid(np.linspace(0.0, 1.0, resolution), np.linspace(0.0, 1.0, resolution))
+    vertices = np.stack([u.ravel(), v.ravel(), 0.01 * rng.standard_normal(u.size)], axis=1)
+    grid = np.arange(resolution * resolution).reshape(resolution, resolution)
+    a = grid[:-1, :-1].ravel()
+    b = grid[:-1, 1:].ravel()
+    c = grid[1:, :-1].ravel()
+    d = grid[1:, 1:].ravel()
+    faces = np.concatenate([np.stack([a, b, d], axis=1), np.stack([a, d, c], axis=1)])
+    return {"vertices": vertices, "faces": faces}
+
+
+def make_meshes(nr_faces, seed=0):
+    rng = np.random.default_rng(seed)
+    # Mostly small faces with a few finely tessellated ones, as in real parts
+    resolutions = rng.choice([3, 5, 10, 40], size=nr_faces, p=[0.5, 0.3, 0.15, 0.05])
+    return [make_face_mesh(r, rng) for r in resolutions]
+
+
+def time_layout(meshes, writer, path, repeat):
+    write_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with h5py.File(path, "w") as hdf5_file:
+            writer(meshes, hdf5_file.create_group("mesh"))
+        write_times.append(time.perf_counter() - start)
+    return min(write_times), os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HDF5 mesh layouts.")
+    parser.add_argument("--faces", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    layouts = [("faces", convert_meshes_to_hdf5), ("concatenated", convert_meshes_to_concatenated_hdf5)]
+
+    print("%8s %12s %10s %12s" % ("faces", "layout", "write [s]", "size [kB]"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for nr_faces in args.faces:
+            meshes = make_meshes(nr_faces)
+            for name, writer in layouts:
+                path = os.path.join(tmp, "%s.hdf5" % name)
+                write_time, size = time_layout(meshes, writer, path, args.repeat)
+                print("%8i %12s %10.3f %12.1f" % (nr_faces, name, write_time, size / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+End-to-end and per-stage throughput of the converter on the synthetic
+STEP corpus of synthetic_corpus.py, with a regression check on the
+scaling curves.
+
+For each file StepProcessor is timed end to end, then each builder
+on its own: EntityMapper, TopologyGraph, TopologyDictBuilder,
+GeometryDictBuilder, MeshBuilder and convert_dict_to_hdf5.  On the
+grid_N files the exponent of time against number of faces is fitted
+per stage; a stage above --max_exponent (default 1.3, linear is 1)
+fails the run with exit status 1, so an accidental quadratic path
+shows up.
+
+    python benchmarks/bench_pipeline.py --corpus /tmp/corpus --faces 100 1000 10000 100000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from steptohdf5.core.step_processor import StepProcessor, load_parts_from_step_file
+from steptohdf5.core.entity_mapper import EntityMapper
+from steptohdf5.core.topology_graph import TopologyGraph
+from steptohdf5.core.topology_dict_builder import TopologyDictBuilder
+from steptohdf5.core.geometry_dict_builder import GeometryDictBuilder
+from steptohdf5.core.mesh_builder import MeshBuilder
+from steptohdf5.core.hdf5_converter import convert_dict_to_hdf5
+
+from synthetic_corpus import generate_corpus
+
+STAGES = ["end_to_end", "entity_mapper", "topology_graph", "topology", "geometry", "mesh", "hdf5_write"]
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def time_file(path, output_dir, repeat):
+    """
+    Best of repeat runs for each stage, and the number of faces
+    """
+    logger = logging.getLogger("bench")
+    best = {}
+    nr_faces = 0
+    for _ in range(repeat):
+        times = {}
+        start = time.perf_counter()
+        processor = StepProcessor(Path(path), Path(output_dir), Path(output_dir))
+        processor.load_step_file()
+        processor.process_parts()
+        times["end_to_end"] = time.perf_counter() - start
+
+        for stage in STAGES[1:]:
+            times[stage] = 0.0
+        nr_faces = 0
+        for part in load_parts_from_step_file(Path(path), logger=logger):
+            mapper, mapper_time = timed(EntityMapper, [part])
+            graph, graph_time = timed(TopologyGraph, part)
+            topo_dict, topo_time = timed(TopologyDictBuilder(mapper, topology_graph=graph).build_dict_for_parts, part)
+            geo_dict, geo_time = timed(GeometryDictBuilder(mapper, topology_graph=graph).build_dict_for_parts, part, logger)
+            bbox = geo_dict["bbox"]
+            length = 1e-3 * max(bbox[3] - bbox[0], bbox[4] - bbox[1], bbox[5] - bbox[2])
+            _, mesh_time = timed(MeshBuilder(mapper, logger, topology_graph=graph).create_surface_meshes, part, length)
+            with h5py.File(os.path.join(output_dir, "bench.hdf5"), "w", driver="core", backing_store=False) as hdf5_file:
+                start = time.perf_counter()
+                convert_dict_to_hdf5(topo_dict, hdf5_file.create_group("topology"))
+                convert_dict_to_hdf5(geo_dict, hdf5_file.create_group("geometry"))
+                write_time = time.perf_counter() - start
+
+            for stage, seconds in zip(STAGES[1:], [mapper_time, graph_time, topo_time, geo_time, mesh_time, write_time]):
+                times[stage] += seconds
+            nr_faces += len(graph.faces)
+
+        for stage, seconds in times.items():
+            best[stage] = min(best.get(stage, np.inf), seconds)
+    return nr_faces, best
+
+
+def scaling_exponent(faces, seconds, min_time=1e-3):
+    """
+    Slope of log(time) against log(faces), ignoring runs too short to
+    time reliably.  None with fewer than two usable points
+    """
+    points = [(f, s) for f, s in zip(faces, seconds) if s >= min_time and f > 0]
+    if len(points) < 2:
+        return None
+    x, y = np.log(np.array(points)).T
+    return np.polyfit(x, y, 1)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the converter on a synthetic STEP corpus.")
+    parser.add_argument("--corpus", default=None, help="Directory of the corpus, a temporary one by default.")
+    parser.add_argument("--faces", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--instances", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--max_exponent", type=float, default=1.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = args.corpus if args.corpus is not None else os.path.join(tmp, "corpus")
+        paths = generate_corpus(corpus, args.faces, args.instances)
+
+        print("%-16s %8s " % ("file", "faces") + " ".join("%14s" % s for s in STAGES))
+        grid = []
+        for name, path in paths.items():
+            nr_faces, times = time_file(path, os.path.join(tmp, "output"), args.repeat)
+            print("%-16s %8i " % (name, nr_faces) + " ".join("%14.4f" % times[s] for s in STAGES))
+            if name.startswith("grid_"):
+                grid.append((nr_faces, times))
+
+    failed = False
+    print()
+    print("%-16s %10s" % ("stage", "exponent"))
+    for stage in STAGES:
+        exponent = scaling_exponent([f for f, _ in grid], [t[stage] for _, t in grid])
+        if exponent is None:
+            print("%-16s %10s" % (stage, "-"))
+            continue
+        status = "ok" if exponent <= args.max_exponent else "FAIL"
+        failed = failed or exponent > args.max_exponent
+        print("%-16s %10.2f %s" % (stage, exponent, status))
+
+    if failed:
+        print("A stage scales worse than faces^%.2f" % args.max_exponent)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
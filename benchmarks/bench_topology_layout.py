@@ -0,0 +1,112 @@
+"""
+Compare write and read times of the topology of a part stored with the
+per-entity group layout (format 2.0) and the columnar layout (format 3.0).
+
+The topology dictionary is synthetic, shaped like the output of
+TopologyDictBuilder for a part made of quad faces, so no STEP file
+is needed.  Only the HDF5 writers of steptohdf5.core are imported,
+which run without OpenCascade.
+
+    python benchmarks/bench_topology_layout.py --halfedges 50000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import h5py
+
+from steptohdf5.core.hdf5_converter import convert_dict_to_hdf5, convert_topology_to_columnar_hdf5
+
+
+def make_topology_dict(nr_halfedges):
+    nr_faces = max(nr_halfedges // 4, 1)
+    nr_halfedges = nr_faces * 4
+    nr_edges = nr_halfedges // 2
+
+    halfedges = []
+    for i in range(nr_halfedges):
+        halfedges.append({
+            "mates": [i ^ 1],
+            "2dcurve": i,
+            "edge": i // 2,
+            "orientation_wrt_edge": i % 2 == 0
+        })
+    edges = [{"3dcurve": i, "start_vertex": i, "end_vertex": (i + 1) % nr_edges} for i in range(nr_edges)]
+    loops = [{"halfedges": list(range(4 * i, 4 * i + 4))} for i in range(nr_faces)]
+    faces = []
+    for i in range(nr_faces):
+        faces.append({
+            "surface": i,
+            "surface_orientation": True,
+            "loops": [i],
+            "exact_domain": [0.0, 1.0, 0.0, 1.0],
+            "outer_loop": i,
+            "has_singularities": False,
+            "nr_singularities": 0,
+            "singularities": []
+        })
+    shells = [{
+        "orientation_wrt_solid": True,
+        "faces": [{"face_index": i, "face_orientation_wrt_shell": True} for i in range(nr_faces)]
+    }]
+    solids = [{"shells": [0]}]
+
+    return {
+        "solids": solids,
+        "shells": shells,
+        "faces": faces,
+        "edges": edges,
+        "loops": loops,
+        "halfedges": halfedges
+    }
+
+
+def read_all_datasets(group):
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset):
+            obj[()]
+    group.visititems(visit)
+
+
+def time_layout(topo_dict, writer, path, repeat):
+    write_times = []
+    read_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with h5py.File(path, "w") as hdf5_file:
+            writer(topo_dict, hdf5_file.create_group("topology"))
+        write_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with h5py.File(path, "r") as hdf5_file:
+            read_all_datasets(hdf5_file["topology"])
+        read_times.append(time.perf_counter() - start)
+
+    with h5py.File(path, "r") as hdf5_file:
+        nr_objects = []
+        hdf5_file.visit(nr_objects.append)
+
+    return min(write_times), min(read_times), len(nr_objects), os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HDF5 topology layouts.")
+    parser.add_argument("--halfedges", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    layouts = [("groups", convert_dict_to_hdf5), ("columnar", convert_topology_to_columnar_hdf5)]
+
+    print("%10s %10s %10s %10s %10s %12s" % ("halfedges", "layout", "write [s]", "read [s]", "objects", "size [kB]"))
+    with tempfile.TemporaryDirectory() as tmp:
+        for nr_halfedges in args.halfedges:
+            topo_dict = make_topology_dict(nr_halfedges)
+            for name, writer in layouts:
+                path = os.path.join(tmp, "%s.hdf5" % name)
+                write_time, read_time, nr_objects, size = time_layout(topo_dict, writer, path, args.repeat)
+                print("%10i %10s %10.3f %10.3f %10i %12.1f" % (nr_halfedges, name, write_time, read_time, nr_objects, size / 1024))
+
+
+if __name__ == "__main__":
+    main()
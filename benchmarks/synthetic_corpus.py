@@ -0,0 +1,135 @@
+"""
+Generate a corpus of synthetic STEP files from OCC primitives, so
+that the benchmarks need no downloaded data.
+
+Families:
+    box          a single box, 6 faces
+    fillet       a box with all 12 edges filleted, 26 faces
+    bspline      a prism over a wavy BSpline face, with BSpline and
+                 extrusion surfaces
+    assembly_N   N located instances of one filleted box
+    grid_N       one part of N/6 boxes, about N faces, used for the
+                 scaling curves
+
+    python benchmarks/synthetic_corpus.py corpus --faces 10 100 1000 10000 100000
+"""
+import argparse
+import math
+import os
+
+from OCC.Core.BRep import BRep_Builder
+from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_MakeFace
+from OCC.Core.BRepFilletAPI import BRepFilletAPI_MakeFillet
+from OCC.Core.BRepPrimAPI import BRepPrimAPI_MakeBox, BRepPrimAPI_MakePrism
+from OCC.Core.GeomAPI import GeomAPI_PointsToBSplineSurface
+from OCC.Core.IFSelect import IFSelect_RetDone
+from OCC.Core.STEPControl import STEPControl_Writer, STEPControl_AsIs
+from OCC.Core.TColgp import TColgp_Array2OfPnt
+from OCC.Core.TopAbs import TopAbs_EDGE
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopLoc import TopLoc_Location
+from OCC.Core.TopoDS import TopoDS_Compound, topods
+from OCC.Core.gp import gp_Pnt, gp_Trsf, gp_Vec
+
+
+def make_box(size=1.0, origin=(0.0, 0.0, 0.0)):
+    return BRepPrimAPI_MakeBox(gp_Pnt(*origin), size, size, size).Shape()
+
+
+def make_filleted_box(size=1.0, radius=0.1):
+    box = make_box(size)
+    fillet = BRepFilletAPI_MakeFillet(box)
+    explorer = TopExp_Explorer(box, TopAbs_EDGE)
+    while explorer.More():
+        fillet.Add(radius, topods.Edge(explorer.Current()))
+        explorer.Next()
+    return fillet.Shape()
+
+
+def make_bspline_prism(resolution=12, height=0.5):
+    points = TColgp_Array2OfPnt(1, resolution, 1, resolution)
+    for i in range(resolution):
+        for j in range(resolution):
+            u = i / (resolution - 1)
+            v = j / (resolution - 1)
+            points.SetValue(i + 1, j + 1, gp_Pnt(u, v, 0.1 * math.sin(4 * u) * math.cos(3 * v)))
+    surface = GeomAPI_PointsToBSplineSurface(points).Surface()
+    face = BRepBuilderAPI_MakeFace(surface, 1e-6).Face()
+    return BRepPrimAPI_MakePrism(face, gp_Vec(0.0, 0.0, height)).Shape()
+
+
+def make_compound(shapes):
+    builder = BRep_Builder()
+    compound = TopoDS_Compound()
+    builder.MakeCompound(compound)
+    for shape in shapes:
+        builder.Add(compound, shape)
+    return compound
+
+
+def make_assembly(nr_instances, spacing=1.5):
+    """
+    Instances share the geometry of one solid and differ in location
+    """
+    solid = make_filleted_box()
+    columns = max(1, int(math.ceil(math.sqrt(nr_instances))))
+    instances = []
+    for i in range(nr_instances):
+        trsf = gp_Trsf()
+        trsf.SetTranslation(gp_Vec(spacing * (i % columns), spacing * (i // columns), 0.0))
+        instances.append(solid.Moved(TopLoc_Location(trsf)))
+    return make_compound(instances)
+
+
+def make_box_grid(nr_faces, spacing=1.5):
+    """
+    One part of distinct boxes with about nr_faces faces in total
+    """
+    nr_boxes = max(1, nr_faces // 6)
+    columns = max(1, int(math.ceil(math.sqrt(nr_boxes))))
+    return make_compound([make_box(origin=(spacing * (i % columns), spacing * (i // columns), 0.0)) for i in range(nr_boxes)])
+
+
+def write_step(shape, path):
+    writer = STEPControl_Writer()
+    writer.Transfer(shape, STEPControl_AsIs)
+    if writer.Write(str(path)) != IFSelect_RetDone:
+        raise RuntimeError("Writing %s failed" % path)
+
+
+def generate_corpus(directory, faces=(10, 100, 1000, 10000), instances=(10, 100)):
+    """
+    Write the corpus into directory/<family>/<name>/<name>.step, the
+    layout the converter expects.  Returns {name: path}, files which
+    exist already are not written again
+    """
+    shapes = {"box": make_box, "fillet": make_filleted_box, "bspline": make_bspline_prism}
+    for n in instances:
+        shapes["assembly_%i" % n] = lambda n=n: make_assembly(n)
+    for n in faces:
+        shapes["grid_%i" % n] = lambda n=n: make_box_grid(n)
+
+    paths = {}
+    for name, make in shapes.items():
+        family = name.split("_")[0]
+        path = os.path.join(directory, family, name, "%s.step" % name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_step(make(), path)
+        paths[name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic STEP corpus.")
+    parser.add_argument("directory")
+    parser.add_argument("--faces", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument("--instances", type=int, nargs="+", default=[10, 100])
+    args = parser.parse_args()
+
+    for name, path in generate_corpus(args.directory, args.faces, args.instances).items():
+        print("%-16s %s" % (name, path))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
-from steptohdf5.processing import process_step_files
+from steptohdf5.processing import iter_process_step_files, iter_process_queue
+from steptohdf5.work_queue import WorkQueue, default_owner
+from steptohdf5.worker_pool import WorkerLimits
+from steptohdf5.content_cache import ContentCache
+from steptohdf5.utils.timing import TimingReport
 import argparse
 
 
@@ -9,19 +13,125 @@ def main():
         parser.add_argument("--output", help="Path to the directory where results will be saved.")
         parser.add_argument("--log", help="Path to the directory where logs will be saved.")
         parser.add_argument("--hdf5_file", help="Path to the HDF5 file where results will be saved.")
+        parser.add_argument("--topology_layout", default="groups", choices=["groups", "columnar"],
+                            help="Store topology as one group per entity or as columnar CSR tables.")
+        parser.add_argument("--geometry_layout", default="groups", choices=["groups", "columnar"],
+                            help="Store geometry as one group per surface and curve or as one table per type.")
+        parser.add_argument("--mesh_layout", default=None, choices=["faces", "concatenated"],
+                            help="Store one mesh group per face or one concatenated mesh per part, "
+                                 "faces by default and that of the output with --remesh.")
+        parser.add_argument("--mesh_deflection", type=float, nargs="+", default=[1e-3],
+                            help="Linear deflection of the meshes relative to the largest side of the part bounding box, "
+                                 "several values write levels of detail.")
+        parser.add_argument("--triangle_budget", type=int, default=None,
+                            help="Raise the deflection of parts whose mesh would have more triangles than this.")
+        parser.add_argument("--remesh", action="store_true",
+                            help="Only replace the meshes of existing outputs, keeping their topology and geometry.")
+        parser.add_argument("--compression", default=None, choices=["none", "gzip9", "default", "fast", "zstd"],
+                            help="Compression policy for the HDF5 datasets, fast and zstd need hdf5plugin, "
+                                 "default by default and that of the output with --remesh.")
+        parser.add_argument("--validation", default="off", choices=["off", "fast", "full"],
+                            help="Run no loop checks, the cheap ones or all of them and store the results per loop.")
+        parser.add_argument("--shard_size", type=float, default=None,
+                            help="Pack the outputs into shard files of about this many GB, written by one process.")
+        parser.add_argument("--cpus", type=int, default=None,
+                            help="Number of CPUs shared by worker processes and meshing threads, all by default.")
+        parser.add_argument("--n_jobs", type=int, default=None,
+                            help="Maximum number of worker processes, one per CPU of the budget by default.")
+        parser.add_argument("--part_jobs", type=int, default=1,
+                            help="Process the parts of each file in this many worker processes, which count against "
+                                 "--cpus. Has no effect with --timeout, --max_rss or --max_files_per_worker.")
+        parser.add_argument("--timeout", type=float, default=None,
+                            help="Kill a worker when converting one file takes longer than this many seconds.")
+        parser.add_argument("--max_rss", type=float, default=None,
+                            help="Kill a worker when its resident memory exceeds this many MB.")
+        parser.add_argument("--max_files_per_worker", type=int, default=None,
+                            help="Replace each worker by a fresh process after this many files.")
+        parser.add_argument("--resume", action="store_true",
+                            help="Skip files with an up to date output or a recorded failure from a previous run.")
+        parser.add_argument("--retry_failed", action="store_true",
+                            help="With --resume, convert files which failed in a previous run again.")
+        parser.add_argument("--content_hash", action="store_true",
+                            help="Identify inputs by a hash of their content instead of their size and mtime.")
+        parser.add_argument("--cache_dir", default=None,
+                            help="Directory of a content addressed cache, identical inputs are converted once.")
+        parser.add_argument("--shape_cache_dir", default=None,
+                            help="Directory of a cache of the shapes transferred from the STEP files in BRep format.")
+        parser.add_argument("--manifest", default=None,
+                            help="JSONL file to which each result is appended as it completes, <input>manifest.jsonl by default.")
+        parser.add_argument("--queue", default=None,
+                            help="SQLite work queue shared by several tasks, files from --input are added to it.")
+        parser.add_argument("--lease_time", type=float, default=3600.0,
+                            help="Seconds after which files claimed by a dead task are handed out again.")
+        parser.add_argument("--max_attempts", type=int, default=3,
+                            help="Number of times a file of the work queue is tried before it is marked failed.")
+        parser.add_argument("--timing_report", action="store_true",
+                            help="Print the time spent per stage and per surface and curve type at the end.")
         args = parser.parse_args()
 
-        success, failed = process_step_files(args.input, args.output, args.log)
-        print(f"Successful conversions: {success}")
-        print(f"Failed conversions: {failed}")
+        options = {"topology_layout": args.topology_layout, "geometry_layout": args.geometry_layout,
+                   "validation": args.validation,
+                   "mesh_deflection": args.mesh_deflection[0] if len(args.mesh_deflection) == 1 else args.mesh_deflection,
+                   "triangle_budget": args.triangle_budget, "remesh": args.remesh,
+                   "content_hash": args.content_hash,
+                   "part_jobs": args.part_jobs, "shape_cache": args.shape_cache_dir,
+                   "shard_size": None if args.shard_size is None else int(args.shard_size * 1024**3)}
+        # Re-meshing keeps the mesh layout and compression of the output unless given
+        if args.mesh_layout is not None or not args.remesh:
+            options["mesh_layout"] = args.mesh_layout if args.mesh_layout is not None else "faces"
+        if args.compression is not None or not args.remesh:
+            options["compression"] = args.compression if args.compression is not None else "default"
+        worker_limits = None
+        if args.timeout is not None or args.max_rss is not None or args.max_files_per_worker is not None:
+            max_rss = None if args.max_rss is None else int(args.max_rss * 1024**2)
+            worker_limits = WorkerLimits(args.timeout, max_rss, args.max_files_per_worker)
 
-        with open(args.input + 'success.txt', 'w') as f:
-            for item in success:
-                f.write(str(item) + "\n")
+        cache = None if args.cache_dir is None else ContentCache(args.cache_dir)
 
-        with open(args.input + 'failed.txt', 'w') as f:
-            for item in failed:
-                f.write(str(item) + "\n")
+        # Result files are named after the input list, or after the queue
+        # and this task, as many tasks share a queue
+        if args.queue is not None:
+            prefix = "%s.%s." % (args.queue, default_owner())
+        else:
+            prefix = args.input
+        manifest = args.manifest if args.manifest is not None else prefix + 'manifest.jsonl'
+        if args.queue is not None:
+            queue = WorkQueue(args.queue, lease_time=args.lease_time, max_attempts=args.max_attempts)
+            if args.input is not None:
+                with open(args.input, 'r') as f:
+                    queue.add(line.strip() for line in f if line.strip())
+            results = iter_process_queue(queue, args.output, args.log, options=options,
+                                         cpu_budget=args.cpus, worker_limits=worker_limits,
+                                         resume=args.resume, cache=cache, manifest=manifest, n_jobs=args.n_jobs)
+        else:
+            results = iter_process_step_files(args.input, args.output, args.log, options=options,
+                                              cpu_budget=args.cpus, worker_limits=worker_limits,
+                                              resume=args.resume, retry_failed=args.retry_failed, cache=cache,
+                                              manifest=manifest, n_jobs=args.n_jobs)
+
+        # Write the results as they complete, so that a killed run keeps its bookkeeping
+        nr_success = 0
+        nr_failed = 0
+        timing_report = TimingReport()
+        with open(prefix + 'success.txt', 'w') as success_file, open(prefix + 'failed.txt', 'w') as failed_file:
+            for sf, error, failure_kind, info in results:
+                if info is not None:
+                    timing_report.add(info.get("timings"))
+                if error is None:
+                    nr_success += 1
+                    success_file.write(str(sf) + "\n")
+                    success_file.flush()
+                else:
+                    nr_failed += 1
+                    failed_file.write(str((sf, error, failure_kind)) + "\n")
+                    failed_file.flush()
+
+        print(f"Successful conversions: {nr_success}")
+        print(f"Failed conversions: {nr_failed}, see {prefix + 'failed.txt'}")
+        if cache is not None:
+            print(cache.summary())
+        if args.timing_report:
+            print(timing_report.format())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from .core.provenance import converter_version, conversion_options, file_hash, hdf5_output_path
+from .worker_pool import FAILURE_ERROR
+
+
+def link_or_copy(source, target):
+    """
+    Hardlink source to target, copying where hardlinks are not possible,
+    e.g. across file systems.  The target is replaced atomically
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(".%s.%i.tmp" % (target.name, os.getpid()))
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class ContentCache:
+    """
+    Cache of HDF5 outputs keyed on the content of the STEP file and the
+    conversion options.  Identical inputs under different paths are
+    converted once, the other outputs are hardlinks or copies.  Since
+    outputs are replaced by renaming, never rewritten in place, the
+    cached files stay valid when an output is converted again
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = {}
+        self.keys = {}
+
+    def key(self, step_file, options):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(file_hash(step_file).encode("utf-8"))
+        digest.update(conversion_options(**options).encode("utf-8"))
+        digest.update(converter_version().encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / key[:2] / ("%s.hdf5" % key)
+
+    def partition(self, step_files, output_dir, options):
+        """
+        Link the outputs of files found in the cache and group the others
+        by key.  Returns the files to convert, one per key, and
+        (file, None, None) for the cache hits
+        """
+        pending = []
+        hits = []
+        first_of_key = {}
+        for sf in step_files:
+            try:
+                key = self.key(sf, options)
+            except OSError:
+                pending.append(sf)
+                continue
+            if self.path(key).exists():
+                try:
+                    link_or_copy(self.path(key), hdf5_output_path(sf, output_dir))
+                    self.hits += 1
+                    hits.append((sf, None, None))
+                    continue
+                except OSError:
+                    pass
+            if key in first_of_key:
+                self.hits += 1
+                self.duplicates[first_of_key[key]].append(sf)
+                continue
+            self.misses += 1
+            first_of_key[key] = sf
+            self.keys[sf] = key
+            self.duplicates[sf] = []
+            pending.append(sf)
+        return pending, hits
+
+    def finish(self, step_file, output_dir, error, failure_kind):
+        """
+        Store the output of a converted file and link it for the files
+        with the same key.  Returns (file, error message, failure kind)
+        for these, they share the outcome of the converted file
+        """
+        key = self.keys.pop(step_file, None)
+        duplicates = self.duplicates.pop(step_file, [])
+        if key is None:
+            return []
+        if error is None:
+            hdf5_path = hdf5_output_path(step_file, output_dir)
+            if hdf5_path.exists():
+                try:
+                    link_or_copy(hdf5_path, self.path(key))
+                    for sf in duplicates:
+                        link_or_copy(hdf5_path, hdf5_output_path(sf, output_dir))
+                except OSError as e:
+                    return [(sf, "Could not link cached output: %s" % e, FAILURE_ERROR) for sf in duplicates]
+        return [(sf, error, failure_kind) for sf in duplicates]
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+    def summary(self):
+        return "Content cache: %i hits, %i misses (%.1f%% hit rate)" % (self.hits, self.misses, 100 * self.hit_rate())
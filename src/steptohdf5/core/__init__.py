@@ -1,3 +1,11 @@
-from .step_processor import StepProcessor
+__all__ = ["StepProcessor"]
 
-__all__ = ["StepProcessor"]
\ No newline at end of file
+
+def __getattr__(name):
+    # StepProcessor needs OCC, it is only imported when asked for so
+    # that the provenance, compression and HDF5 writing helpers, and
+    # the reader through them, work without it
+    if name == "StepProcessor":
+        from .step_processor import StepProcessor
+        return StepProcessor
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,96 @@
+import numpy as np
+
+# Faster codecs (LZ4, Zstd) are only available with hdf5plugin,
+# without it the policies fall back to the built-in gzip filter
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+class CompressionPolicy:
+    """
+    Decides the HDF5 filter and chunk options of a dataset from its
+    dtype and size.  Datasets smaller than min_size bytes are stored
+    uncompressed, since filters cost more than they save on them.
+    """
+    def __init__(self, codec="gzip", level=4, shuffle=True, min_size=4096, chunk_size=1 << 20):
+        """
+        codec is one of "none", "gzip", "lz4" or "zstd", chunk_size
+        is the target size of a chunk in bytes
+        """
+        if codec not in ("none", "gzip", "lz4", "zstd"):
+            raise ValueError("Unknown compression codec: %s"%codec)
+        if codec in ("lz4", "zstd") and hdf5plugin is None:
+            codec = "gzip"
+        self.codec = codec
+        self.level = level
+        self.shuffle = shuffle
+        self.min_size = min_size
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        # Recorded in the conversion options, so it must not depend on the process
+        return "CompressionPolicy(codec=%r, level=%r, shuffle=%r, min_size=%r, chunk_size=%r)" % (
+            self.codec, self.level, self.shuffle, self.min_size, self.chunk_size)
+
+    def dataset_options(self, data):
+        """
+        Keyword arguments for h5py create_dataset
+        """
+        if self.codec == "none" or not isinstance(data, np.ndarray):
+            return {}
+        if data.ndim == 0 or data.size == 0 or data.dtype.kind not in "biuf":
+            return {}
+        if data.nbytes < self.min_size:
+            return {}
+
+        # Only multi byte types gain from reordering the bytes
+        shuffle = self.shuffle and data.dtype.itemsize > 1
+        options = {"chunks": self.chunk_shape(data)}
+        if self.codec == "gzip":
+            options.update(compression="gzip", compression_opts=self.level, shuffle=shuffle)
+        else:
+            blosc_shuffle = hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE
+            options.update(hdf5plugin.Blosc(cname=self.codec, clevel=self.level, shuffle=blosc_shuffle))
+        return options
+
+    def chunk_shape(self, data):
+        """
+        Chunk along the first axis, keeping whole rows, so that a
+        chunk holds about chunk_size bytes
+        """
+        row_bytes = data.nbytes // data.shape[0]
+        rows = min(data.shape[0], max(1, self.chunk_size // max(row_bytes, 1)))
+        return (rows,) + data.shape[1:]
+
+
+# Named policies, selectable from the command line
+compression_policies = {
+    "none": CompressionPolicy(codec="none"),
+    "gzip9": CompressionPolicy(codec="gzip", level=9, shuffle=False, min_size=0),
+    "default": CompressionPolicy(codec="gzip", level=4),
+    "fast": CompressionPolicy(codec="lz4", level=5),
+    "zstd": CompressionPolicy(codec="zstd", level=5)
+}
+
+
+def get_compression_policy(policy):
+    """
+    Return the policy for a name, policies are passed through
+    """
+    if policy is None or isinstance(policy, CompressionPolicy):
+        return policy
+    if not policy in compression_policies:
+        raise ValueError("Unknown compression policy: %s"%policy)
+    return compression_policies[policy]
+
+
+def create_dataset(group, name, data, policy=None):
+    """
+    Create a dataset with the filters chosen by the policy.  Without
+    a policy, and for scalars and strings, it is stored uncompressed
+    """
+    if policy is None or not isinstance(data, np.ndarray):
+        return group.create_dataset(name, data=data)
+    return group.create_dataset(name, data=data, **policy.dataset_options(data))
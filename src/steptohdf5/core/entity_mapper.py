@@ -1,5 +1,4 @@
 # PythonOCC
-from OCC.Extend.TopologyUtils import TopologyExplorer
 from OCC.Core.TopoDS import TopoDS_Shape
 
 
@@ -46,20 +45,20 @@ class EntityMapper:
             bodies = [bodies]
 
         for body in bodies:
-            top_exp = TopologyExplorer(body)
+            faces = unique_subshapes(body, TopAbs_FACE)
 
             # Build the index lookup tables
             self.append_body(body)
-            self.append_solids(top_exp)
-            self.append_shells(top_exp)
-            self.append_faces(top_exp)
-            self.append_loops(top_exp)
-            self.append_edges(top_exp)
-            self.append_halfedges(body)
-            self.append_vertices(top_exp)
+            self.append_solids(unique_subshapes(body, TopAbs_SOLID))
+            self.append_shells(unique_subshapes(body, TopAbs_SHELL))
+            self.append_faces(faces)
+            self.append_loops(unique_subshapes(body, TopAbs_WIRE))
+            self.append_edges(unique_subshapes(body, TopAbs_EDGE))
+            self.append_halfedges(unique_subshapes(body, TopAbs_EDGE, ignore_orientation=False))
+            self.append_vertices(unique_subshapes(body, TopAbs_VERTEX))
 
             # Build the orientations of the primary faces
-            self.build_primary_face_orientations_map(top_exp)
+            self.build_primary_face_orientations_map(faces)
 
 
     # The following functions are the interface for 
@@ -153,8 +152,7 @@ class EntityMapper:
         assert not h in self.body_map
         self.body_map[h] = index
 
-    def append_solids(self, top_exp):
-        solids = top_exp.solids()
+    def append_solids(self, solids):
         for solid in solids:
             self.append_solid(solid)
 
@@ -164,8 +162,7 @@ class EntityMapper:
         assert not h in self.solid_map
         self.solid_map[h] = index
 
-    def append_shells(self, top_exp):
-        shells = top_exp.shells()
+    def append_shells(self, shells):
         for shell in shells:
             self.append_shell(shell)
 
@@ -175,8 +172,7 @@ class EntityMapper:
         assert not h in self.shell_map
         self.shell_map[h] = index
 
-    def append_faces(self, top_exp):
-        faces = top_exp.faces()
+    def append_faces(self, faces):
         for face in faces:
             self.append_face(face)
 
@@ -186,8 +182,7 @@ class EntityMapper:
         assert not h in self.face_map
         self.face_map[h] = index
 
-    def append_loops(self, top_exp):
-        loops = top_exp.wires()
+    def append_loops(self, loops):
         for loop in loops:
             self.append_loop(loop)
 
@@ -197,8 +192,7 @@ class EntityMapper:
         assert not h in self.loop_map
         self.loop_map[h] = index
 
-    def append_edges(self, top_exp):
-        edges = top_exp.edges()
+    def append_edges(self, edges):
         for edge in edges:
             self.append_edge(edge)
 
@@ -208,9 +202,7 @@ class EntityMapper:
         assert not h in self.edge_map
         self.edge_map[h] = index
 
-    def append_halfedges(self, body):
-        oriented_top_exp = TopologyExplorer(body, ignore_orientation=False)
-        halfedges = oriented_top_exp.edges()
+    def append_halfedges(self, halfedges):
         for halfedge in halfedges:
             self.append_halfedge(halfedge)
 
@@ -222,8 +214,7 @@ class EntityMapper:
         if not tup in self.halfedge_map:
             self.halfedge_map[tup] = index
 
-    def append_vertices(self, top_exp):
-        vertices = top_exp.vertices()
+    def append_vertices(self, vertices):
         for vertex in vertices:
             self.append_vertex(vertex)
 
@@ -233,8 +224,7 @@ class EntityMapper:
         assert not h in self.vertex_map
         self.vertex_map[h] = index
 
-    def build_primary_face_orientations_map(self, top_exp):
-        faces = top_exp.faces()
+    def build_primary_face_orientations_map(self, faces):
         for face in faces:
             self.append_primary_face(face)
 
@@ -1,6 +1,5 @@
 
 # Python OCC
-from OCC.Extend.TopologyUtils import TopologyExplorer, WireExplorer
 from OCC.Core.TopExp import topexp
 from OCC.Core.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
                              TopAbs_SHELL, TopAbs_SOLID, TopAbs_COMPOUND,
@@ -12,18 +11,39 @@ from OCC.Core.TopoDS import TopoDS_Shape
 
 # CAD
 from ..utils.geometry import get_boundingbox, convert_3dcurve, convert_2dcurve, convert_surface, convert_vec_to_list
+from .topology_graph import topology_graph_for
+import time
 
 class GeometryDictBuilder:
     """
     A class which builds a python dictionary
     ready for export to the geometry file
     """
-    def __init__(self, entity_mapper):
+    def __init__(self, entity_mapper, topology_graph=None, timer=None):
         """
         Construct from the entity mapper which gives
-        us a mapping between entities
+        us a mapping between entities.  The topology
+        graph of the part is built on demand if not given.
+        A StageTimer collects the conversion time per
+        surface and curve type.  The vertex order of the
+        edges is only checked with full validation, by the
+        "vertex_order" check of TopologyDictBuilder.check_loop
         """
         self.entity_mapper = entity_mapper
+        self.topology_graph = topology_graph
+        self.timer = timer
+
+    def timed_convert(self, kind, convert, *args):
+        if self.timer is None:
+            return convert(*args)
+        start = time.perf_counter()
+        data = convert(*args)
+        self.timer.add_entity(kind, data["type"], time.perf_counter() - start)
+        return data
+
+    def get_topology_graph(self, part):
+        self.topology_graph = topology_graph_for(part, self.topology_graph)
+        return self.topology_graph
 
 
     def build_dict_for_parts(self, parts, logger=None):
@@ -56,10 +76,8 @@ class GeometryDictBuilder:
     
     
     def build_vertices_array(self, part):
-        top_exp = TopologyExplorer(part)
-        nr_verts = top_exp.number_of_vertices()
-        part_vertices = [None]*nr_verts
-        verts = top_exp.vertices()
+        verts = self.get_topology_graph(part).vertices
+        part_vertices = [None]*len(verts)
         for vert in verts:
             expected_vert_index = self.entity_mapper.vertex_index(vert)
             #print(len(part_curves), expected_edge_index)
@@ -73,10 +91,8 @@ class GeometryDictBuilder:
         return convert_vec_to_list(BRep_Tool.Pnt(vertex))
 
     def build_3dcurves_array(self, part):
-        top_exp = TopologyExplorer(part)
-        nr_edges = top_exp.number_of_edges()
-        part_curves = [None]*nr_edges
-        edges = top_exp.edges()
+        edges = self.get_topology_graph(part).edges
+        part_curves = [None]*len(edges)
         for edge in edges:
             expected_edge_index = self.entity_mapper.edge_index(edge)
             #print(len(part_curves), expected_edge_index)
@@ -87,26 +103,20 @@ class GeometryDictBuilder:
         return part_curves
     
     def build_3dcurve_data(self, edge):
-        # Check this actually gets the vertex order correct
-        start_vertex = topexp.FirstVertex(edge)
-        end_vertex = topexp.LastVertex(edge)
-        self.debug_check_correct_vertex_order(edge, start_vertex, end_vertex)
-        curve = convert_3dcurve(edge)
+        curve = self.timed_convert("3dcurve", convert_3dcurve, edge)
         return curve
 
     def build_surfaces_and_2dcurves(self, part):
-        top_exp = TopologyExplorer(part, ignore_orientation=False)
-        nr_faces = top_exp.number_of_faces()
-        part_surfaces = [None]*nr_faces
+        graph = self.get_topology_graph(part)
+        part_surfaces = [None]*len(graph.faces)
         part_2dcurves_dict = {}
 
         # Iterate over faces
-        faces = top_exp.faces()
-        for face in faces:
+        for face_position, face in enumerate(graph.faces):
             expected_face_index = self.entity_mapper.face_index(face)
             assert expected_face_index >= 0 and expected_face_index < len(part_surfaces)
             assert part_surfaces[expected_face_index] == None
-            part_surfaces[expected_face_index] = convert_surface(face)
+            part_surfaces[expected_face_index] = self.timed_convert("surface", convert_surface, face)
             
 #             # TODO add proper meshing code
 #             verts, tris, _, _, _ = process_face(expected_face_index, face)
@@ -114,11 +124,11 @@ class GeometryDictBuilder:
 #             igl.write_triangle_mesh("%s/%s_%03i_mesh_%04i.obj"%(res_path, fil, occ_cnt, fci), np.array(verts), np.array(faces))
 
             # Iterate over edges in face
-            edges = top_exp.edges_from_face(face)
+            edges = graph.halfedges_of_face(face_position)
             for edge in edges:                  
                 expected_halfedge_index = self.entity_mapper.halfedge_index(edge)
 #                assert expected_halfedge_index not in part_2dcurves_dict
-                part_2dcurves_dict[expected_halfedge_index] = convert_2dcurve(edge, face)
+                part_2dcurves_dict[expected_halfedge_index] = self.timed_convert("2dcurve", convert_2dcurve, edge, face)
 
 
         part_2dcurves = []
@@ -4,51 +4,285 @@ import os
 from pathlib import Path
 import numpy as np
 
+from .compression import create_dataset
 
 
+# Format version written to the "parts" group.  Files written with the
+# per-entity group layout keep version 2.0, columnar tables or
+# concatenated meshes bump it to 3.0 so that older readers know they
+# can not walk the numbered groups
+LEGACY_FORMAT_VERSION = "2.0"
+COLUMNAR_FORMAT_VERSION = "3.0"
 
-def convert_dict_to_hdf5(data, group):
+
+def format_version(topology_layout="groups", mesh_layout="faces", geometry_layout="groups", mesh_lods=False):
+    """
+    The format version of a file written with these layouts, and with
+    meshes at several levels of detail if mesh_lods is set
+    """
+    if topology_layout == "groups" and mesh_layout == "faces" and geometry_layout == "groups" and not mesh_lods:
+        return LEGACY_FORMAT_VERSION
+    return COLUMNAR_FORMAT_VERSION
+
+
+def convert_dict_to_hdf5(data, group, policy=None):
     for key, value in data.items():
         if isinstance(value, dict):
             subgroup = group.create_group(key)
-            convert_dict_to_hdf5(value, subgroup)
+            convert_dict_to_hdf5(value, subgroup, policy)
         elif isinstance(value, list) and all(isinstance(item, dict) for item in value):
             if key == "faces" and all(
                     isinstance(item, dict) and "face_index" in item and "face_orientation_wrt_shell" in item for item in
                     value):
                 array_data = np.array([(item['face_index'], item['face_orientation_wrt_shell']) for item in value],
                                       dtype=[('face_index', int), ('face_orientation_wrt_shell', bool)])
-                group.create_dataset(key, data=array_data)
+                create_dataset(group, key, array_data, policy)
             else:
                 subgroup = group.create_group(key)
                 for i, item in enumerate(value):
                     if key == 'parts':
-                        convert_dict_to_hdf5(item, subgroup.create_group('part_' + str(i + 1).zfill(3)))
+                        convert_dict_to_hdf5(item, subgroup.create_group('part_' + str(i + 1).zfill(3)), policy)
                     else:
-                        convert_dict_to_hdf5(item, subgroup.create_group(str(i).zfill(3)))
+                        convert_dict_to_hdf5(item, subgroup.create_group(str(i).zfill(3)), policy)
         elif isinstance(value, list) and all(isinstance(item, (int, float)) for item in value):
             if key == "bbox" and len(value) == 6:
                 array_data = np.array(value).reshape((2, 3))
-                group.create_dataset(key, data=array_data)
+                create_dataset(group, key, array_data, policy)
             elif key == "trim_domain" and len(value) == 4:
                 array_data = np.array(value).reshape((2, 2))
-                group.create_dataset(key, data=array_data)
+                create_dataset(group, key, array_data, policy)
             else:
                 array_data = np.array(value)
-                group.create_dataset(key, data=array_data)
+                create_dataset(group, key, array_data, policy)
         elif isinstance(value, list):
             if key == "poles" or key == "vertices":
                 array_data = np.array(value)
-                group.create_dataset(key, data=array_data)
+                create_dataset(group, key, array_data, policy)
             else:
                 subgroup = group.create_group(key)
                 for i, item in enumerate(value):
-                    subgroup.create_dataset(str(i), data=np.array(item))
+                    create_dataset(subgroup, str(i), np.array(item), policy)
+        elif isinstance(value, np.ndarray) and value.ndim == 2 and key == "weights":
+            # Surface weights are stored one row per dataset, as they were
+            # when the converters still returned nested lists
+            subgroup = group.create_group(key)
+            for i, item in enumerate(value):
+                create_dataset(subgroup, str(i), item, policy)
         elif isinstance(value, np.ndarray) and value.shape == (3,4):
             array_data = value.astype(np.float64)
-            group.create_dataset(key, data=array_data)
+            create_dataset(group, key, array_data, policy)
         else:
-            group.create_dataset(key, data=value)
+            create_dataset(group, key, value, policy)
+
+
+def is_scalar(value):
+    return isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating))
+
+
+def is_face_use_list(value):
+    return all(isinstance(item, dict) and "face_index" in item and "face_orientation_wrt_shell" in item for item in value)
+
+
+def create_csr_datasets(rows, group, policy=None):
+    """
+    Store a list of lists as one flat values array and the offsets
+    at which each list starts, so row i is values[offsets[i]:offsets[i+1]]
+    """
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    flat = [item for row in rows for item in row]
+    if len(flat) > 0 and all(isinstance(item, dict) for item in flat):
+        if is_face_use_list(flat):
+            values = np.array([(item['face_index'], item['face_orientation_wrt_shell']) for item in flat],
+                              dtype=[('face_index', int), ('face_orientation_wrt_shell', bool)])
+            create_dataset(group, "values", values, policy)
+        else:
+            convert_table_to_columnar_hdf5(flat, group.create_group("values"), policy)
+    else:
+        values = np.array(flat) if len(flat) > 0 else np.zeros(0, dtype=np.int64)
+        create_dataset(group, "values", values, policy)
+    create_dataset(group, "offsets", offsets, policy)
+
+
+def convert_table_to_columnar_hdf5(rows, group, policy=None):
+    """
+    Write a list of dictionaries sharing the same keys as one dataset
+    per key.  Scalars become flat typed arrays, lists become CSR
+    values/offsets pairs
+    """
+    group.attrs["count"] = len(rows)
+    if len(rows) == 0:
+        return
+    for key in rows[0].keys():
+        column = [row[key] for row in rows]
+        if all(is_scalar(item) for item in column):
+            create_dataset(group, key, np.array(column), policy)
+        elif all(isinstance(item, list) for item in column):
+            create_csr_datasets(column, group.create_group(key), policy)
+        else:
+            subgroup = group.create_group(key)
+            for i, item in enumerate(column):
+                create_dataset(subgroup, str(i).zfill(3), np.array(item), policy)
+
+
+def convert_topology_to_columnar_hdf5(data, group, policy=None):
+    """
+    Write a topology dictionary with one columnar table per entity
+    type (faces, loops, edges, ...) instead of one group per entity
+    """
+    group.attrs["layout"] = "columnar"
+    for key, value in data.items():
+        convert_table_to_columnar_hdf5(value, group.create_group(key), policy)
+
+
+# Geometry fields of variable length, stored as ragged arrays
+RAGGED_GEOMETRY_KEYS = ("poles", "knots", "u_knots", "v_knots", "weights")
+
+
+def create_ragged_datasets(arrays, group, policy=None):
+    """
+    Store arrays of varying shape as one flat values array, the offsets
+    at which each array starts and the shape of each array, so row i is
+    values[offsets[i]:offsets[i+1]].reshape(shapes[i])
+    """
+    arrays = [np.asarray(array, dtype=np.float64) for array in arrays]
+    ndim = max((array.ndim for array in arrays), default=1)
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([array.size for array in arrays], out=offsets[1:])
+    shapes = np.array([array.shape for array in arrays], dtype=np.int64).reshape(len(arrays), ndim)
+    values = np.concatenate([array.reshape(-1) for array in arrays]) if arrays else np.zeros(0)
+    create_dataset(group, "values", values, policy)
+    create_dataset(group, "offsets", offsets, policy)
+    create_dataset(group, "shapes", shapes, policy)
+
+
+def convert_entities_to_columnar_hdf5(entities, group, policy=None):
+    """
+    Write a list of geometric entities (surfaces or curves) with one
+    table per type.  index holds the (type, row) of each entity, where
+    type indexes the types attribute and row the table of that type.
+    Fixed size fields of a type are one structured array data, ragged
+    fields such as poles and knots CSR values/offsets/shapes groups and
+    nested entities (the curve of a revolution surface, the basis of an
+    offset surface) tables of their own
+    """
+    types = []
+    rows = {}
+    index = np.zeros(len(entities), dtype=[("type", np.uint8), ("row", np.int64)])
+    for i, entity in enumerate(entities):
+        entity_type = entity["type"]
+        if entity_type not in rows:
+            types.append(entity_type)
+            rows[entity_type] = []
+        index[i] = (types.index(entity_type), len(rows[entity_type]))
+        rows[entity_type].append(entity)
+
+    group.attrs["layout"] = "columnar"
+    group.attrs["types"] = np.array(types, dtype=h5py.string_dtype())
+    create_dataset(group, "index", index, policy)
+    for entity_type in types:
+        convert_entity_table_to_hdf5(rows[entity_type], group.create_group(entity_type.lower()), policy)
+
+
+def convert_entity_table_to_hdf5(rows, group, policy=None):
+    """
+    Write entities of one type, which share the same keys
+    """
+    group.attrs["count"] = len(rows)
+    fields = []
+    for key in rows[0].keys():
+        if key == "type":
+            continue
+        column = [row[key] for row in rows]
+        if key in RAGGED_GEOMETRY_KEYS:
+            create_ragged_datasets(column, group.create_group(key), policy)
+        elif isinstance(column[0], dict):
+            convert_entities_to_columnar_hdf5(column, group.create_group(key), policy)
+        else:
+            array = np.array(column)
+            if array.dtype == object:
+                array = array.astype(np.float64)
+            fields.append((key, array))
+
+    data = np.zeros(len(rows), dtype=[(key, array.dtype, array.shape[1:]) for key, array in fields])
+    for key, array in fields:
+        data[key] = array
+    create_dataset(group, "data", data, policy)
+
+
+def convert_geometry_to_columnar_hdf5(data, group, policy=None):
+    """
+    Write a geometry dictionary with one table per surface and curve
+    type instead of one group per entity.  bbox and vertices are
+    written as in convert_dict_to_hdf5
+    """
+    group.attrs["layout"] = "columnar"
+    for key, value in data.items():
+        if key in ("surfaces", "3dcurves", "2dcurves"):
+            convert_entities_to_columnar_hdf5(value, group.create_group(key), policy)
+        else:
+            convert_dict_to_hdf5({key: value}, group, policy)
+
+
+def convert_meshes_to_hdf5(meshes, group, policy=None):
+    """
+    Write the mesh of every face as its own numbered group
+    """
+    for index, mesh in enumerate(meshes):
+        mesh_subgroup = group.create_group(str(index).zfill(3))
+        create_dataset(mesh_subgroup, 'points', mesh["vertices"], policy)
+        create_dataset(mesh_subgroup, 'triangle', mesh["faces"], policy)
+
+
+def convert_meshes_to_concatenated_hdf5(meshes, group, policy=None):
+    """
+    Write the meshes of all faces as one points and one triangle array.
+    The triangles of face i are triangle[face_triangle_offsets[i]:face_triangle_offsets[i+1]]
+    and index into points, where the vertices of face i start at
+    face_vertex_offsets[i]
+    """
+    points = [np.asarray(mesh["vertices"], dtype=np.float64).reshape(-1, 3) for mesh in meshes]
+    triangles = [np.asarray(mesh["faces"], dtype=np.int64).reshape(-1, 3) for mesh in meshes]
+
+    face_vertex_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in points], out=face_vertex_offsets[1:])
+    face_triangle_offsets = np.zeros(len(meshes) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in triangles], out=face_triangle_offsets[1:])
+
+    # Shift the face local vertex indices to indices into the part points
+    triangles = [t + offset for t, offset in zip(triangles, face_vertex_offsets)]
+
+    group.attrs["layout"] = "concatenated"
+    create_dataset(group, 'points', np.concatenate(points) if points else np.zeros((0, 3)), policy)
+    create_dataset(group, 'triangle', np.concatenate(triangles) if triangles else np.zeros((0, 3), dtype=np.int64), policy)
+    create_dataset(group, 'face_vertex_offsets', face_vertex_offsets, policy)
+    create_dataset(group, 'face_triangle_offsets', face_triangle_offsets, policy)
+
+
+def convert_mesh_lods_to_hdf5(levels, group, mesh_layout="faces", policy=None):
+    """
+    Write meshes at several levels of detail as groups lod_0 (coarsest)
+    to lod_N, each in the given mesh layout.  levels holds dicts with
+    the relative and linear deflection of the level and its meshes
+    """
+    group.attrs["lods"] = len(levels)
+    for i, level in enumerate(levels):
+        lod_group = group.create_group("lod_%i" % i)
+        if mesh_layout == "concatenated":
+            convert_meshes_to_concatenated_hdf5(level["meshes"], lod_group, policy)
+        else:
+            convert_meshes_to_hdf5(level["meshes"], lod_group, policy)
+        write_mesh_parameters(level, lod_group)
+
+
+def write_mesh_parameters(level, group):
+    """
+    Store the parameters of a mesh level, e.g. its deflections and
+    triangle budget, as attributes of its group
+    """
+    for key, value in level.items():
+        if key != "meshes" and value is not None:
+            group.attrs[key] = value
 
 
 def convert_stat_to_hdf5(data, group):
@@ -1,4 +1,5 @@
-from OCC.Extend.TopologyUtils import TopologyExplorer, WireExplorer
+import itertools
+import math
 import numpy as np
 from OCC.Core.TopExp import topexp
 from OCC.Core.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
@@ -9,30 +10,188 @@ from OCC.Core.BRep import BRep_Tool
 from OCC.Core.TopoDS import TopoDS_Shape
 from OCC.Core.TopLoc import TopLoc_Location
 from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Core.BRepTools import breptools
 
+from .topology_graph import topology_graph_for
 
 
+# Angular deflection of the meshes in radians
+ANGULAR_DEFLECTION = 0.5
+
+# With a triangle budget, the pass estimating the number of triangles is
+# this much coarser than the requested deflection, the angular deflection
+# is raised up to MAX_ANGULAR_DEFLECTION and a mesh above the budget is
+# redone at most MAX_BUDGET_ATTEMPTS times
+BUDGET_PASS_FACTOR = 8.0
+MAX_ANGULAR_DEFLECTION = 1.0
+MAX_BUDGET_ATTEMPTS = 3
+
+
+def deflection_within_budget(pass_length, pass_triangles, length, angular, triangle_budget):
+    """
+    The number of triangles grows about inversely with the linear
+    deflection.  Estimate it at length from a pass at pass_length and
+    return the linear and angular deflection keeping the estimate within
+    the budget, and the estimate
+    """
+    estimate = pass_triangles * pass_length / length
+    if estimate <= triangle_budget:
+        return length, angular, estimate
+    factor = estimate / max(triangle_budget, 1)
+    return length * factor, min(MAX_ANGULAR_DEFLECTION, angular * math.sqrt(factor)), estimate
+
+
+def location_to_matrix(location):
+    """
+    The 3x4 matrix of the transformation of a TopLoc_Location
+    """
+    trsf = location.Transformation()
+    return np.array([[trsf.Value(i + 1, j + 1) for j in range(4)] for i in range(3)])
+
+
+def triangulation_to_arrays(mesh, location=None, reverse=False, first_vertex=0):
+    """
+    Copy the nodes and triangles of a Poly_Triangulation into NumPy
+    arrays in one pass each, without intermediate lists.  pythonocc
+    wraps no array view of the nodes and triangles, so this still
+    takes one call per node and per triangle.  The nodes are moved by
+    the location of the face, the triangles are zero based and flipped
+    if the face is reversed with respect to the surface normal
+    """
+    num_vertices = mesh.NbNodes()
+    coords = itertools.chain.from_iterable(mesh.Node(i).Coord() for i in range(1, num_vertices+1))
+    verts = np.fromiter(coords, dtype=np.float64, count=3*num_vertices).reshape(num_vertices, 3)
+    if location is not None and not location.IsIdentity():
+        matrix = location_to_matrix(location)
+        verts = verts @ matrix[:, :3].T + matrix[:, 3]
+
+    num_tris = mesh.NbTriangles()
+    indices = itertools.chain.from_iterable(mesh.Triangle(i).Get() for i in range(1, num_tris+1))
+    tris = np.fromiter(indices, dtype=np.int64, count=3*num_tris).reshape(num_tris, 3)
+    tris += first_vertex - 1
+    if reverse:
+        tris = np.ascontiguousarray(tris[:, ::-1])
+
+    return verts, tris
+
 
 class MeshBuilder:
-    def __init__(self, entity_mapper, logger):
+    def __init__(self, entity_mapper, logger, topology_graph=None):
         self.entity_mapper = entity_mapper
         self.logger = logger
+        self.topology_graph = topology_graph
+        # The deflections used by the last call, one dict per level
+        self.mesh_parameters = []
         
-    def create_surface_meshes(self, part, length):
-        top_exp = TopologyExplorer(part, ignore_orientation=False)
-        
-        mesh = BRepMesh_IncrementalMesh(part, length)
-        #mesh.SetParallel(True)
+    def create_surface_meshes(self, part, length, parallel=False, triangle_budget=None):
+        """
+        Mesh the part with the given linear deflection.  With parallel
+        set, BRepMesh meshes the faces on the OCC thread pool.
+        With a triangle_budget the part is first meshed BUDGET_PASS_FACTOR
+        times coarser, the number of triangles at length is estimated
+        from that pass and the linear and angular deflection are raised
+        as far as needed to stay within the budget, see
+        deflection_within_budget.  A mesh which still exceeds the budget
+        is redone with the measured count
+        """
+        self.topology_graph = topology_graph_for(part, self.topology_graph)
+        if triangle_budget is None:
+            self.__mesh_part(part, length, parallel)
+            self.mesh_parameters = [{"linear_deflection": length, "angular_deflection": ANGULAR_DEFLECTION}]
+            return self.__face_meshes()
+
+        # Start from the coarse pass, refined incrementally if it is within budget
+        breptools.Clean(part)
+        pass_length = length * BUDGET_PASS_FACTOR
+        self.__mesh_part(part, pass_length, parallel)
+        length, angular, estimate = deflection_within_budget(pass_length, self.count_triangles(), length,
+                                                             ANGULAR_DEFLECTION, triangle_budget)
+        length, angular, triangles = self.__mesh_within_budget(part, length, angular, parallel, triangle_budget)
+
+        self.mesh_parameters = [{"linear_deflection": length, "angular_deflection": angular, "triangle_budget": triangle_budget,
+                                 "estimated_triangles": estimate, "triangles": triangles}]
+        return self.__face_meshes()
+
+    def create_surface_mesh_lods(self, part, lengths, parallel=False, triangle_budget=None):
+        """
+        Mesh the part at several linear deflections in one pass, from
+        the coarsest to the finest.  BRepMesh_IncrementalMesh keeps the
+        triangulation of faces which is fine enough already and refines
+        the others, so each level starts from the previous one.  With a
+        triangle_budget the coarsest level serves to estimate the number
+        of triangles of the finer ones, whose deflections are raised to
+        stay within the budget, and every level is redone like in
+        create_surface_meshes while it exceeds the budget.  Returns the
+        meshes of each level, coarsest first
+        """
+        self.topology_graph = topology_graph_for(part, self.topology_graph)
+        # A finer triangulation left on the shape would be kept for all levels
+        breptools.Clean(part)
+        levels = []
+        self.mesh_parameters = []
+        pass_length = None
+        angular = ANGULAR_DEFLECTION
+        for length in sorted(lengths, reverse=True):
+            parameters = {}
+            if triangle_budget is None:
+                self.__mesh_part(part, length, parallel, angular)
+            else:
+                parameters["triangle_budget"] = triangle_budget
+                if pass_length is not None:
+                    length, angular, parameters["estimated_triangles"] = deflection_within_budget(
+                        pass_length, pass_triangles, length, angular, triangle_budget)
+                length, angular, parameters["triangles"] = self.__mesh_within_budget(part, length, angular, parallel, triangle_budget)
+                if pass_length is None:
+                    pass_length, pass_triangles = length, parameters["triangles"]
+            levels.append(self.__face_meshes())
+            self.mesh_parameters.append(dict(parameters, linear_deflection=length, angular_deflection=angular))
+        return levels
+
+    def count_triangles(self):
+        """
+        Number of triangles of the current triangulation of the faces
+        """
+        total = 0
+        for face in self.topology_graph.faces:
+            mesh = BRep_Tool.Triangulation(face, TopLoc_Location())
+            if mesh != None:
+                total += mesh.NbTriangles()
+        return total
+
+    def __mesh_within_budget(self, part, length, angular, parallel, triangle_budget):
+        """
+        Mesh the part and redo the mesh with the measured number of
+        triangles at most MAX_BUDGET_ATTEMPTS times while it exceeds the
+        budget.  Returns the linear and angular deflection used and the
+        number of triangles
+        """
+        self.__mesh_part(part, length, parallel, angular)
+        triangles = self.count_triangles()
+        for _ in range(MAX_BUDGET_ATTEMPTS):
+            if triangles <= triangle_budget:
+                break
+            length, angular, _ = deflection_within_budget(length, triangles, length, angular, triangle_budget)
+            breptools.Clean(part)
+            self.__mesh_part(part, length, parallel, angular)
+            triangles = self.count_triangles()
+        if triangles > triangle_budget and self.logger:
+            self.logger.warning("Mesh of %i triangles exceeds the budget of %i"%(triangles, triangle_budget))
+        return length, angular, triangles
+
+    def __mesh_part(self, part, length, parallel=False, angular=ANGULAR_DEFLECTION):
+        mesh = BRepMesh_IncrementalMesh(part, length, False, angular, parallel)
+        mesh.SetParallel(parallel)
         mesh.SetShape(part)
         mesh.Perform()
         assert mesh.IsDone()
         
         if self.logger:
             self.logger.info("Meshing body: Done")
-        nr_faces = top_exp.number_of_faces()
-        meshes = [None]*nr_faces
+
+    def __face_meshes(self):
+        faces = self.topology_graph.faces
+        meshes = [None]*len(faces)
         # Iterate over faces
-        faces = top_exp.faces()
         for face in faces:
             expected_face_index = self.entity_mapper.face_index(face)
 
@@ -40,7 +199,7 @@ class MeshBuilder:
             try:
                 verts, tris, _, _, _ = self.__process_face(face)
                 assert meshes[expected_face_index] == None
-                meshes[expected_face_index] = {"vertices": np.array(verts), "faces": np.array(tris)}
+                meshes[expected_face_index] = {"vertices": np.asarray(verts), "faces": np.asarray(tris)}
             except Exception as e:
                 #print("Conversion failed, processing unconverted")
                 #print(e.args.split("\n"))
@@ -60,28 +219,17 @@ class MeshBuilder:
         brep_tool = BRep_Tool()
         location = TopLoc_Location()
         mesh = brep_tool.Triangulation(face, location)
-        verts = []
-        tris = []
+        verts = np.array([])
+        tris = np.array([])
         normals = []
         surf_normals = []
         centroids = []
         if mesh != None:
-            # Get vertices
-            num_vertices = mesh.NbNodes()
-            for i in range(1, num_vertices+1):
-                verts.append(list(mesh.Node(i).Coord()))
-            verts = np.array(verts)
-
-            # Get faces
-            num_tris = mesh.NbTriangles()
-            for i in range(1, num_tris+1):
-                index1, index2, index3 = mesh.Triangle(i).Get()
-                if face_orientation_wrt_surface_normal == 0:
-                    tris.append([first_vertex + index1 - 1, first_vertex + index2 - 1, first_vertex + index3 - 1])
-                elif face_orientation_wrt_surface_normal == 1:
-                    tris.append([first_vertex + index3 - 1, first_vertex + index2 - 1, first_vertex + index1 - 1])
-                else:
-                    print("Broken face orientation", face_orientation_wrt_surface_normal)
+            verts, tris = triangulation_to_arrays(mesh, location, face_orientation_wrt_surface_normal == 1, first_vertex)
+            if face_orientation_wrt_surface_normal != 0 and face_orientation_wrt_surface_normal != 1:
+                if self.logger:
+                    self.logger.warning("Broken face orientation %s"%face_orientation_wrt_surface_normal)
+                tris = np.array([])
 
     #             # Get mesh normals
     #             pt1 = verts[index1-1]
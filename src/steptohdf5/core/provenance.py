@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import h5py
+
+try:
+    from importlib.metadata import version, PackageNotFoundError
+except ImportError:
+    version = None
+
+
+def converter_version():
+    """
+    Version of the installed steptohdf5 package
+    """
+    if version is None:
+        return "unknown"
+    try:
+        return version("steptohdf5")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def hdf5_output_path(step_file, output_dir):
+    """
+    Path of the HDF5 file written for a STEP file, output_dir/grandparent/parent/stem.hdf5
+    """
+    step_file = Path(step_file)
+    return Path(output_dir) / step_file.parent.parent.name / step_file.parent.name / f"{step_file.stem}.hdf5"
+
+
+def failure_record_path(step_file, output_dir):
+    """
+    Path of the record left next to the output when a conversion fails
+    """
+    hdf5_path = hdf5_output_path(step_file, output_dir)
+    return hdf5_path.with_name(hdf5_path.stem + ".failed.json")
+
+
+def file_hash(path, block_size=1 << 20):
+    """
+    BLAKE2 digest of the content of a file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def conversion_options(convert=False, fix=False, indices=[], topology_layout="groups", mesh_layout="faces", compression="default", meshes=True, geometry_layout="groups", validation="off", mesh_deflection=1e-3, triangle_budget=None, **ignored):
+    """
+    The options of StepProcessor.process_parts which change the output,
+    with the same defaults, as a canonical JSON string.  Options which
+    only change how the work is done, such as mesh_threads, are ignored
+    """
+    if not isinstance(compression, str) and compression is not None:
+        compression = repr(compression)
+    return json.dumps({"convert": bool(convert), "fix": bool(fix), "indices": [int(i) for i in indices],
+                       "topology_layout": topology_layout, "mesh_layout": mesh_layout, "geometry_layout": geometry_layout,
+                       "compression": compression, "meshes": bool(meshes), "validation": validation,
+                       "mesh_deflection": mesh_deflection_option(mesh_deflection),
+                       "triangle_budget": None if triangle_budget is None else int(triangle_budget)}, sort_keys=True)
+
+
+def remeshed_options(recorded, mesh_deflection=1e-3, mesh_layout=None, compression=None, triangle_budget=None, **ignored):
+    """
+    The options of an output re-meshed by StepProcessor.remesh_parts,
+    from the options recorded in it.  mesh_layout and compression are
+    kept unless given
+    """
+    options = dict(recorded, mesh_deflection=mesh_deflection, triangle_budget=triangle_budget)
+    if mesh_layout is not None:
+        options["mesh_layout"] = mesh_layout
+    if compression is not None:
+        options["compression"] = compression
+    return options
+
+
+def read_recorded_options(step_file, output_dir):
+    """
+    The conversion options recorded in the output of a STEP file as a
+    dict, None if there is no readable output or it has none
+    """
+    hdf5_path = hdf5_output_path(step_file, output_dir)
+    if not hdf5_path.exists():
+        return None
+    try:
+        with h5py.File(hdf5_path, "r") as hdf5_file:
+            recorded = hdf5_file.attrs.get("options")
+    except OSError:
+        return None
+    if recorded is None:
+        return None
+    return json.loads(recorded.decode("utf-8") if isinstance(recorded, bytes) else recorded)
+
+
+def mesh_deflection_option(mesh_deflection):
+    """
+    A mesh deflection, or list of them for levels of detail, as stored
+    in the conversion options
+    """
+    if isinstance(mesh_deflection, (list, tuple)):
+        return sorted((float(d) for d in mesh_deflection), reverse=True)
+    return float(mesh_deflection)
+
+
+def input_signature(step_file, content_hash=False):
+    """
+    Identify the state of an input file by its size and modification
+    time, or by its size and content hash
+    """
+    stat = os.stat(step_file)
+    signature = {"input_size": stat.st_size}
+    if content_hash:
+        signature["input_hash"] = file_hash(step_file)
+    else:
+        signature["input_mtime"] = stat.st_mtime_ns
+    return signature
+
+
+def provenance(step_file, options, content_hash=False):
+    """
+    Attributes stored in each output, see write_provenance
+    """
+    record = {"converter_version": converter_version(), "options": options}
+    record.update(input_signature(step_file, content_hash))
+    return record
+
+
+def write_provenance(hdf5_file, step_file, options, content_hash=False):
+    """
+    Record the converter version, the conversion options and the state
+    of the input file as attributes of the root group
+    """
+    for key, value in provenance(step_file, options, content_hash).items():
+        hdf5_file.attrs[key] = value
+
+
+def matches_provenance(attributes, step_file, options, content_hash=False):
+    """
+    Whether recorded attributes belong to the current converter,
+    options and input file
+    """
+    try:
+        expected = provenance(step_file, options, content_hash)
+    except OSError:
+        return False
+    for key, value in expected.items():
+        if not key in attributes:
+            return False
+        recorded = attributes[key]
+        if isinstance(recorded, bytes):
+            recorded = recorded.decode("utf-8")
+        if recorded != value:
+            return False
+    return True
+
+
+def is_up_to_date(step_file, output_dir, options, content_hash=False):
+    """
+    Whether the output of a STEP file exists, can be opened and was
+    written by this converter version with the same options from the
+    current input.  Outputs are renamed into place only once complete
+    """
+    hdf5_path = hdf5_output_path(step_file, output_dir)
+    if not hdf5_path.exists():
+        return False
+    try:
+        with h5py.File(hdf5_path, "r") as hdf5_file:
+            return "parts" in hdf5_file and matches_provenance(hdf5_file.attrs, step_file, options, content_hash)
+    except OSError:
+        return False
+
+
+def write_failure_record(step_file, output_dir, options, message, failure_kind, content_hash=False):
+    """
+    Remember that converting a STEP file failed, with the
+    converter version, options and input it failed for
+    """
+    record_path = failure_record_path(step_file, output_dir)
+    record_path.parent.mkdir(parents=True, exist_ok=True)
+    record = provenance(step_file, options, content_hash)
+    record.update(input=str(step_file), error=message, failure_kind=failure_kind)
+    with open(record_path, "w") as f:
+        json.dump(record, f)
+
+
+def read_failure_record(step_file, output_dir, options, content_hash=False):
+    """
+    The failure record of a STEP file if it is from this converter
+    version, options and input, None otherwise
+    """
+    record_path = failure_record_path(step_file, output_dir)
+    try:
+        with open(record_path, "r") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not matches_provenance(record, step_file, options, content_hash):
+        return None
+    return record
+
+
+def remove_failure_record(step_file, output_dir):
+    try:
+        os.remove(failure_record_path(step_file, output_dir))
+    except OSError:
+        pass
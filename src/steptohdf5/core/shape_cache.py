@@ -0,0 +1,99 @@
+from OCC.Core.BinTools import bintools
+from OCC.Core.Interface import Interface_Static
+from OCC.Core.STEPControl import STEPControl_Reader
+from OCC.Core.TopoDS import TopoDS_Shape
+import OCC
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+from .provenance import file_hash
+
+
+# Parameters of the STEP reader which change the transferred shapes
+READER_PARAMETERS = ("read.precision.mode", "read.precision.val", "read.maxprecision.mode",
+                     "read.maxprecision.val", "read.stdsameparameter.mode", "read.surfacecurve.mode",
+                     "read.encoderegularity.angle", "xstep.cascade.unit", "read.step.product.mode",
+                     "read.step.product.context", "read.step.shape.repr", "read.step.assembly.level",
+                     "read.step.shape.relationship", "read.step.shape.aspect", "read.step.nonmanifold")
+
+
+def reader_settings():
+    """
+    The STEP reader parameters and the OCC version as a canonical JSON string
+    """
+    # The reader registers its parameters when the first one is created
+    STEPControl_Reader()
+    settings = {name: Interface_Static.CVal(name) for name in READER_PARAMETERS}
+    settings["occ_version"] = OCC.VERSION
+    return json.dumps(settings, sort_keys=True)
+
+
+class ShapeCache:
+    """
+    Cache of the shapes transferred from STEP files in the binary BRep
+    format, keyed on the content of the file and the reader settings.
+    Reading the BRep files is much faster than parsing and transferring
+    the STEP file again, e.g. when only the meshing or the output layout
+    changes between runs.  The parts are stored right after the
+    transfer, before they are meshed
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, step_file):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(file_hash(step_file).encode("utf-8"))
+        digest.update(reader_settings().encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        """
+        Directory holding the parts of an entry as NNN.brep files
+        """
+        return self.cache_dir / key[:2] / key
+
+    def load(self, key):
+        """
+        The parts stored under key, None if there is no entry
+        """
+        path = self.path(key)
+        if not path.is_dir():
+            return None
+        return [read_brep(part_path) for part_path in sorted(path.glob("*.brep"))]
+
+    def store(self, key, parts):
+        """
+        Write the parts under key.  The entry is written to a temporary
+        directory which is renamed once complete, an entry written
+        concurrently by another process is kept
+        """
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(".%s.%i.tmp" % (path.name, os.getpid()))
+        try:
+            tmp_path.mkdir()
+            for i, part in enumerate(parts):
+                write_brep(part, tmp_path / ("%03i.brep" % i))
+            os.replace(tmp_path, path)
+        except OSError:
+            if not path.is_dir():
+                raise
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def write_brep(shape, path):
+    """
+    Write a shape in the binary BRep format
+    """
+    bintools.Write(shape, str(path))
+
+
+def read_brep(path):
+    shape = TopoDS_Shape()
+    bintools.Read(shape, str(path))
+    return shape
@@ -1,10 +1,11 @@
-from OCC.Extend.TopologyUtils import TopologyExplorer, WireExplorer
 from OCC.Core.ShapeAnalysis import ShapeAnalysis_Surface, shapeanalysis
 from OCC.Core.ShapeAnalysis import shapeanalysis_OuterWire
 from OCC.Core.ShapeAnalysis import shapeanalysis_GetFaceUVBounds
 from OCC.Core.BRep import BRep_Tool
 from OCC.Core.gp import gp_Pnt, gp_Vec, gp_Pnt2d
 
+from .topology_graph import topology_graph_for
+
 
 
 
@@ -69,12 +70,10 @@ def extract_face_stats(face, entity_mapper, prec=1e-8):
     return stats
 
 
-def extract_statistical_information(body, entity_mapper, logger):
-    top_exp = TopologyExplorer(body, ignore_orientation=False)
-    nr_faces = top_exp.number_of_faces()
-    stats = [None]*nr_faces
+def extract_statistical_information(body, entity_mapper, logger, topology_graph=None):
+    faces = topology_graph_for(body, topology_graph).faces
+    stats = [None]*len(faces)
     # Iterate over faces
-    faces = top_exp.faces()
     for face in faces:
         expected_face_index = entity_mapper.face_index(face)
         try:
@@ -3,14 +3,30 @@ from OCC.Core.IFSelect import IFSelect_RetDone
 # from OCCUtils.Topology import Topo, dumpTopology
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_NurbsConvert
 from OCC.Core.ShapeFix import ShapeFix_Shape as _ShapeFix_Shape
+import json
 import logging
-from .hdf5_converter import convert_dict_to_hdf5
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+import h5py
+import numpy as np
+from joblib import Parallel, delayed
+from .hdf5_converter import (convert_dict_to_hdf5, convert_topology_to_columnar_hdf5, convert_geometry_to_columnar_hdf5,
+                             convert_meshes_to_hdf5, convert_meshes_to_concatenated_hdf5, convert_mesh_lods_to_hdf5,
+                             write_mesh_parameters, format_version)
+from .compression import get_compression_policy
+from .provenance import hdf5_output_path, conversion_options, remeshed_options, write_provenance, converter_version
+from .shape_cache import ShapeCache, write_brep, read_brep
+from ..utils.cpu_budget import set_occ_thread_count
+from ..utils.timing import StageTimer, write_timings
 
 
 
 from .entity_mapper import EntityMapper
+from .topology_graph import TopologyGraph
 from .geometry_dict_builder import GeometryDictBuilder
-from .topology_dict_builder import TopologyDictBuilder
+from .topology_dict_builder import TopologyDictBuilder, VALIDATION_LEVELS
 from .statistics_dict_builder import extract_statistical_information
 from .mesh_builder import MeshBuilder
 
@@ -47,6 +63,10 @@ class StepProcessor:
         # Initialize the parts list
         self.parts = []
 
+        # Wall time of the stages of the whole file, and of each processed part
+        self.timer = StageTimer()
+        self.part_timers = []
+
         # Directory for output files
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
@@ -72,79 +92,100 @@ class StepProcessor:
         self.logger.addHandler(logging.NullHandler())
 
 
-    def load_step_file(self):
-        self.parts = load_parts_from_step_file(self.step_file, logger=self.logger)
+    def load_step_file(self, shape_cache=None):
+        """
+        Read and transfer the parts of the STEP file.  With a ShapeCache
+        (or its directory) the parts are read from the cache when the
+        file was transferred before, and stored in it otherwise
+        """
+        if shape_cache is None:
+            with self.timer.stage("step_transfer"):
+                self.parts = load_parts_from_step_file(self.step_file, logger=self.logger)
+            return
+
+        if not isinstance(shape_cache, ShapeCache):
+            shape_cache = ShapeCache(shape_cache)
+        key = shape_cache.key(self.step_file)
+        with self.timer.stage("brep_load"):
+            parts = shape_cache.load(key)
+        if parts is not None:
+            self.logger.info("Loaded parts from shape cache: %i"%len(parts))
+            self.parts = parts
+            return
+        with self.timer.stage("step_transfer"):
+            self.parts = load_parts_from_step_file(self.step_file, logger=self.logger)
+        with self.timer.stage("brep_store"):
+            shape_cache.store(key, self.parts)
+
+    def process_parts(self, convert=False, fix=False, write_face_obj=True, write_part_obj=True, indices=[], version=None, topology_layout="groups", mesh_layout="faces", compression="default", mesh_threads=1, content_hash=False, part_jobs=1, geometry_layout="groups", validation="off", mesh_deflection=1e-3, triangle_budget=None, in_memory=False):
+        """
+        Process the loaded parts and write them to the HDF5 file.
+        topology_layout selects how topology tables are stored: "groups"
+        writes one group per entity, "columnar" writes flat typed arrays
+        with CSR values/offsets for variable-length lists.
+        geometry_layout "groups" writes one group per surface and curve,
+        "columnar" one table per surface and curve type.
+        validation "off" runs no checks, "fast" and "full" store the
+        results of the cheap or of all loop checks as a status bitfield
+        per loop, see topology_dict_builder.LOOP_CHECKS.
+        mesh_deflection is the linear deflection of the meshes relative
+        to the largest side of the bounding box of the part, a list of
+        deflections writes meshes at these levels of detail as mesh/lod_N,
+        coarsest first.  triangle_budget bounds the number of triangles of
+        the mesh of each part, see MeshBuilder.create_surface_meshes.
+        mesh_layout "faces" writes one group per face mesh, "concatenated"
+        writes one points and triangle array per part with face offsets.
+        compression is the name of a compression policy ("none", "gzip9",
+        "default", "fast", "zstd") or a CompressionPolicy.
+        mesh_threads > 1 meshes each part in parallel on that many OCC threads,
+        part_jobs > 1 processes the parts in that many worker processes.
+        The output records the converter version, the options and the size
+        and mtime of the input, or its content hash with content_hash set.
+        It is written to a temporary file which is renamed once complete.
+        Returns the number of parts and faces written, the output path,
+        its size in bytes and the timings, which are also stored as
+        time_<stage> attributes of the root and part groups.
+        With in_memory set nothing is written to disk, the image of the
+        file is returned as image instead, e.g. for a ShardWriter
+        """
+        if topology_layout not in ("groups", "columnar"):
+            raise ValueError("Unknown topology layout: %s"%topology_layout)
+        if mesh_layout not in ("faces", "concatenated"):
+            raise ValueError("Unknown mesh layout: %s"%mesh_layout)
+        if geometry_layout not in ("groups", "columnar"):
+            raise ValueError("Unknown geometry layout: %s"%geometry_layout)
+        if validation not in VALIDATION_LEVELS:
+            raise ValueError("Unknown validation level: %s"%validation)
+        policy = get_compression_policy(compression)
+        options = conversion_options(convert=convert, fix=fix, indices=indices, topology_layout=topology_layout,
+                                     mesh_layout=mesh_layout, compression=compression, meshes=self.extract_meshes,
+                                     geometry_layout=geometry_layout, validation=validation, mesh_deflection=mesh_deflection,
+                                     triangle_budget=triangle_budget)
+        if mesh_threads > 1:
+            set_occ_thread_count(mesh_threads)
+        if version is None:
+            version = format_version(topology_layout, mesh_layout, geometry_layout, is_mesh_lods(mesh_deflection))
 
-    def process_parts(self, convert=False, fix=False, write_face_obj=True, write_part_obj=True, indices=[], version="2.0"):
         if len(self.parts) == 0:
             self.logger.info("No parts loaded to process.")
-            return
+            return {"parts": 0, "faces": 0, "output": None, "output_size": 0, "timings": self.timings()}
 
         # If no indices are given, process all parts
         if len(indices) == 0:
             indices = range(len(self.parts))
             self.logger.info("Processing all %i parts of file."%len(indices))
 
-        topo_dicts = []
-        geo_dicts = []
-        mesh_dicts = []
-        stats_dicts = []
-
-        # Iterate over all indices
-        for index in indices:
-            part = self.parts[index]
-
-            # Convert complete part to NURBS surfaces
-            if convert:
-                try:
-                    nurbs_converter = BRepBuilderAPI_NurbsConvert(part)
-                    nurbs_converter.Perform(part)
-                    part = nurbs_converter.Shape()
-                except Exception as e:
-                    #print("Conversion failed, processing unconverted")
-                    #print(e.args.split("\n"))
-                    self.logger.error("Nurbs conversion error: %s"%"".join(str(e).split("\n")[:2]))
-                    continue
-
-            # Fix shape with healing operations
-            if fix:
-                #print("Fixing shape")
-                b = _ShapeFix_Shape(part)
-                b.SetPrecision(1e-8)
-                #b.SetMaxTolerance(1e-8)
-                #b.SetMinTolerance(1e-8)
-                b.Perform()
-                part = b.Shape()
-
-            # Extract information for part
-            try:
-                topo_dict, geo_dict, meshes, stats_dict = self.__process_part(part)
-            except Exception as e:
-                print("Error:", str(e))
-                self.logger.error("Processing part failed %i"%index)
-                self.logger.error(str(e))
-                continue
-
-            topo_dicts.append(topo_dict)
-            geo_dicts.append(geo_dict)
-            stats_dicts.append(stats_dict)
-            mesh_dicts.append(meshes)
-
-            # if write_face_obj:
-            #     mesh_path = self.output_dir / f"{self.step_file.stem}_mesh"
-            #     #print(str(mesh_path), mesh_path)
-            #     os.makedirs(mesh_path, exist_ok=True)
-            #     for idx, mesh in enumerate(meshes):
-            #         if len(mesh["vertices"]) > 0:
-            #             igl.write_triangle_mesh("%s/%03i_%05i_mesh.obj"%(str(mesh_path), index, idx), mesh["vertices"], mesh["faces"])
-
-        parent_folder_name = self.step_file.parent.name
-        grandparent_folder_name = self.step_file.parent.parent.name
-
-        new_folder_path = self.output_dir / grandparent_folder_name/parent_folder_name
-        new_folder_path.mkdir(parents=True, exist_ok=True)
-        hdf5_path = self.output_dir / grandparent_folder_name / parent_folder_name / f"{self.step_file.stem}.hdf5"
+        self.part_timers = []
+        nr_parts = 0
+        nr_faces = 0
 
+        hdf5_path = hdf5_output_path(self.step_file, self.output_dir)
+        tmp_path = hdf5_path.with_name(".%s.%i.tmp" % (hdf5_path.name, os.getpid()))
+        if in_memory:
+            file_options = {"driver": "core", "backing_store": False}
+        else:
+            file_options = {}
+            hdf5_path.parent.mkdir(parents=True, exist_ok=True)
 
         # if self.step_file.stem == 'assembly':
         #     new_file_name = f"{self.step_file.parent.name}_{self.step_file.stem}.hdf5"
@@ -152,56 +193,290 @@ class StepProcessor:
         # else:
         #     hdf5_path = self.output_dir / f"{self.step_file.stem}.hdf5"
 
-        # self.logger.info("Writing dictionaries")
-        # topo_yaml = self.output_dir / f"{self.step_file.stem}_topo"
-        # write_dictionary_to_file(topo_yaml, {"parts": topo_dicts, "version": version}, self.data_format)
-        # self.logger.info("Topo dict: Done")
-        # geo_yaml = self.output_dir / f"{self.step_file.stem}_geo"
-        # write_dictionary_to_file(geo_yaml, {"parts": geo_dicts, "version": version}, self.data_format)
-        # self.logger.info("Geo dict: Done")
-        # stats_yaml = self.output_dir / f"{self.step_file.stem}_stat"
-        # write_dictionary_to_file(stats_yaml, {"parts": stats_dicts, "version": version}, self.data_format)
-        # self.logger.info("Stat dict: Done")
-
-        with h5py.File(hdf5_path, "w") as hdf5_file:
-
-            parts_group = hdf5_file.create_group('parts')
-            parts_group.attrs['version'] = version
+        # The file is open while the parts are processed, each part is
+        # written and released as soon as it is done, so that memory is
+        # bounded by the largest part rather than the whole model
+        try:
+            with h5py.File(tmp_path, "w", **file_options) as hdf5_file:
+                write_provenance(hdf5_file, self.step_file, options, content_hash)
+                parts_group = hdf5_file.create_group('parts')
+                parts_group.attrs['version'] = version
+
+                # Iterate over all indices, in order also with part_jobs
+                for index, result, part_timer in self.__part_results(indices, convert, fix, mesh_threads, part_jobs, validation,
+                                                                             mesh_deflection, triangle_budget):
+                    if result is None:
+                        continue
+                    topo_dict, geo_dict, meshes, stats_dict = result
+                    result = None
+
+                    # if write_face_obj:
+                    #     mesh_path = self.output_dir / f"{self.step_file.stem}_mesh"
+                    #     #print(str(mesh_path), mesh_path)
+                    #     os.makedirs(mesh_path, exist_ok=True)
+                    #     for idx, mesh in enumerate(meshes):
+                    #         if len(mesh["vertices"]) > 0:
+                    #             igl.write_triangle_mesh("%s/%03i_%05i_mesh.obj"%(str(mesh_path), index, idx), mesh["vertices"], mesh["faces"])
+
+                    self.part_timers.append(part_timer)
+                    part_group = parts_group.create_group('part_' + str(nr_parts + 1).zfill(3))
+                    part_group.attrs["index"] = index
+                    with self.timer.stage("hdf5_write"):
+                        self.__write_part(part_group, part_timer, topology_layout, mesh_layout, geometry_layout, mesh_deflection, policy,
+                                          topo_dict, geo_dict, meshes, stats_dict)
+                    nr_parts += 1
+                    nr_faces += len(topo_dict.get("faces", []))
+                    del topo_dict, geo_dict, meshes, stats_dict
+
+                write_timings(hdf5_file, self.timer.stages)
+                if in_memory:
+                    hdf5_file.flush()
+                    image = hdf5_file.id.get_file_image()
+            if in_memory:
+                return {"parts": nr_parts, "faces": nr_faces, "output": None, "output_size": len(image),
+                        "image": image, "timings": self.timings()}
+            os.replace(tmp_path, hdf5_path)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+
+        return {"parts": nr_parts, "faces": nr_faces, "output": str(hdf5_path),
+                "output_size": os.path.getsize(hdf5_path), "timings": self.timings()}
+
+    def remesh_parts(self, mesh_deflection=1e-3, mesh_layout=None, compression=None, mesh_threads=1, triangle_budget=None):
+        """
+        Replace the meshes of the existing output of the loaded parts
+        by meshes with a new relative deflection, or list of them for
+        levels of detail, and triangle budget, see process_parts.
+        The parts are converted and healed as recorded in the options
+        of the output and only the face index mapping is rebuilt, the
+        topology and geometry groups are copied unchanged.  mesh_layout
+        and compression default to those of the output.  The new file is
+        written next to the output and renamed over it once complete,
+        so outputs linked from a ContentCache are left untouched.
+        Returns the same summary as process_parts
+        """
+        if not self.extract_meshes:
+            raise ValueError("Re-meshing needs a mesh builder")
+        hdf5_path = hdf5_output_path(self.step_file, self.output_dir)
+        tmp_path = hdf5_path.with_name(".%s.%i.tmp" % (hdf5_path.name, os.getpid()))
+        if mesh_threads > 1:
+            set_occ_thread_count(mesh_threads)
+
+        self.part_timers = []
+        nr_parts = 0
+        nr_faces = 0
+        try:
+            with h5py.File(hdf5_path, "r") as source, h5py.File(tmp_path, "w") as hdf5_file:
+                recorded = source.attrs["options"]
+                recorded = json.loads(recorded.decode("utf-8") if isinstance(recorded, bytes) else recorded)
+                recorded = remeshed_options(recorded, mesh_deflection, mesh_layout, compression, triangle_budget)
+                if recorded["mesh_layout"] not in ("faces", "concatenated"):
+                    raise ValueError("Unknown mesh layout: %s"%recorded["mesh_layout"])
+                policy = get_compression_policy(recorded["compression"])
+
+                for key, value in source.attrs.items():
+                    hdf5_file.attrs[key] = value
+                hdf5_file.attrs["converter_version"] = converter_version()
+                hdf5_file.attrs["options"] = conversion_options(**recorded)
+                parts_group = hdf5_file.create_group('parts')
+                parts_group.attrs['version'] = format_version(recorded.get("topology_layout", "groups"), recorded["mesh_layout"],
+                                                              recorded.get("geometry_layout", "groups"), is_mesh_lods(mesh_deflection))
+
+                # Files written before part groups recorded their index
+                # hold one part group per recorded index, in order
+                indices = recorded["indices"] if len(recorded["indices"]) > 0 else range(len(self.parts))
+                part_names = sorted(source["parts"].keys(), key=lambda name: int(name.split("_")[-1]))
+                for position, name in enumerate(part_names):
+                    source_part = source["parts"][name]
+                    index = int(source_part.attrs.get("index", indices[position]))
+                    part_timer = StageTimer()
+                    if index >= len(self.parts):
+                        raise ValueError("%s has no part %i"%(self.step_file, index))
+                    part = self.prepare_part(index, self.parts[index], recorded["convert"], recorded["fix"], part_timer)
+                    if part is None:
+                        raise ValueError("Preparing part %i of %s failed"%(index, self.step_file))
+
+                    with part_timer.stage("entity_mapper"):
+                        entity_mapper = self.entity_mapper([part])
+                    with part_timer.stage("topology_graph"):
+                        topology_graph = TopologyGraph(part)
+                    if len(topology_graph.faces) != nr_meshed_faces(source_part["mesh"]):
+                        raise ValueError("Part %i of %s does not match its output"%(index, self.step_file))
+                    bbox = source_part["geometry/bbox"][()] if "geometry/bbox" in source_part else None
+                    with part_timer.stage("mesh"):
+                        mesh_builder = self.mesh_builder(entity_mapper, self.logger, topology_graph=topology_graph)
+                        meshes = mesh_part(mesh_builder, part, bbox, mesh_deflection, parallel=mesh_threads > 1,
+                                           triangle_budget=triangle_budget)
+
+                    self.part_timers.append(part_timer)
+                    with self.timer.stage("hdf5_write"):
+                        part_group = parts_group.create_group(name)
+                        for key, value in source_part.attrs.items():
+                            part_group.attrs[key] = value
+                        part_group.attrs["index"] = index
+                        write_timings(part_group, part_timer.stages)
+                        for key in source_part.keys():
+                            if key != "mesh":
+                                source.copy(source_part[key], part_group, name=key)
+                        write_meshes(meshes, part_group.create_group('mesh'), recorded["mesh_layout"], mesh_deflection, policy)
+                    nr_parts += 1
+                    nr_faces += len(topology_graph.faces)
+                    del meshes
+
+                write_timings(hdf5_file, self.timer.stages)
+            os.replace(tmp_path, hdf5_path)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+
+        return {"parts": nr_parts, "faces": nr_faces, "output": str(hdf5_path),
+                "output_size": os.path.getsize(hdf5_path), "timings": self.timings()}
+
+    def timings(self):
+        """
+        Wall time in seconds of the stages of the file and of each part,
+        and the conversion time per surface and curve type
+        """
+        by_type = StageTimer()
+        for part_timer in self.part_timers:
+            by_type.merge_types(part_timer)
+        return {"stages": dict(self.timer.stages), "parts": [dict(t.stages) for t in self.part_timers],
+                "by_type": by_type.types_as_dict()}
 
-            for i, (topo_dict, geo_dict, meshes, stats_dict) in enumerate(zip(topo_dicts, geo_dicts, mesh_dicts, stats_dicts)):
-                part_group = parts_group.create_group('part_' + str(i + 1).zfill(3))
+    def __part_results(self, indices, convert, fix, mesh_threads, part_jobs, validation="off", mesh_deflection=1e-3, triangle_budget=None):
+        """
+        Yield (index, result, timer) for the parts in the order of indices,
+        see process_part_at.  With part_jobs > 1 the parts are written in
+        the binary BRep format and processed by that many worker processes
+        """
+        if part_jobs > 1 and len(indices) > 1 and multiprocessing.current_process().daemon:
+            self.logger.warning("Daemonic processes cannot start part workers, processing parts sequentially")
+            part_jobs = 1
+        if part_jobs <= 1 or len(indices) <= 1:
+            for index in indices:
+                yield self.process_part_at(index, self.parts[index], convert, fix, mesh_threads > 1, validation, mesh_deflection,
+                                           triangle_budget)
+            return
 
-                for j, k in enumerate(topo_dict["faces"]):
-                    s = stats_dict[j]
-                    k.update(s)
+        builders = {"entity_mapper": self.entity_mapper, "topology_builder": self.topology_builder,
+                    "geometry_builder": self.geometry_builder, "mesh_builder": self.mesh_builder,
+                    "stats_builder": self.stats_builder}
+        with tempfile.TemporaryDirectory() as brep_dir:
+            brep_paths = []
+            with self.timer.stage("brep_serialize"):
+                for index in indices:
+                    brep_paths.append(os.path.join(brep_dir, "part_%i.brep" % index))
+                    write_brep(self.parts[index], brep_paths[-1])
+            # The backend is explicit since joblib runs nested calls, e.g. from
+            # the workers of a batch conversion, in threads by default
+            yield from Parallel(n_jobs=part_jobs, backend="loky", return_as="generator")(
+                delayed(process_part_file)(self.step_file, self.output_dir, self.log_dir, builders, index, path, convert, fix,
+                                            mesh_threads, validation, mesh_deflection, triangle_budget)
+                for index, path in zip(indices, brep_paths))
+
+    def process_part_at(self, index, part, convert=False, fix=False, parallel_meshing=False, validation="off", mesh_deflection=1e-3, triangle_budget=None):
+        """
+        Optionally convert the part to NURBS and heal it, then extract
+        its dictionaries and meshes.  Returns (index, result, timer),
+        result is None if the part failed
+        """
+        part_timer = StageTimer()
+        part = self.prepare_part(index, part, convert, fix, part_timer)
+        if part is None:
+            return index, None, part_timer
 
-                convert_dict_to_hdf5(topo_dict, part_group.create_group('topology'))
-                convert_dict_to_hdf5(geo_dict, part_group.create_group('geometry'))
-                # convert_stat_to_hdf5(stats_dict, part_group.create_group('stat'))
+        # Extract information for part
+        try:
+            result = self.__process_part(part, part_timer, parallel_meshing=parallel_meshing, validation=validation,
+                                         mesh_deflection=mesh_deflection, triangle_budget=triangle_budget)
+        except Exception as e:
+            print("Error:", str(e))
+            self.logger.error("Processing part failed %i"%index)
+            self.logger.error(str(e))
+            return index, None, part_timer
+        return index, result, part_timer
+
+    def prepare_part(self, index, part, convert=False, fix=False, part_timer=None):
+        """
+        Optionally convert the part to NURBS and heal it.  Returns
+        the part, None if the conversion failed
+        """
+        if part_timer is None:
+            part_timer = StageTimer()
 
-                mesh_group = part_group.create_group('mesh')
-                for index, mesh in enumerate(meshes):
-                    points = mesh["vertices"]
-                    faces = mesh["faces"]
-                    mesh_subgroup = mesh_group.create_group(str(index).zfill(3))
-                    mesh_subgroup.create_dataset('points', data=points, compression="gzip", compression_opts=9)
-                    mesh_subgroup.create_dataset('triangle', data=faces, compression="gzip", compression_opts=9)
+        # Convert complete part to NURBS surfaces
+        if convert:
+            try:
+                with part_timer.stage("nurbs_convert"):
+                    nurbs_converter = BRepBuilderAPI_NurbsConvert(part)
+                    nurbs_converter.Perform(part)
+                    part = nurbs_converter.Shape()
+            except Exception as e:
+                #print("Conversion failed, processing unconverted")
+                #print(e.args.split("\n"))
+                self.logger.error("Nurbs conversion error: %s"%"".join(str(e).split("\n")[:2]))
+                return None
+
+        # Fix shape with healing operations
+        if fix:
+            #print("Fixing shape")
+            with part_timer.stage("fix"):
+                b = _ShapeFix_Shape(part)
+                b.SetPrecision(1e-8)
+                #b.SetMaxTolerance(1e-8)
+                #b.SetMinTolerance(1e-8)
+                b.Perform()
+                part = b.Shape()
+        return part
 
+    def __write_part(self, part_group, part_timer, topology_layout, mesh_layout, geometry_layout, mesh_deflection, policy, topo_dict, geo_dict, meshes, stats_dict):
+        """
+        Write a processed part into its group of the HDF5 file
+        """
+        write_timings(part_group, part_timer.stages)
 
+        for j, k in enumerate(topo_dict["faces"]):
+            s = stats_dict[j]
+            k.update(s)
 
+        if topology_layout == "columnar":
+            convert_topology_to_columnar_hdf5(topo_dict, part_group.create_group('topology'), policy)
+        else:
+            convert_dict_to_hdf5(topo_dict, part_group.create_group('topology'), policy)
+        if geometry_layout == "columnar":
+            convert_geometry_to_columnar_hdf5(geo_dict, part_group.create_group('geometry'), policy)
+        else:
+            convert_dict_to_hdf5(geo_dict, part_group.create_group('geometry'), policy)
+        # convert_stat_to_hdf5(stats_dict, part_group.create_group('stat'))
 
+        write_meshes(meshes, part_group.create_group('mesh'), mesh_layout, mesh_deflection, policy)
 
-    def __process_part(self, part):
+    def __process_part(self, part, timer, parallel_meshing=False, validation="off", mesh_deflection=1e-3, triangle_budget=None):
+        """
+        Extract the dictionaries and meshes of a part, recording
+        the time of each stage with the StageTimer
+        """
         self.logger.info("Entity mapper: Init")
-        entity_mapper = self.entity_mapper([part])
+        with timer.stage("entity_mapper"):
+            entity_mapper = self.entity_mapper([part])
         self.logger.info("Entity mapper: Done")
 
+        # Build the relations between entities once for all builders
+        self.logger.info("Topology graph: Init")
+        with timer.stage("topology_graph"):
+            topology_graph = TopologyGraph(part)
+        self.logger.info("Topology graph: Done")
+
         # Extract topology
         if self.extract_topo:
             self.logger.info("Extract topo: Init")
-            topo_dict_builder = self.topology_builder(entity_mapper)
-            self.logger.info("Extract topo: Build")
-            topo_dict = topo_dict_builder.build_dict_for_parts(part)
+            with timer.stage("topology"):
+                topo_dict_builder = self.topology_builder(entity_mapper, topology_graph=topology_graph, validation=validation)
+                self.logger.info("Extract topo: Build")
+                topo_dict = topo_dict_builder.build_dict_for_parts(part)
             self.logger.info("Extract topo: Done")
         else:
             topo_dict = {}
@@ -209,9 +484,10 @@ class StepProcessor:
         # Extract geometry
         if self.extract_geometry:
             self.logger.info("Extract geo: Init")
-            geo_dict_builder = self.geometry_builder(entity_mapper)
-            self.logger.info("Extract geo: Build")
-            geo_dict = geo_dict_builder.build_dict_for_parts(part, self.logger)
+            with timer.stage("geometry"):
+                geo_dict_builder = self.geometry_builder(entity_mapper, topology_graph=topology_graph, timer=timer)
+                self.logger.info("Extract geo: Build")
+                geo_dict = geo_dict_builder.build_dict_for_parts(part, self.logger)
             self.logger.info("Extract geo: Done")
         else:
             geo_dict = {}
@@ -219,21 +495,20 @@ class StepProcessor:
         # Extract statistics
         if True:#self.extract_stats:
             self.logger.info("Extract stats: Init")
-            stats_dict = extract_statistical_information(part, entity_mapper, self.logger)
+            with timer.stage("stats"):
+                stats_dict = extract_statistical_information(part, entity_mapper, self.logger, topology_graph=topology_graph)
             self.logger.info("Extract stats: Done")
         else:
             stats_dict = {}
 
         # Extract meshes
         if self.extract_meshes:
-            lenght = 1e-3
-            if geo_dict and 'bbox' in geo_dict:
-                bbox = geo_dict['bbox']
-                lenght = max(bbox[3] - bbox[0], bbox[4] - bbox[1], bbox[5] - bbox[2]) * lenght
+            bbox = geo_dict['bbox'] if geo_dict and 'bbox' in geo_dict else None
 
             self.logger.info("Extract mesh: Init")
-            mesh_builder = self.mesh_builder(entity_mapper, self.logger)
-            meshes = mesh_builder.create_surface_meshes(part, lenght)
+            with timer.stage("mesh"):
+                mesh_builder = self.mesh_builder(entity_mapper, self.logger, topology_graph=topology_graph)
+                meshes = mesh_part(mesh_builder, part, bbox, mesh_deflection, parallel=parallel_meshing, triangle_budget=triangle_budget)
             self.logger.info("Extract mesh: Done")
         else:
             meshes = []
@@ -267,3 +542,77 @@ def load_parts_from_step_file(pathname, logger=None):
 
     logger.info("Loaded parts: %i"%len(shapes))
     return shapes
+
+
+def linear_deflection(bbox, mesh_deflection=1e-3):
+    """
+    The linear deflection of a mesh relative to the largest side of a
+    bounding box, given as [xmin, ymin, zmin, xmax, ymax, zmax] or as
+    its (2, 3) array
+    """
+    bbox = np.asarray(bbox, dtype=np.float64).reshape(2, 3)
+    return float(np.max(bbox[1] - bbox[0])) * mesh_deflection
+
+
+def is_mesh_lods(mesh_deflection):
+    return isinstance(mesh_deflection, (list, tuple))
+
+
+def mesh_part(mesh_builder, part, bbox, mesh_deflection=1e-3, parallel=False, triangle_budget=None):
+    """
+    Mesh a part with a deflection relative to its bounding box, an
+    absolute one without bounding box, or at a list of them for levels
+    of detail.  Returns one dict per level with its relative deflection,
+    the parameters chosen by the mesh builder and the face meshes
+    """
+    if not is_mesh_lods(mesh_deflection):
+        lenght = mesh_deflection if bbox is None else linear_deflection(bbox, mesh_deflection)
+        levels = [mesh_builder.create_surface_meshes(part, lenght, parallel=parallel, triangle_budget=triangle_budget)]
+        deflections = [mesh_deflection]
+    else:
+        deflections = sorted(mesh_deflection, reverse=True)
+        lenghts = [d if bbox is None else linear_deflection(bbox, d) for d in deflections]
+        levels = mesh_builder.create_surface_mesh_lods(part, lenghts, parallel=parallel, triangle_budget=triangle_budget)
+    return [dict(parameters, deflection=d, meshes=meshes)
+            for d, parameters, meshes in zip(deflections, mesh_builder.mesh_parameters, levels)]
+
+
+def write_meshes(levels, group, mesh_layout="faces", mesh_deflection=1e-3, policy=None):
+    """
+    Write the result of mesh_part in the given mesh layout, as levels
+    of detail for a list of deflections.  The parameters of the meshes
+    are attributes of their group
+    """
+    if is_mesh_lods(mesh_deflection):
+        convert_mesh_lods_to_hdf5(levels, group, mesh_layout, policy)
+        return
+    # Without meshing there are no levels, the group is left empty
+    level = levels[0] if levels else {"meshes": []}
+    if mesh_layout == "concatenated":
+        convert_meshes_to_concatenated_hdf5(level["meshes"], group, policy)
+    else:
+        convert_meshes_to_hdf5(level["meshes"], group, policy)
+    write_mesh_parameters(level, group)
+
+
+def nr_meshed_faces(mesh_group):
+    """
+    Number of face meshes in the mesh group of a part
+    """
+    if "lod_0" in mesh_group:
+        return nr_meshed_faces(mesh_group["lod_0"])
+    if mesh_group.attrs.get("layout") == "concatenated":
+        return len(mesh_group["face_triangle_offsets"]) - 1
+    return len(mesh_group)
+
+
+def process_part_file(step_file, output_dir, log_dir, builders, index, brep_path, convert=False, fix=False, mesh_threads=1, validation="off", mesh_deflection=1e-3, triangle_budget=None):
+    """
+    Process a part written by write_brep in a worker process, with
+    a StepProcessor using the given builder classes.  The part is
+    meshed on mesh_threads OCC threads, like in the parent process
+    """
+    if mesh_threads > 1:
+        set_occ_thread_count(mesh_threads)
+    processor = StepProcessor(step_file, output_dir, log_dir, **builders)
+    return processor.process_part_at(index, read_brep(brep_path), convert, fix, mesh_threads > 1, validation, mesh_deflection, triangle_budget)
@@ -1,6 +1,6 @@
 
 # Python OCC
-from OCC.Extend.TopologyUtils import TopologyExplorer, WireExplorer
+from OCC.Extend.TopologyUtils import WireExplorer
 from OCC.Core.TopExp import topexp
 from OCC.Core.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
                              TopAbs_SHELL, TopAbs_SOLID, TopAbs_COMPOUND,
@@ -14,19 +14,40 @@ from OCC.Core.ShapeExtend import *
 
 # CAD
 from ..utils.topology import *
+from .topology_graph import topology_graph_for
+
+
+# Validation levels: "off" runs no checks, "fast" the cheap
+# ShapeAnalysis_Wire checks of each loop, "full" all of them and
+# whether the vertices of each edge match the ends of its curve
+VALIDATION_LEVELS = ("off", "fast", "full")
+
+# Bit i of the status of a loop is set when check i found a problem
+LOOP_CHECKS = ("order", "connected", "small", "edgecurves", "degenerated", "closed",
+               "sisect", "lack", "gap3d", "gap2d", "gapcurve", "vertex_order")
+FAST_LOOP_CHECKS = ("order", "connected", "small", "degenerated", "closed")
+
 
 class TopologyDictBuilder:
     """
     A class which builds a python dictionary
     ready for export to the topology file
     """
-    def __init__(self, entity_mapper, allow_nonmanifold = False):
+    def __init__(self, entity_mapper, allow_nonmanifold = False, topology_graph=None, validation="off"):
         """
         Construct from the entity mapper which gives
         us a mapping between the 
+        entities and their indices.  The topology graph
+        of the part is built on demand if not given.
+        With validation "fast" or "full" each loop gets
+        a status bitfield of the checks in LOOP_CHECKS
         """
+        if validation not in VALIDATION_LEVELS:
+            raise ValueError("Unknown validation level: %s"%validation)
         self.entity_mapper = entity_mapper
         self.allow_nonmanifold = allow_nonmanifold
+        self.topology_graph = topology_graph
+        self.validation = validation
 
     def build_dict_for_parts(self, parts):
         """
@@ -54,97 +75,88 @@ class TopologyDictBuilder:
             parts_arr.append(self.build_part_data(part))
         return parts_arr
 
+    def get_topology_graph(self, part):
+        self.topology_graph = topology_graph_for(part, self.topology_graph)
+        return self.topology_graph
+
     def build_solids_array(self, parts):
         solids_arr = []
         for part in parts:
-            top_exp = TopologyExplorer(part)
-            solids = top_exp.solids()
-            for solid in solids:
+            graph = self.get_topology_graph(part)
+            for position, solid in enumerate(graph.solids):
                 expected_solid_index = self.entity_mapper.solid_index(solid)
                 assert expected_solid_index == len(solids_arr)
-                solids_arr.append(self.build_solid_data(top_exp, solid))
+                solids_arr.append(self.build_solid_data(graph, position))
         return solids_arr
         
 
     def build_shells_array(self, parts):
         shells_arr = []
         for part in parts:
-            top_exp = TopologyExplorer(part)
-            shells = top_exp.shells()
-            for shell in shells:
+            graph = self.get_topology_graph(part)
+            for position, shell in enumerate(graph.shells):
                 expected_shell_index = self.entity_mapper.shell_index(shell)
                 assert expected_shell_index == len(shells_arr)
-                shells_arr.append(self.build_shell_data(top_exp, shell))
+                shells_arr.append(self.build_shell_data(graph, position))
         return shells_arr
 
 
     def build_faces_array(self, parts):
         faces_arr = []
         for part in parts:
-            top_exp = TopologyExplorer(part)
-            faces = top_exp.faces()
-            for face in faces:
+            graph = self.get_topology_graph(part)
+            for position, face in enumerate(graph.faces):
                 expected_face_index = self.entity_mapper.face_index(face)
                 assert expected_face_index == len(faces_arr)
-                faces_arr.append(self.build_face_data(top_exp, face))
+                faces_arr.append(self.build_face_data(graph, position))
         return faces_arr
 
 
     def build_edges_array(self, parts):
         edges_arr = []
         for part in parts:
-            top_exp = TopologyExplorer(part)
-            edges = top_exp.edges()
-            for edge in edges:
+            graph = self.get_topology_graph(part)
+            for edge in graph.edges:
                 expected_edge_index = self.entity_mapper.edge_index(edge)
                 assert expected_edge_index == len(edges_arr)
-                edges_arr.append(self.build_edge_data(top_exp, edge))
+                edges_arr.append(self.build_edge_data(graph, edge))
         return edges_arr
 
 
     def build_loops_array(self, parts):
         loops_arr = []
         for part in parts:
-            top_exp = TopologyExplorer(part)
-            loops = top_exp.wires()
-            for loop in loops:
+            graph = self.get_topology_graph(part)
+            for position, loop in enumerate(graph.wires):
                 expected_loop_index = self.entity_mapper.loop_index(loop)
                 assert expected_loop_index == len(loops_arr)
-                loops_arr.append(self.build_loop_data(top_exp, loop))
+                loops_arr.append(self.build_loop_data(graph, position))
         return loops_arr
 
 
     def build_halfedges_array(self, parts):
         halfedges_arr = []
         for part in parts:
-            oriented_top_exp = TopologyExplorer(part, ignore_orientation=False)
-            halfedges = oriented_top_exp.edges()
-            halfedge_set = set()
-            for halfedge in halfedges:
-                h = self.entity_mapper.get_hash(halfedge)
-                orientation = halfedge.Orientation()
-                tup = (h, orientation)
-                if not tup in halfedge_set:
-                    expected_halfedge_index = self.entity_mapper.halfedge_index(halfedge)
-                    assert expected_halfedge_index == len(halfedges_arr)
-                    halfedges_arr.append(self.build_halfedge_data(halfedge))
-                    halfedge_set.add(tup)
+            graph = self.get_topology_graph(part)
+            for halfedge in graph.halfedges:
+                expected_halfedge_index = self.entity_mapper.halfedge_index(halfedge)
+                assert expected_halfedge_index == len(halfedges_arr)
+                halfedges_arr.append(self.build_halfedge_data(halfedge))
         return halfedges_arr
 
     def build_part_data(self, part):
         solid_indices = []
-        top_exp = TopologyExplorer(part)
-        solids = top_exp.solids()
-        for solid in solids:
+        graph = self.get_topology_graph(part)
+        for solid in graph.solids:
             solid_index = self.entity_mapper.solid_index(solid)
             solid_indices.append(solid_index)
         return {
             "solids": solid_indices
         }
 
-    def build_solid_data(self, top_exp, solid):
+    def build_solid_data(self, graph, solid_position):
         shell_indices = []
-        shells = top_exp._loop_topo(TopAbs_SHELL, solid)
+        shells = graph.shells_of_solid(solid_position)
         for shell in shells:
             shell_orientation = orientation_to_sense(shell.Orientation())
             shell_indices.append(self.entity_mapper.shell_index(shell))
@@ -153,14 +165,18 @@ class TopologyDictBuilder:
         }
 
 
-    def build_shell_data(self, top_exp, shell):
+    def build_shell_data(self, graph, shell_position):
         face_list = []
-        faces = top_exp._loop_topo(TopAbs_FACE, shell)
+        shell = graph.shells[shell_position]
+        face_positions = graph.shell_faces[shell_position]
+        face_orientations = graph.shell_face_orientations[shell_position]
         shell_orientation = orientation_to_sense(shell.Orientation())
-        for face in faces:
+        for face_position, orientation in zip(face_positions, face_orientations):
+            face = graph.faces[face_position]
+
             # We need to know if this face-use has the same orientation 
             # as the "primary face-use"
-            face_orientation = orientation_to_sense(face.Orientation())
+            face_orientation = orientation_to_sense(int(orientation))
             primary_face_orientation = self.entity_mapper.primary_face_orientation(face)
 
             # Is this face-use oriented the same way as the primary face-use
@@ -177,9 +193,10 @@ class TopologyDictBuilder:
         }
 
 
-    def build_face_data(self, top_exp, face):
+    def build_face_data(self, graph, face_position):
         loop_indices = []
-        loops = top_exp.wires_from_face(face)
+        face = graph.faces[face_position]
+        loops = graph.wires_of_face(face_position)
         for loop in loops:
             loop_indices.append(self.entity_mapper.loop_index(loop))
         
@@ -202,7 +219,7 @@ class TopologyDictBuilder:
     ):
         """
         Check the correct vertex is used as the start and end vertex
-        given the geometry of the edge curve
+        given the geometry of the edge curve, returns False if not
         """
         curve = BRepAdaptor_Curve(edge)
         t_start = curve.FirstParameter()
@@ -218,11 +235,10 @@ class TopologyDictBuilder:
         # print(f"start_point_from_vertex {self.point_to_str(start_point_from_vertex)}")
         # print(f"end_point {self.point_to_str(end_point)}")
         # print(f"end_point_from_vertex {self.point_to_str(end_point_from_vertex)}")
-        
-        assert start_point.IsEqual(start_point_from_vertex, tolerance)
-        assert end_point.IsEqual(end_point_from_vertex, tolerance)
 
-    def build_edge_data(self, top_exp, edge):
+        return start_point.IsEqual(start_point_from_vertex, tolerance) and end_point.IsEqual(end_point_from_vertex, tolerance)
+
+    def build_edge_data(self, graph, edge):
         index_of_edge = self.entity_mapper.edge_index(edge)
         start_vertex = topexp.FirstVertex(edge)
         end_vertex = topexp.LastVertex(edge)
@@ -237,36 +253,53 @@ class TopologyDictBuilder:
         }
 
 
-    def build_loop_data(self, top_exp, loop):
-        nr = top_exp.number_of_faces_from_wires(loop)
+    def build_loop_data(self, graph, loop_position):
+        loop = graph.wires[loop_position]
+        nr = graph.wire_faces.count(loop_position)
         if not self.allow_nonmanifold:
             assert nr == 1
-        face = list(top_exp.faces_from_wire(loop))[0]
-        saw = ShapeAnalysis_Wire(loop, face, 1e-8)
-        #saw.Perform()
-        sd = {}
-        sd["order"] = saw.CheckOrder()
-        sd["connected"] = saw.CheckConnected()
-        sd["small"] = saw.CheckSmall()
-        sd["edgecurves"] = saw.CheckEdgeCurves()
-        sd["degenerated"] = saw.CheckDegenerated()
-        sd["closed"] = saw.CheckClosed()
-        
-        sd["sisect"] = saw.CheckSelfIntersection()
-        sd["lack"] = saw.CheckLacking()
-        sd["gap3d"] = saw.CheckGaps3d()
-        sd["gap2d"] = saw.CheckGaps2d()
-        sd["gapcurve"] = saw.CheckCurveGaps()
-        
+        face = graph.faces_of_wire(loop_position)[0]
+
         wire_exp = WireExplorer(loop)
         halfedge_indices = []
-        halfedges = wire_exp.ordered_edges()
+        # A list, the explorer gives an iterator and check_loop walks the edges again
+        halfedges = list(wire_exp.ordered_edges())
         for halfedge in halfedges:
             halfedge_indices.append(self.entity_mapper.halfedge_index(halfedge))
-        return {
+        loop_data = {
             "halfedges": halfedge_indices,
-            #"status": sd
         }
+        if self.validation != "off":
+            loop_data["status"] = self.check_loop(loop, face, halfedges)
+        return loop_data
+
+    def check_loop(self, loop, face, halfedges):
+        """
+        Run the checks of the validation level on a loop and return
+        them as a bitfield, bit i set if LOOP_CHECKS[i] found a problem
+        """
+        saw = ShapeAnalysis_Wire(loop, face, 1e-8)
+        checks = {
+            "order": saw.CheckOrder,
+            "connected": saw.CheckConnected,
+            "small": saw.CheckSmall,
+            "edgecurves": saw.CheckEdgeCurves,
+            "degenerated": saw.CheckDegenerated,
+            "closed": saw.CheckClosed,
+            "sisect": saw.CheckSelfIntersection,
+            "lack": saw.CheckLacking,
+            "gap3d": saw.CheckGaps3d,
+            "gap2d": saw.CheckGaps2d,
+            "gapcurve": saw.CheckCurveGaps,
+            "vertex_order": lambda: not all(self.debug_check_correct_vertex_order(
+                edge, topexp.FirstVertex(edge), topexp.LastVertex(edge)) for edge in halfedges),
+        }
+        names = FAST_LOOP_CHECKS if self.validation == "fast" else LOOP_CHECKS
+        status = 0
+        for name in names:
+            if checks[name]():
+                status |= 1 << LOOP_CHECKS.index(name)
+        return status
 
 
     def build_halfedge_data(self, halfedge):
@@ -0,0 +1,142 @@
+import numpy as np
+
+# Python OCC
+from OCC.Core.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
+                             TopAbs_SHELL, TopAbs_SOLID)
+
+
+# CAD
+from ..utils.topology import shape_key, unique_subshapes
+
+
+class Adjacency:
+    """
+    A list of index lists stored as one flat array of values
+    and an array of offsets into it, i.e. row i holds
+    values[offsets[i]:offsets[i+1]]
+    """
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @classmethod
+    def from_lists(cls, lists):
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(l) for l in lists], out=offsets[1:])
+        values = np.fromiter((v for l in lists for v in l), dtype=np.int64, count=offsets[-1])
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    def count(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def transpose(self, nr_rows):
+        """
+        Invert the relation.  Within each row of the result the
+        entries keep the order of the rows of this adjacency
+        """
+        rows = np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.offsets))
+        order = np.argsort(self.values, kind="stable")
+        offsets = np.zeros(nr_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.values, minlength=nr_rows), out=offsets[1:])
+        return Adjacency(rows[order], offsets)
+
+
+class TopologyGraph:
+    """
+    The child and ancestor relations between the entities of one part.
+
+    Every relation is built once, with a single walk over the part,
+    and stored as an Adjacency of positions into the entity lists
+    of the graph.  The entity lists are in the order of the
+    EntityMapper, so for a mapper built from this part alone
+    a position is the index written to the file.
+    """
+    def __init__(self, part):
+        self.part = part
+
+        self.solids = unique_subshapes(part, TopAbs_SOLID)
+        self.shells = unique_subshapes(part, TopAbs_SHELL)
+        self.faces = unique_subshapes(part, TopAbs_FACE)
+        self.wires = unique_subshapes(part, TopAbs_WIRE)
+        self.edges = unique_subshapes(part, TopAbs_EDGE)
+        self.halfedges = unique_subshapes(part, TopAbs_EDGE, ignore_orientation=False)
+        self.vertices = unique_subshapes(part, TopAbs_VERTEX)
+
+        self.shell_positions = self.build_positions(self.shells)
+        self.face_positions = self.build_positions(self.faces)
+        self.wire_positions = self.build_positions(self.wires)
+        self.edge_positions = self.build_positions(self.edges)
+        self.halfedge_positions = self.build_positions(self.halfedges, ignore_orientation=False)
+
+        # Children
+        self.solid_shells = self.build_children(self.solids, TopAbs_SHELL, self.shell_positions)
+        self.shell_faces, self.shell_face_orientations = self.build_shell_faces()
+        self.face_wires = self.build_children(self.faces, TopAbs_WIRE, self.wire_positions)
+        self.face_halfedges = self.build_children(self.faces, TopAbs_EDGE, self.halfedge_positions, ignore_orientation=False)
+        self.halfedge_edges = np.array([self.edge_positions[shape_key(h)] for h in self.halfedges], dtype=np.int64)
+
+        # Ancestors
+        self.shell_solids = self.solid_shells.transpose(len(self.shells))
+        self.face_shells = self.shell_faces.transpose(len(self.faces))
+        self.wire_faces = self.face_wires.transpose(len(self.wires))
+        self.edge_faces = self.build_face_edges().transpose(len(self.edges))
+
+    def build_positions(self, shapes, ignore_orientation=True):
+        return {shape_key(shape, ignore_orientation): i for i, shape in enumerate(shapes)}
+
+    def build_children(self, parents, topology_type, positions, ignore_orientation=True):
+        children = []
+        for parent in parents:
+            subshapes = unique_subshapes(parent, topology_type, ignore_orientation)
+            children.append([positions[shape_key(s, ignore_orientation)] for s in subshapes])
+        return Adjacency.from_lists(children)
+
+    def build_shell_faces(self):
+        """
+        Faces of each shell, together with the orientations
+        of the face-uses in that shell
+        """
+        children = []
+        orientations = []
+        for shell in self.shells:
+            faces = unique_subshapes(shell, TopAbs_FACE)
+            children.append([self.face_positions[shape_key(f)] for f in faces])
+            orientations.extend(f.Orientation() for f in faces)
+        shell_faces = Adjacency.from_lists(children)
+        return shell_faces, Adjacency(np.array(orientations, dtype=np.int8), shell_faces.offsets)
+
+    def build_face_edges(self):
+        edges = []
+        for i in range(len(self.faces)):
+            edges.append(np.unique(self.halfedge_edges[self.face_halfedges[i]]))
+        return Adjacency.from_lists(edges)
+
+    # Accessors for the shapes related to a given entity
+
+    def faces_of_wire(self, wire_position):
+        return [self.faces[i] for i in self.wire_faces[wire_position]]
+
+    def wires_of_face(self, face_position):
+        return [self.wires[i] for i in self.face_wires[face_position]]
+
+    def halfedges_of_face(self, face_position):
+        return [self.halfedges[i] for i in self.face_halfedges[face_position]]
+
+    def shells_of_solid(self, solid_position):
+        return [self.shells[i] for i in self.solid_shells[solid_position]]
+
+
+def topology_graph_for(part, topology_graph=None):
+    """
+    Reuse the given graph if it was built for this part,
+    otherwise build a new one
+    """
+    if topology_graph is not None and topology_graph.part.IsSame(part):
+        return topology_graph
+    return TopologyGraph(part)
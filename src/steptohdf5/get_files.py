@@ -1,61 +1,29 @@
 import sys
 import glob
-import os
-import time
-import random
 
-# Get the task id, directory, file pattern, and processed files list path as command line arguments
-task_id = int(sys.argv[1])
+from steptohdf5.work_queue import WorkQueue
+
+# Get the task id, directory, file pattern, and work queue database path as command line arguments
+task_id = sys.argv[1]
 directory = sys.argv[2]
 pattern = sys.argv[3]
-processed_files_path = sys.argv[4]
-
-# Get all files matching the pattern
-all_files = sorted(glob.glob(f"{directory}/{pattern}"))
-
-print(f"Found {len(all_files)} files matching the pattern in the directory.", file=sys.stderr)  # Debug line
-
-# The path of the lock file
-lock_file = f"{directory}/lock_file"
-
-while True:
-    # Check if the lock file exists
-    if not os.path.isfile(lock_file):
-        # Create the lock file
-        open(lock_file, 'w').close()
+queue_path = sys.argv[4]
 
-        # Read already processed files
-        if os.path.isfile(processed_files_path):
-            with open(processed_files_path, 'r') as f:
-                processed_files = f.read().splitlines()
-        else:
-            processed_files = []
+queue = WorkQueue(queue_path)
 
-        print(f"Found {len(processed_files)} already processed files.", file=sys.stderr)  # Debug line
-
-        # Get the list of unassigned files
-        unassigned_files = list(set(all_files) - set(processed_files))
-
-        print(f"Found {len(unassigned_files)} unassigned files.", file=sys.stderr)  # Debug line
-
-        # Select 500 or fewer files for this task
-        files_to_process = unassigned_files[:300]
-
-        # Update the list of processed files
-        processed_files.extend(files_to_process)
-        with open(processed_files_path, 'w') as f:
-            for item in processed_files:
-                f.write("%s\n" % item)
+# Add all files matching the pattern, files already queued are kept as they are
+all_files = sorted(glob.glob(f"{directory}/{pattern}"))
+added = queue.add(all_files)
 
-        # Delete the lock file
-        os.remove(lock_file)
+print(f"Found {len(all_files)} files matching the pattern in the directory, {added} newly queued.", file=sys.stderr)  # Debug line
 
-        # Print the files to standard output, one per line
-        for file in files_to_process:
-            print(file)
+# Claim a batch for this task without a lease, the files are handed out
+# for good like the old processed list.  Tasks which convert through
+# `steptohdf5 --queue` instead get leases, heartbeats and retries
+files_to_process = queue.claim(task_id, lease=False)
 
-        # Break the loop
-        break
+print(f"Claimed {len(files_to_process)} files, queue state: {queue.counts()}", file=sys.stderr)  # Debug line
 
-    # Sleep for a random amount of time (e.g., between 1 and 10 seconds) before trying again
-    time.sleep(random.randint(1, 10))
+# Print the files to standard output, one per line
+for file in files_to_process:
+    print(file)
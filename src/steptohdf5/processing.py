@@ -6,10 +6,23 @@ from pathlib import Path
 import multiprocessing
 import functools
 import os
+import json
+import time
+from collections import namedtuple
 from joblib import Parallel, delayed
 
 
-from .core.step_processor import StepProcessor
+from .core.provenance import (conversion_options, is_up_to_date, matches_provenance, read_failure_record,
+                              write_failure_record, remove_failure_record, read_recorded_options, remeshed_options)
+from .utils.cpu_budget import plan_cpu_budget, estimate_costs, load_recorded_times
+from .worker_pool import SupervisedPool, FAILURE_ERROR
+from .work_queue import Heartbeat, default_owner
+from .shards import ShardWriter, model_id, read_shard_index, share_image
+
+
+# Outcome of converting one file.  error and failure_kind are None on
+# success, info holds the wall time, part and face counts and output size
+ConversionResult = namedtuple("ConversionResult", ["file", "error", "failure_kind", "info"], defaults=[None])
 
 @contextlib.contextmanager
 def tqdm_joblib(tqdm_object):
@@ -45,22 +58,229 @@ def with_timeout(timeout):
     return decorator
 
 
+# Options of process_parts which remesh_parts takes as well
+REMESH_OPTIONS = ("mesh_deflection", "mesh_layout", "compression", "mesh_threads", "triangle_budget")
+
+
 # @with_timeout(60.0)
-def process_single_step(sf, output_dir, log_dir, produce_meshes=True):
+def process_single_step(sf, output_dir, log_dir, produce_meshes=True, options=None):
+    """
+    Convert a single step file.  options holds keyword arguments
+    for StepProcessor.process_parts, e.g. the topology layout,
+    shape_cache, a ShapeCache or its directory for load_step_file, and
+    remesh, which only replaces the meshes of an existing output with
+    StepProcessor.remesh_parts, and shard_size, with which the output is
+    not written but passed to a ShardWriter in shared memory, see
+    share_image.
+    Returns the file, the error message or None and a dict with the
+    wall time and the summary returned by process_parts
+    """
+    # Imported here, scheduling and resuming do not need OCC
+    from .core.step_processor import StepProcessor
+    options = dict(options) if options is not None else {}
+    shape_cache = options.pop("shape_cache", None)
+    remesh = options.pop("remesh", False)
+    sharded = options.pop("shard_size", None) is not None
+    start_time = time.perf_counter()
     try:
         if produce_meshes:
             sp = StepProcessor(sf, Path(output_dir), Path(log_dir))
         else:
             sp = StepProcessor(sf, Path(output_dir), Path(log_dir), mesh_builder=None)
 
-        sp.load_step_file()
-        sp.process_parts()
-        return sf, None
+        sp.load_step_file(shape_cache=shape_cache)
+        if remesh:
+            if sharded:
+                raise ValueError("Re-meshing needs one output file per model")
+            info = sp.remesh_parts(**remesh_arguments(options))
+        else:
+            info = sp.process_parts(in_memory=sharded, **options) or {}
+            if "image" in info:
+                info["shared_memory"] = share_image(info.pop("image"))
+        info["wall_time"] = time.perf_counter() - start_time
+        return sf, None, info
     except Exception as e:
-        return sf, str(e)
+        return sf, str(e), {"wall_time": time.perf_counter() - start_time}
+
+
+def remesh_arguments(options):
+    return {key: value for key, value in options.items() if key in REMESH_OPTIONS}
+
+
+def options_signature(sf, output_dir, options):
+    """
+    The conversion options recorded for a file converted with options.
+    Re-meshing keeps the options recorded in the output apart from the
+    mesh options it replaces, see remeshed_options
+    """
+    if options.get("remesh", False):
+        recorded = read_recorded_options(sf, output_dir)
+        if recorded is not None:
+            return conversion_options(**remeshed_options(recorded, **remesh_arguments(options)))
+    return conversion_options(**options)
+
+
+def resume_step_files(step_files, output_dir, options=None, retry_failed=False):
+    """
+    Split the files into those which still need converting and those
+    whose outcome is known from a previous run with the same converter
+    version and options: files with a complete, up to date output and,
+    unless retry_failed is set, files which failed.  Returns the files
+    to convert and (file, error message, failure kind) for the others.
+    With shard_size in the options, converted files are looked up in
+    the index of the shards.  With remesh, the outputs are compared
+    with the options they would have once re-meshed
+    """
+    if options is None:
+        options = {}
+    remesh = options.get("remesh", False)
+    signature = conversion_options(**options)
+    content_hash = options.get("content_hash", False)
+    shards = read_shard_index(output_dir) if options.get("shard_size") is not None else None
+    pending = []
+    known = []
+    for sf in step_files:
+        if remesh:
+            signature = options_signature(sf, output_dir, options)
+        if shards is None:
+            done = is_up_to_date(sf, output_dir, signature, content_hash)
+        else:
+            done = model_id(sf) in shards and matches_provenance(shards[model_id(sf)], sf, signature, content_hash)
+        if done:
+            known.append((sf, None, None))
+            continue
+        record = None if retry_failed else read_failure_record(sf, output_dir, signature, content_hash)
+        if record is not None:
+            known.append((sf, record["error"], record["failure_kind"]))
+        else:
+            pending.append(sf)
+    return pending, known
+
+
+def record_result(sf, output_dir, options, error, failure_kind):
+    """
+    Leave a failure record next to the output of a failed file and
+    remove the stale record of a file which converted
+    """
+    if error is None:
+        remove_failure_record(sf, output_dir)
+        return
+    try:
+        write_failure_record(sf, output_dir, options_signature(sf, output_dir, options), error, failure_kind,
+                             options.get("content_hash", False))
+    except OSError:
+        logging.warning("Could not write the failure record of %s" % sf)
+
+
+def manifest_entry(result):
+    """
+    One line of the JSONL manifest, for a ConversionResult
+    """
+    entry = {"file": str(result.file), "error": result.error, "failure_kind": result.failure_kind}
+    entry.update(result.info or {})
+    return entry
+
+
+def iter_convert_step_files(step_files, output_dir, log_dir, options=None, cpu_budget=None, worker_limits=None, resume=False, retry_failed=False, cache=None, manifest=None, n_jobs=None, recorded_times=None, shard_writer=None):
+    """
+    Convert the files in parallel within a budget of cpu_budget CPUs
+    (all available by default), see plan_cpu_budget.  With worker_limits
+    the files are converted by a SupervisedPool enforcing them, otherwise
+    by joblib.  Yields a ConversionResult for each file as soon as it
+    completes, and appends it to the JSONL file manifest if given, so that
+    nothing is lost if the run is killed.  With resume, files already
+    converted or failed by a previous run are not converted again, see
+    resume_step_files.  With a ContentCache, files with the same content
+    and options are converted once.  The most expensive files are
+    dispatched first, their cost is estimated from their size and the
+    times recorded in the manifest by earlier runs, see estimate_costs.
+    n_jobs caps the number of worker processes.  With shard_size in the
+    options the outputs are packed into shards of that many bytes by one
+    ShardWriter process, shard_writer if given
+    """
+    if options is None:
+        options = {}
+    sharded = options.get("shard_size") is not None
+    if sharded and cache is not None:
+        raise ValueError("The content cache needs one output file per model")
+    if options.get("remesh", False) and cache is not None:
+        # The re-meshed outputs keep their recorded layouts, not those of the options
+        raise ValueError("The content cache can not be used with remesh")
+    known = []
+    if resume:
+        step_files, known = resume_step_files(step_files, output_dir, options, retry_failed)
+        if len(known) > 0:
+            logging.info("Resuming, %i of %i files are already done" % (len(known), len(known) + len(step_files)))
+    known = [ConversionResult(sf, error, failure_kind, {"source": "resume"}) for sf, error, failure_kind in known]
+    if cache is not None:
+        step_files, hits = cache.partition(step_files, output_dir, options)
+        known.extend(ConversionResult(sf, error, failure_kind, {"source": "cache"}) for sf, error, failure_kind in hits)
+    if recorded_times is None:
+        recorded_times = {} if manifest is None else load_recorded_times(manifest)
+    # The daemonic workers of a SupervisedPool cannot start part workers
+    part_jobs = 1 if options.get("remesh", False) else options.get("part_jobs", 1)
+    if part_jobs > 1 and worker_limits is not None:
+        logging.warning("Part workers cannot be used with worker limits, the parts of each file are processed one after another")
+        part_jobs = 1
+    plan = plan_cpu_budget(step_files, cpu_budget, max_jobs=n_jobs, costs=estimate_costs(step_files, recorded_times),
+                           part_jobs=part_jobs)
 
+    def outcomes(sf, error, failure_kind, info):
+        if info is not None and "shared_memory" in info:
+            shard_writer.submit(model_id(sf), *info.pop("shared_memory"))
+            info["sharded"] = True
+        results = [ConversionResult(sf, error, failure_kind, dict(info or {}, source="conversion"))]
+        if cache is not None:
+            results.extend(ConversionResult(other_sf, other_error, other_kind, {"source": "cache"})
+                           for other_sf, other_error, other_kind in cache.finish(sf, output_dir, error, failure_kind))
+        return results
 
-def process_step_folder(input_dir, output_dir, log_dir, file_pattern="*.stp", file_range=[0, -1]):
+    def converted():
+        yield from known
+        if len(plan.files) == 0:
+            return
+        with tqdm(desc="Processing step files", total=len(step_files)) as progress_bar:
+            # One pool for all files, each with the threads of its plan
+            file_options = {sf: dict(options, mesh_threads=plan.threads[sf]) for sf in plan.files}
+            if worker_limits is None:
+                # Dispatched one at a time in plan order, batches could put a large file behind small ones
+                results = Parallel(n_jobs=plan.n_jobs, batch_size=1, return_as="generator_unordered")(
+                    delayed(process_single_step)(sf, output_dir, log_dir, options=file_options[sf]) for sf in plan.files)
+                for sf, error, info in results:
+                    progress_bar.update()
+                    yield from outcomes(sf, error, None if error is None else FAILURE_ERROR, info)
+            else:
+                pool = SupervisedPool(process_single_step, plan.n_jobs, worker_limits)
+                arguments = [(sf, output_dir, log_dir, True, file_options[sf]) for sf in plan.files]
+                for args, result, failure_kind, message in pool.map(arguments, progress=progress_bar.update):
+                    if failure_kind is None:
+                        sf, message, info = result
+                        failure_kind = None if message is None else FAILURE_ERROR
+                    else:
+                        sf, info = args[0], None
+                    yield from outcomes(sf, message, failure_kind, info)
+
+    with contextlib.ExitStack() as stack:
+        manifest_file = None if manifest is None else stack.enter_context(open(manifest, "a"))
+        if sharded and shard_writer is None:
+            shard_writer = stack.enter_context(ShardWriter(output_dir, options["shard_size"]))
+        for result in converted():
+            if result.info.get("source") != "resume":
+                record_result(result.file, output_dir, options, result.error, result.failure_kind)
+            if manifest_file is not None:
+                manifest_file.write(json.dumps(manifest_entry(result)) + "\n")
+                manifest_file.flush()
+            yield result
+
+
+def convert_step_files(step_files, output_dir, log_dir, options=None, cpu_budget=None, worker_limits=None, resume=False, retry_failed=False, cache=None, manifest=None, n_jobs=None):
+    """
+    List of the ConversionResults of iter_convert_step_files
+    """
+    return list(iter_convert_step_files(step_files, output_dir, log_dir, options, cpu_budget, worker_limits, resume, retry_failed, cache, manifest, n_jobs))
+
+
+def process_step_folder(input_dir, output_dir, log_dir, file_pattern="*.stp", file_range=[0, -1], options=None, cpu_budget=None, worker_limits=None, resume=False, retry_failed=False, cache=None, manifest=None, n_jobs=None):
     data_dir = Path(input_dir)
     output_dir = Path(output_dir)
     log_dir = Path(log_dir)
@@ -80,19 +300,22 @@ def process_step_folder(input_dir, output_dir, log_dir, file_pattern="*.stp", fi
     success_files = []
     failed_files = []
 
-    with tqdm_joblib(tqdm(desc="Processing step files", total=len(step_files))) as progress_bar:
-        results = Parallel(n_jobs=4)(delayed(process_single_step)(sf, output_dir, log_dir) for sf in step_files)
-
-    for sf, error_message in results:
+    for sf, error_message, failure_kind, _ in iter_convert_step_files(step_files, output_dir, log_dir, options, cpu_budget, worker_limits, resume, retry_failed, cache, manifest, n_jobs):
         if error_message is None:
             success_files.append(sf)
         else:
-            failed_files.append((sf, error_message))
+            failed_files.append((sf, error_message, failure_kind))
+    if cache is not None:
+        logging.info(cache.summary())
 
     return success_files, failed_files
 
 
-def process_step_files(input_file_list, output_dir, log_dir):
+def iter_process_step_files(input_file_list, output_dir, log_dir, options=None, cpu_budget=None, worker_limits=None, resume=False, retry_failed=False, cache=None, manifest=None, n_jobs=None):
+    """
+    Convert the files listed in a text file, one per line, yielding
+    a ConversionResult per file as it completes
+    """
     output_dir = Path(output_dir)
     log_dir = Path(log_dir)
 
@@ -100,21 +323,77 @@ def process_step_files(input_file_list, output_dir, log_dir):
     os.makedirs(log_dir, exist_ok=True)
 
     with open(input_file_list, 'r') as f:
-        input_files = [Path(line.strip()) for line in f]
+        input_files = [Path(line.strip()) for line in f if line.strip()]
 
-    success_files = []
-    failed_files = []
+    yield from iter_convert_step_files(input_files, output_dir, log_dir, options, cpu_budget, worker_limits, resume, retry_failed, cache, manifest, n_jobs)
+    if cache is not None:
+        logging.info(cache.summary())
 
 
-    with tqdm_joblib(tqdm(desc="Processing step files", total=len(input_files))) as progress_bar:
-        results = Parallel(n_jobs=4)(delayed(process_single_step)(sf, output_dir, log_dir) for sf in input_files)
-    model_names = []
+def process_step_files(input_file_list, output_dir, log_dir, options=None, cpu_budget=None, worker_limits=None, resume=False, retry_failed=False, cache=None, manifest=None, n_jobs=None):
+    success_files = []
+    failed_files = []
 
-    for sf, error_message in results:
+    for sf, error_message, failure_kind, _ in iter_process_step_files(input_file_list, output_dir, log_dir, options, cpu_budget, worker_limits, resume, retry_failed, cache, manifest, n_jobs):
         if error_message is None:
             success_files.append(sf)
-            model_names.append(sf.name)
         else:
-            failed_files.append((sf, error_message))
+            failed_files.append((sf, error_message, failure_kind))
 
     return success_files, failed_files
+
+
+def iter_process_queue(queue, output_dir, log_dir, owner=None, options=None, cpu_budget=None, worker_limits=None, resume=False, cache=None, manifest=None, n_jobs=None):
+    """
+    Convert files claimed from a WorkQueue until it is drained, yielding
+    a ConversionResult per file.  The leases of the claimed batch are
+    renewed in the background while it is converted, converted files are
+    marked done and failed ones given back to the queue, which caps the
+    retries.  Failure records therefore do not stop a retry.  With
+    shard_size in the options one ShardWriter serves all batches, and
+    converted files are only marked done once their shard is closed
+    """
+    output_dir = Path(output_dir)
+    log_dir = Path(log_dir)
+    if owner is None:
+        owner = default_owner()
+
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+    recorded_times = {} if manifest is None else load_recorded_times(manifest)
+
+    # One writer for all batches, so that shards fill up across batches
+    shard_writer = None
+    written = {}
+    with contextlib.ExitStack() as stack:
+        if options is not None and options.get("shard_size") is not None:
+            shard_writer = stack.enter_context(ShardWriter(output_dir, options["shard_size"], prefix=owner))
+        while True:
+            batch = queue.claim(owner)
+            if len(batch) == 0:
+                break
+            queued_paths = {Path(sf): sf for sf in batch}
+            with Heartbeat(queue, owner):
+                for result in iter_convert_step_files(list(queued_paths), output_dir, log_dir, options, cpu_budget, worker_limits, resume, True, cache, manifest, n_jobs, recorded_times, shard_writer):
+                    if result.error is not None:
+                        queue.fail(queued_paths[result.file], owner, result.error)
+                    elif not result.info.get("sharded", False):
+                        queue.complete(queued_paths[result.file], owner)
+                    else:
+                        written[model_id(result.file)] = queued_paths[result.file]
+                    if shard_writer is not None:
+                        complete_written(queue, owner, written, shard_writer.closed_models())
+                    yield result
+    if shard_writer is not None:
+        complete_written(queue, owner, written, shard_writer.closed_models())
+    if cache is not None:
+        logging.info(cache.summary())
+
+
+def complete_written(queue, owner, written, keys):
+    """
+    Mark the files of the models in closed shards done
+    """
+    for key in keys:
+        if key in written:
+            queue.complete(written.pop(key), owner)
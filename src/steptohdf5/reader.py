@@ -0,0 +1,430 @@
+import json
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+
+from .shards import read_shard_index
+
+
+# Budget of the cache of decoded arrays of a file in bytes
+DEFAULT_CACHE_BYTES = 256 << 20
+
+# Smaller datasets are read rather than mapped, a view of the map
+# saves nothing on them
+MIN_MEMMAP_BYTES = 4096
+
+
+class ArrayCache:
+    """
+    Least recently used cache of the arrays read from a file, bounded
+    by their total size.  Views of the memory map of the file cost no
+    memory until they are touched and are not counted.  Cached arrays
+    are read-only, since they are shared by every view asking for them
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.arrays = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load, mapped=False):
+        """
+        The array cached under key, loaded by calling load on a miss.
+        mapped is set for views of the memory map
+        """
+        if key in self.arrays:
+            self.arrays.move_to_end(key)
+            self.hits += 1
+            return self.arrays[key][0]
+        self.misses += 1
+        array = load()
+        if isinstance(array, np.ndarray):
+            array.flags.writeable = False
+        size = 0 if mapped or not isinstance(array, np.ndarray) else array.nbytes
+        if size > self.max_bytes:
+            return array
+        self.arrays[key] = (array, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_size) = self.arrays.popitem(last=False)
+            self.nbytes -= evicted_size
+        return array
+
+    def clear(self):
+        self.arrays.clear()
+        self.nbytes = 0
+
+
+def can_memmap(dataset):
+    """
+    Whether the dataset is stored as one contiguous, unfiltered block of
+    plain numbers in a file on disk, so that it can be mapped directly
+    """
+    if dataset.file.driver != "sec2" or dataset.chunks is not None or dataset.nbytes < MIN_MEMMAP_BYTES:
+        return False
+    if dataset.dtype.kind not in "biuf" or dataset.external:
+        return False
+    return dataset.id.get_offset() is not None
+
+
+def read_dataset(dataset):
+    """
+    The content of a dataset as an array, scalar strings are decoded
+    """
+    value = dataset[()]
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+def is_row_group(group):
+    """
+    Groups of datasets named 0, 1, ..., such as the rows of the surface
+    weights in the group layout
+    """
+    return len(group) > 0 and all(name.isdigit() and isinstance(item, h5py.Dataset) for name, item in group.items())
+
+
+class File:
+    """
+    Lazy view of a converted HDF5 file.  Nothing is read when parts,
+    faces and meshes are accessed, datasets are read when an array is
+    asked for and kept in an ArrayCache.  The file is memory mapped
+    once, uncompressed contiguous datasets are read-only views of the
+    map instead of copies, so a training loader only pays for the pages
+    it touches.  Both the group and the columnar
+    layouts are read.  root is the group of the model in a shard file,
+    see open_model.
+
+        with File("Model.hdf5") as f:
+            points, triangles = f.parts[0].face(3).mesh()
+    """
+    def __init__(self, path, cache_bytes=DEFAULT_CACHE_BYTES, memmap=True, root="/"):
+        self.path = path
+        self.file = h5py.File(path, "r")
+        self.root = self.file[root]
+        self.cache = ArrayCache(cache_bytes)
+        self.memmap = memmap
+        self.__map = None
+        self.__parts = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close the file.  The map is released once no array viewing it
+        is left
+        """
+        self.cache.clear()
+        self.__map = None
+        self.file.close()
+
+    @property
+    def version(self):
+        return self.root["parts"].attrs.get("version", "2.0")
+
+    @property
+    def options(self):
+        """
+        The recorded conversion options, None for files written before
+        they were recorded
+        """
+        options = self.root.attrs.get("options")
+        return None if options is None else json.loads(options)
+
+    @property
+    def parts(self):
+        """
+        The parts in the order of their index
+        """
+        if self.__parts is None:
+            names = sorted(self.root["parts"].keys(), key=lambda name: int(name.split("_")[-1]))
+            self.__parts = [Part(self, self.root["parts"][name]) for name in names]
+        return self.__parts
+
+    def __len__(self):
+        return len(self.parts)
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def __getitem__(self, index):
+        return self.parts[index]
+
+    def array(self, dataset):
+        """
+        The whole content of a dataset, from the cache
+        """
+        if self.memmap and can_memmap(dataset):
+            return self.cache.get(dataset.name, lambda: self.__mapped(dataset), mapped=True)
+        return self.cache.get(dataset.name, lambda: read_dataset(dataset))
+
+    def rows(self, dataset, start, stop):
+        """
+        Rows start to stop of a dataset, read without reading the rest
+        of the dataset unless it is memory mapped
+        """
+        if self.memmap and can_memmap(dataset):
+            return self.array(dataset)[start:stop]
+        return self.cache.get((dataset.name, start, stop), lambda: dataset[start:stop])
+
+    def __mapped(self, dataset):
+        """
+        A view of the content of a dataset in the memory map of the file
+        """
+        if self.__map is None:
+            self.__map = np.memmap(self.file.filename, dtype=np.uint8, mode="r")
+        return np.frombuffer(self.__map, dtype=dataset.dtype, count=dataset.size,
+                             offset=dataset.id.get_offset()).reshape(dataset.shape)
+
+
+def open_model(output_dir, model_id, **kwargs):
+    """
+    The File view of a model written to the shards under output_dir,
+    see ShardWriter.  model_id is grandparent/parent/stem of the STEP
+    file.  Keyword arguments are passed to File
+    """
+    model = read_shard_index(output_dir).get(model_id)
+    if model is None:
+        raise KeyError("No model %s in the shards of %s" % (model_id, output_dir))
+    return File(model["shard"], root=model["group"], **kwargs)
+
+
+class Part:
+    """
+    Lazy view of one part/part_NNN group
+    """
+    def __init__(self, file, group):
+        self.file = file
+        self.group = group
+
+    @property
+    def name(self):
+        return self.group.name.split("/")[-1]
+
+    @property
+    def index(self):
+        """
+        Index of the part in the STEP file
+        """
+        if "index" in self.group.attrs:
+            return int(self.group.attrs["index"])
+        return int(self.name.split("_")[-1]) - 1
+
+    @property
+    def bbox(self):
+        return self.file.array(self.group["geometry/bbox"])
+
+    def __len__(self):
+        """
+        Number of faces
+        """
+        faces = self.group["topology/faces"]
+        if faces.attrs.get("count") is not None:
+            return int(faces.attrs["count"])
+        return len(faces)
+
+    def face(self, index):
+        return Face(self, index)
+
+    @property
+    def faces(self):
+        return [Face(self, i) for i in range(len(self))]
+
+    def mesh(self, lod=None):
+        """
+        The meshes of the part, at level of detail lod for files written
+        with several of them, the finest by default
+        """
+        group = self.group["mesh"]
+        lods = int(group.attrs.get("lods", 0))
+        if lods == 0:
+            if lod not in (None, 0):
+                raise ValueError("The part has no meshes at levels of detail")
+            return Mesh(self.file, group)
+        if lod is None:
+            lod = lods - 1
+        if not 0 <= lod < lods:
+            raise ValueError("No level of detail %i, the part has %i" % (lod, lods))
+        return Mesh(self.file, group["lod_%i" % lod])
+
+    def topology(self, table, index):
+        """
+        Entity index of a topology table (faces, edges, loops, ...) as a
+        dict of its fields
+        """
+        group = self.group["topology"][table]
+        if group.parent.attrs.get("layout") == "columnar":
+            return self.__columnar_row(group, index)
+        return self.__group_entity(group[str(index).zfill(3)])
+
+    def geometry(self, table, index):
+        """
+        Entity index of surfaces, 3dcurves or 2dcurves as a dict of its
+        fields
+        """
+        group = self.group["geometry"][table]
+        if group.attrs.get("layout") == "columnar":
+            return self.__columnar_entity(group, index)
+        return self.__group_entity(group[str(index).zfill(3)])
+
+    def geometry_table(self, table, entity_type):
+        """
+        All entities of one type of a columnar surfaces, 3dcurves or
+        2dcurves table, e.g. geometry_table("surfaces", "bspline").  The
+        fixed size fields are one structured array data, the ragged
+        fields (values, offsets, shapes) triples
+        """
+        group = self.group["geometry"][table]
+        if group.attrs.get("layout") != "columnar":
+            raise ValueError("Geometry tables need the columnar geometry layout")
+        types = [t.lower() for t in group.attrs["types"]]
+        if entity_type.lower() not in types:
+            return None
+        table_group = group[entity_type.lower()]
+        result = {}
+        for key, item in table_group.items():
+            if isinstance(item, h5py.Dataset):
+                result[key] = self.file.array(item)
+            elif "values" in item:
+                result[key] = {name: self.file.array(dataset) for name, dataset in item.items()}
+        return result
+
+    def __group_entity(self, group):
+        result = {}
+        for key, item in group.items():
+            if isinstance(item, h5py.Dataset):
+                result[key] = self.file.array(item)
+            elif is_row_group(item):
+                result[key] = [self.file.array(item[str(i)]) for i in range(len(item))]
+            else:
+                result[key] = self.__group_entity(item)
+        return result
+
+    def __columnar_row(self, group, index):
+        return {key: self.__columnar_value(item, index) for key, item in group.items()}
+
+    def __columnar_rows(self, group, start, stop):
+        """
+        Rows start to stop of a columnar table, such as the values of a
+        CSR column of dictionaries, as a dict of field arrays
+        """
+        result = {}
+        for key, item in group.items():
+            if isinstance(item, h5py.Dataset):
+                result[key] = self.file.array(item)[start:stop]
+            else:
+                result[key] = [self.__columnar_value(item, i) for i in range(start, stop)]
+        return result
+
+    def __columnar_value(self, item, index):
+        """
+        Row index of one column of a columnar table, a dataset, a CSR
+        values/offsets group or a group of one dataset per row
+        """
+        if isinstance(item, h5py.Dataset):
+            return self.file.array(item)[index]
+        if "offsets" in item:
+            offsets = self.file.array(item["offsets"])
+            values = item["values"]
+            if isinstance(values, h5py.Dataset):
+                return self.file.array(values)[offsets[index]:offsets[index + 1]]
+            return self.__columnar_rows(values, offsets[index], offsets[index + 1])
+        return self.file.array(item[str(index).zfill(3)])
+
+    def __columnar_entity(self, group, index):
+        entity_type, row = self.file.array(group["index"])[index]
+        table = group[group.attrs["types"][entity_type].lower()]
+        result = {"type": group.attrs["types"][entity_type]}
+        data = self.file.array(table["data"])
+        for key in data.dtype.names:
+            result[key] = data[key][row]
+        for key, item in table.items():
+            if key == "data":
+                continue
+            if "index" in item:
+                result[key] = self.__columnar_entity(item, row)
+            else:
+                offsets = self.file.array(item["offsets"])
+                values = self.file.array(item["values"])
+                result[key] = values[offsets[row]:offsets[row + 1]].reshape(self.file.array(item["shapes"])[row])
+        return result
+
+
+class Mesh:
+    """
+    Lazy view of the meshes of a part at one level of detail, in the
+    per face or the concatenated layout
+    """
+    def __init__(self, file, group):
+        self.file = file
+        self.group = group
+        self.concatenated = group.attrs.get("layout") == "concatenated"
+
+    @property
+    def parameters(self):
+        """
+        The deflections and triangle budget the meshes were made with
+        """
+        return {key: value for key, value in self.group.attrs.items() if key not in ("layout", "lods")}
+
+    def __len__(self):
+        if self.concatenated:
+            return len(self.group["face_triangle_offsets"]) - 1
+        return len(self.group)
+
+    def face(self, index):
+        """
+        The points and triangles of the mesh of face index, the
+        triangles index into the points
+        """
+        if not self.concatenated:
+            face_group = self.group[str(index).zfill(3)]
+            return self.file.array(face_group["points"]), self.file.array(face_group["triangle"])
+        vertex_offsets = self.file.array(self.group["face_vertex_offsets"])
+        triangle_offsets = self.file.array(self.group["face_triangle_offsets"])
+        points = self.file.rows(self.group["points"], vertex_offsets[index], vertex_offsets[index + 1])
+        triangles = self.file.rows(self.group["triangle"], triangle_offsets[index], triangle_offsets[index + 1])
+        return points, triangles - vertex_offsets[index]
+
+    def arrays(self):
+        """
+        The points and triangles of all faces as one mesh
+        """
+        if self.concatenated:
+            return self.file.array(self.group["points"]), self.file.array(self.group["triangle"])
+        meshes = [self.face(i) for i in range(len(self))]
+        offsets = np.cumsum([0] + [len(points) for points, _ in meshes])
+        points = np.concatenate([points for points, _ in meshes]) if meshes else np.zeros((0, 3))
+        triangles = (np.concatenate([triangles + offset for (_, triangles), offset in zip(meshes, offsets)])
+                     if meshes else np.zeros((0, 3), dtype=np.int64))
+        return points, triangles
+
+
+class Face:
+    """
+    Lazy view of one face of a part, its topology, surface and mesh
+    """
+    def __init__(self, part, index):
+        self.part = part
+        self.index = index
+
+    @property
+    def topology(self):
+        return self.part.topology("faces", self.index)
+
+    @property
+    def surface(self):
+        return self.part.geometry("surfaces", int(self.topology["surface"]))
+
+    def mesh(self, lod=None):
+        """
+        The points and triangles of the mesh of the face
+        """
+        return self.part.mesh(lod).face(self.index)
@@ -0,0 +1,272 @@
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+from multiprocessing import shared_memory, resource_tracker
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from .core.provenance import hdf5_output_path
+from .work_queue import default_owner
+
+
+# Shards are closed once they reach this size in bytes
+DEFAULT_SHARD_SIZE = 2 << 30
+
+# Name of the index of the closed shards in the shard directory
+INDEX_NAME = "index.jsonl"
+
+# Root attributes of a model recorded in the index, see write_provenance
+PROVENANCE_KEYS = ("converter_version", "options", "input_size", "input_mtime", "input_hash")
+
+
+def model_id(step_file):
+    """
+    Identifier of the model of a STEP file, grandparent/parent/stem as in
+    the path of its output file
+    """
+    return hdf5_output_path(step_file, "").with_suffix("").as_posix()
+
+
+def shard_dir(output_dir):
+    return Path(output_dir) / "shards"
+
+
+def share_image(image):
+    """
+    Copy the image of an HDF5 file into a new block of shared memory and
+    return its name and size.  The block outlives this process, the
+    shard writer unlinks it once the model is written
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(len(image), 1))
+    # Otherwise the resource tracker of a worker unlinks the block when
+    # the worker exits, possibly before the writer got to it
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.buf[:len(image)] = image
+    block.close()
+    return block.name, len(image)
+
+
+def take_image(name, size):
+    """
+    The image in a block of shared memory made by share_image, as an
+    in memory file.  The block is unlinked
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return io.BytesIO(bytes(block.buf[:size]))
+    finally:
+        block.close()
+        block.unlink()
+
+
+def read_shard_index(output_dir):
+    """
+    The models of the closed shards under output_dir, as a dict from
+    model ID to a dict with the path of its shard, its group and its
+    provenance attributes.  Models written again later win
+    """
+    path = shard_dir(output_dir) / INDEX_NAME
+    models = {}
+    if not path.exists():
+        return models
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash
+                continue
+            for key, model in entry["models"].items():
+                models[key] = dict(model, shard=str(shard_dir(output_dir) / entry["shard"]))
+    return models
+
+
+class Shard:
+    """
+    An open shard file.  Models are written to a temporary file as
+    groups models/NNNNNN, closing the shard writes the index table from
+    model ID to group, renames the file into place and appends its
+    models to the index of the shard directory.  A shard left open by
+    a crash is never renamed, so the closed shards and the index stay
+    consistent and only the models of the open shard are lost
+    """
+    def __init__(self, directory, name):
+        self.directory = Path(directory)
+        self.name = name
+        self.path = self.directory / name
+        self.tmp_path = self.directory / (".%s.tmp" % name)
+        self.file = h5py.File(self.tmp_path, "w")
+        self.models = self.file.create_group("models")
+        self.index = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def size(self):
+        self.file.flush()
+        return os.path.getsize(self.tmp_path)
+
+    def add(self, key, image):
+        """
+        Copy the content and root attributes of a model file image into
+        a new group
+        """
+        group_name = "models/%06i" % len(self.models)
+        with h5py.File(image, "r") as source:
+            group = self.file.create_group(group_name)
+            for name, value in source.attrs.items():
+                group.attrs[name] = value
+            for name in source:
+                source.copy(source[name], group)
+            self.index[key] = dict({name: json_value(source.attrs[name]) for name in PROVENANCE_KEYS if name in source.attrs},
+                                   group=group_name)
+
+    def close(self):
+        keys = list(self.index)
+        table = np.array([(key, self.index[key]["group"]) for key in keys],
+                         dtype=[("model_id", h5py.string_dtype()), ("group", h5py.string_dtype())])
+        self.file.create_dataset("index", data=table)
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        append_index_line(self.directory / INDEX_NAME, json.dumps({"shard": self.name, "models": self.index}))
+
+
+def append_index_line(path, line):
+    """
+    Append a line to the index.  A line cut short by a crash is ended
+    first, so that only that line is lost and not the new one
+    """
+    with open(path, "a+b") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write(line.encode("utf-8") + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def json_value(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def shard_name(prefix, number):
+    return "shard_%s_%05i.hdf5" % (prefix, number)
+
+
+def write_shards(models, closed, directory, prefix, shard_size):
+    """
+    Write the models received from the queue models into shards of
+    about shard_size bytes until None is received, and put the model
+    IDs of each shard on the queue closed once it is closed.  A model
+    which fails to be written is logged and skipped
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    shard = None
+    nr_shards = 0
+    # Shards of earlier runs with the same prefix are kept
+    while (directory / shard_name(prefix, nr_shards)).exists():
+        nr_shards += 1
+    while True:
+        item = models.get()
+        if item is None:
+            break
+        key, name, size = item
+        try:
+            image = take_image(name, size)
+            if shard is not None and len(shard) > 0 and shard.size() + size > shard_size:
+                shard.close()
+                closed.put(list(shard.index))
+                shard = None
+            if shard is None:
+                shard = Shard(directory, shard_name(prefix, nr_shards))
+                nr_shards += 1
+            shard.add(key, image)
+        except Exception:
+            logging.exception("Could not write model %s to its shard" % key)
+    if shard is not None:
+        shard.close()
+        closed.put(list(shard.index))
+
+
+class ShardWriter:
+    """
+    A dedicated process packing the models converted by all workers into
+    shard files under output_dir/shards, instead of one file per model.
+    Workers pass the image of a model file in shared memory, see
+    share_image, so only its name goes through the queue.  At most
+    max_pending models wait for the writer, submit blocks beyond that.
+    A model is only safe once its shard is closed, see closed_models
+    """
+    def __init__(self, output_dir, shard_size=DEFAULT_SHARD_SIZE, prefix=None, max_pending=64, mp_context="spawn"):
+        self.directory = shard_dir(output_dir)
+        self.shard_size = shard_size
+        self.prefix = prefix if prefix is not None else default_owner()
+        context = multiprocessing.get_context(mp_context)
+        self.models = context.Queue(max_pending)
+        self.closed = context.Queue()
+        self.closed_keys = []
+        self.process = context.Process(target=write_shards, args=(self.models, self.closed, self.directory, self.prefix, shard_size),
+                                       daemon=True)
+
+    def __enter__(self):
+        self.process.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def submit(self, key, name, size):
+        """
+        Hand the model in shared memory block name over to the writer
+        """
+        while True:
+            if not self.process.is_alive():
+                take_image(name, size)
+                raise RuntimeError("The shard writer exited with code %s" % self.process.exitcode)
+            try:
+                self.models.put((key, name, size), timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+    def closed_models(self):
+        """
+        The IDs of the models in the shards closed since the last call
+        """
+        while True:
+            try:
+                self.closed_keys.extend(self.closed.get_nowait())
+            except queue.Empty:
+                break
+        keys, self.closed_keys = self.closed_keys, []
+        return keys
+
+    def close(self):
+        """
+        Close the open shard and wait for the writer to exit.  Raises
+        RuntimeError if the writer did not exit cleanly, the models
+        submitted since its last closed shard are then lost
+        """
+        if self.process.is_alive():
+            self.models.put(None)
+        # The writer only exits once the closed queue is drained
+        while self.process.is_alive() or not self.closed.empty():
+            try:
+                self.closed_keys.extend(self.closed.get(timeout=0.1))
+            except queue.Empty:
+                pass
+        self.process.join()
+        if self.process.exitcode != 0:
+            raise RuntimeError("The shard writer exited with code %s" % self.process.exitcode)
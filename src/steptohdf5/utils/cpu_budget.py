@@ -0,0 +1,118 @@
+import json
+import os
+from collections import namedtuple
+
+
+# The files in the order they are handed to n_jobs worker processes,
+# and the number of threads OCC algorithms run on for each file
+CpuPlan = namedtuple("CpuPlan", ["files", "n_jobs", "threads"])
+
+
+def available_cpus():
+    """
+    Number of CPUs this process may run on
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def load_recorded_times(manifest):
+    """
+    Wall time of the last conversion of each file recorded in a JSONL
+    result manifest, empty if there is none
+    """
+    times = {}
+    try:
+        with open(manifest, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("wall_time") is not None and entry.get("source", "conversion") == "conversion":
+                    times[entry["file"]] = entry["wall_time"]
+    except OSError:
+        pass
+    return times
+
+
+def estimate_costs(files, recorded_times=None):
+    """
+    Expected conversion time of each file.  Files converted before
+    cost their recorded time, the others their size times the median
+    time per byte of the recorded files.  Without records the cost
+    is the size, which orders the files the same way
+    """
+    if recorded_times is None:
+        recorded_times = {}
+    sizes = {f: file_size(f) for f in files}
+    rates = sorted(recorded_times[str(f)] / sizes[f] for f in files if str(f) in recorded_times and sizes[f] > 0)
+    seconds_per_byte = rates[len(rates) // 2] if len(rates) > 0 else 1.0
+    return {f: recorded_times.get(str(f), sizes[f] * seconds_per_byte) for f in files}
+
+
+def plan_cpu_budget(files, cpu_budget=None, large_file_size=20 * 1024**2, max_threads=8, max_jobs=None, costs=None, part_jobs=1):
+    """
+    Split a CPU budget between joblib workers and the OCC thread pool of
+    each worker.  Large files get several meshing threads each when
+    there are fewer of them than CPUs, the CPUs they leave over convert
+    the small files meanwhile, one single threaded worker each.  All
+    files go to one pool of at most max_jobs workers, large files first
+    and then by decreasing cost, see estimate_costs, so that the
+    longest jobs do not end up last.  As the pool hands out files in
+    order, no more large files run at once than planned, and n_jobs
+    workers with their threads stay within the budget.  A
+    worker done with its large file goes on with small files on one
+    thread, so the other threads of a large file are left idle once it
+    is done rather than oversubscribing the CPUs while it runs.  With
+    part_jobs > 1 each worker hands the parts of its file to that many
+    processes, each with the threads of the file, see
+    StepProcessor.process_parts, so a worker counts part_jobs times
+    """
+    if cpu_budget is None:
+        cpu_budget = available_cpus()
+    cpu_budget = max(1, cpu_budget)
+    if max_jobs is None:
+        max_jobs = cpu_budget
+    max_jobs = max(1, max_jobs)
+    part_jobs = max(1, part_jobs)
+    if costs is None:
+        costs = estimate_costs(files)
+
+    files = sorted(files, key=lambda f: -costs[f])
+    large_files = [f for f in files if file_size(f) >= large_file_size]
+    large_set = set(large_files)
+    small_files = [f for f in files if not f in large_set]
+
+    threads = {f: 1 for f in small_files}
+    n_jobs = 0
+    free_cpus = cpu_budget
+    if len(large_files) > 0:
+        large_threads = max(1, min(max_threads, cpu_budget // (len(large_files) * part_jobs)))
+        n_jobs = max(1, min(len(large_files), cpu_budget // (large_threads * part_jobs), max_jobs))
+        free_cpus -= n_jobs * large_threads * part_jobs
+        threads.update((f, large_threads) for f in large_files)
+    if len(small_files) > 0:
+        # Without CPUs left over the small files wait for a large file to finish
+        n_jobs += max(0, min(len(small_files), free_cpus // part_jobs, max_jobs - n_jobs))
+        n_jobs = max(1, n_jobs)
+    return CpuPlan(large_files + small_files, n_jobs, threads)
+
+
+def set_occ_thread_count(threads):
+    """
+    Size the default OCC thread pool used by parallel algorithms
+    such as BRepMesh in this process
+    """
+    # Imported here, planning the budget does not need OCC
+    from OCC.Core.OSD import OSD_ThreadPool
+    OSD_ThreadPool.DefaultPool(threads).Init(threads)
@@ -1,3 +1,4 @@
+import itertools
 import math
 
 from OCC.Core.STEPControl import STEPControl_Reader
@@ -120,6 +121,44 @@ def get_boundingbox(body, tol=1e-6, use_mesh=False, logger=None):
     return [xmin, ymin, zmin, xmax, ymax, zmax]
 
 
+def reals_to_array(array):
+    """
+    Copy a TColStd_Array1OfReal into a float64 array
+    """
+    n = array.Length()
+    lower = array.Lower()
+    return np.fromiter((array.Value(lower + i) for i in range(n)), dtype=np.float64, count=n)
+
+
+def points_to_array(array, dim=3):
+    """
+    Copy a TColgp_Array1OfPnt (dim 3) or TColgp_Array1OfPnt2d (dim 2)
+    into an (n, dim) float64 array
+    """
+    n = array.Length()
+    lower = array.Lower()
+    coords = itertools.chain.from_iterable(array.Value(lower + i).Coord() for i in range(n))
+    return np.fromiter(coords, dtype=np.float64, count=dim*n).reshape(n, dim)
+
+
+def reals2_to_array(array):
+    """
+    Copy a TColStd_Array2OfReal into a (rows, columns) float64 array
+    """
+    rows, columns = array.ColLength(), array.RowLength()
+    values = (array.Value(i + 1, j + 1) for i in range(rows) for j in range(columns))
+    return np.fromiter(values, dtype=np.float64, count=rows*columns).reshape(rows, columns)
+
+
+def points2_to_array(array):
+    """
+    Copy a TColgp_Array2OfPnt into a (rows, columns, 3) float64 array
+    """
+    rows, columns = array.ColLength(), array.RowLength()
+    coords = itertools.chain.from_iterable(array.Value(i + 1, j + 1).Coord() for i in range(rows) for j in range(columns))
+    return np.fromiter(coords, dtype=np.float64, count=3*rows*columns).reshape(rows, columns, 3)
+
+
 def edge_type(nr):
     edge_map = {0: "Line", 1: "Circle", 2: "Ellipse", 3: "Hyperbola", 4: "Parabola", 5: "Bezier", 6: "BSpline", 7: "Offset", 8: "Other"}
     return edge_map[nr]
@@ -187,24 +226,15 @@ def convert_3dcurve(edge, curve_input=False):
         d1_feat["degree"] = c.Degree()
         p = TColgp_Array1OfPnt(1, c.NbPoles())
         c.Poles(p)
-        points = []
-        for pi in range(p.Length()):
-            points.append(list(p.Value(pi+1).Coord()))
-        d1_feat["poles"] = points
+        d1_feat["poles"] = points_to_array(p)
 
         k = TColStd_Array1OfReal(1, c.NbPoles() + c.Degree() + 1)
         c.KnotSequence(k)
-        knots = []
-        for ki in range(k.Length()):
-            knots.append(k.Value(ki+1))
-        d1_feat["knots"] = knots
+        d1_feat["knots"] = reals_to_array(k)
 
         w = TColStd_Array1OfReal(1, c.NbPoles())
         c.Weights(w)
-        weights = []
-        for wi in range(w.Length()):
-            weights.append(w.Value(wi+1))
-        d1_feat["weights"] = weights
+        d1_feat["weights"] = reals_to_array(w)
 
         scale_factor = 1.0
     else:
@@ -247,24 +277,15 @@ def convert_2dcurve(edge, surface):
         d1_feat["degree"] = c.Degree()
         p = TColgp_Array1OfPnt2d(1, c.NbPoles())
         c.Poles(p)
-        points = []
-        for pi in range(p.Length()):
-            points.append(list(p.Value(pi+1).Coord()))
-        d1_feat["poles"] = points
+        d1_feat["poles"] = points_to_array(p, dim=2)
 
         k = TColStd_Array1OfReal(1, c.NbPoles() + c.Degree() + 1)
         c.KnotSequence(k)
-        knots = []
-        for ki in range(k.Length()):
-            knots.append(k.Value(ki+1))
-        d1_feat["knots"] = knots
+        d1_feat["knots"] = reals_to_array(k)
 
         w = TColStd_Array1OfReal(1, c.NbPoles())
         c.Weights(w)
-        weights = []
-        for wi in range(w.Length()):
-            weights.append(w.Value(wi+1))
-        d1_feat["weights"] = weights
+        d1_feat["weights"] = reals_to_array(w)
     else:
         print("Unsupported type 2d", c_type)
     return d1_feat
@@ -371,13 +392,7 @@ def convert_surface(face):
 
         p = TColgp_Array2OfPnt(1, c.NbUPoles(), 1, c.NbVPoles())
         c.Poles(p)
-        points = []
-        for pi in range(p.ColLength()):
-            elems = []
-            for pj in range(p.RowLength()):
-                elems.append(list(p.Value(pi+1, pj+1).Coord()))
-            points.append(elems)
-        d2_feat["poles"] = points
+        d2_feat["poles"] = points2_to_array(p)
 
 
         per_offset = 1
@@ -386,10 +401,7 @@ def convert_surface(face):
 
         k = TColStd_Array1OfReal(1, c.NbUPoles() + c.UDegree() + per_offset)
         c.UKnotSequence(k)
-        knots = []
-        for ki in range(k.Length()):
-            knots.append(k.Value(ki+1))
-        d2_feat["u_knots"] = knots
+        d2_feat["u_knots"] = reals_to_array(k)
         per_offset = 1
         # if c.IsVPeriodic():
         #    per_offset = 2
@@ -397,20 +409,11 @@ def convert_surface(face):
         k = TColStd_Array1OfReal(1, c.NbVPoles() + c.VDegree() + per_offset)
         #print(c.NbVPoles() + c.VDegree() + 1)
         c.VKnotSequence(k)
-        knots = []
-        for ki in range(k.Length()):
-            knots.append(k.Value(ki+1))
-        d2_feat["v_knots"] = knots
+        d2_feat["v_knots"] = reals_to_array(k)
 
         w = TColStd_Array2OfReal(1, c.NbUPoles(), 1, c.NbVPoles())
         c.Weights(w)
-        weights = []
-        for wi in range(w.ColLength()):
-            elems = []
-            for wj in range(w.RowLength()):
-                elems.append(w.Value(wi+1, wj+1))
-            weights.append(elems)
-        d2_feat["weights"] = weights
+        d2_feat["weights"] = reals2_to_array(w)
 
         scale_factor = 1.0
 
@@ -0,0 +1,91 @@
+import contextlib
+import json
+import time
+
+
+class StageTimer:
+    """
+    Accumulates the wall time of named stages with a high resolution
+    clock, and the time spent converting geometric entities by type
+    """
+    def __init__(self):
+        self.stages = {}
+        self.by_type = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def add_entity(self, kind, entity_type, seconds):
+        """
+        Count one entity of a kind ("surface", "3dcurve", "2dcurve")
+        and type (e.g. "BSpline") which took seconds to convert
+        """
+        key = "%s/%s" % (kind, entity_type)
+        count, total = self.by_type.get(key, (0, 0.0))
+        self.by_type[key] = (count + 1, total + seconds)
+
+    def merge_types(self, other):
+        for key, (count, total) in other.by_type.items():
+            own_count, own_total = self.by_type.get(key, (0, 0.0))
+            self.by_type[key] = (own_count + count, own_total + total)
+
+    def types_as_dict(self):
+        return {key: {"count": count, "time": total} for key, (count, total) in self.by_type.items()}
+
+
+def write_timings(group, stages):
+    """
+    Store stage timings in seconds as time_<stage> attributes of an HDF5 group
+    """
+    for name, seconds in stages.items():
+        group.attrs["time_" + name] = seconds
+
+
+class TimingReport:
+    """
+    Aggregate of the timings returned by StepProcessor.process_parts
+    for many files, per stage and per entity type
+    """
+    def __init__(self):
+        self.nr_files = 0
+        self.stages = {}
+        self.by_type = {}
+
+    def add(self, timings):
+        if not timings:
+            return
+        self.nr_files += 1
+        for name, seconds in timings.get("stages", {}).items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for part_stages in timings.get("parts", []):
+            for name, seconds in part_stages.items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for key, entry in timings.get("by_type", {}).items():
+            count, total = self.by_type.get(key, (0, 0.0))
+            self.by_type[key] = (count + entry["count"], total + entry["time"])
+
+    def format(self):
+        lines = ["Timings of %i files" % self.nr_files, "%-28s %12s" % ("stage", "seconds")]
+        for name, seconds in sorted(self.stages.items(), key=lambda item: -item[1]):
+            lines.append("%-28s %12.3f" % (name, seconds))
+        lines.append("%-28s %10s %12s %12s" % ("entity type", "count", "seconds", "us/entity"))
+        for key, (count, total) in sorted(self.by_type.items(), key=lambda item: -item[1][1]):
+            lines.append("%-28s %10i %12.3f %12.1f" % (key, count, total, 1e6 * total / max(count, 1)))
+        return "\n".join(lines)
+
+
+def timing_report_from_manifest(manifest):
+    """
+    Aggregate the timings recorded in a JSONL result manifest
+    """
+    report = TimingReport()
+    with open(manifest, "r") as f:
+        for line in f:
+            entry = json.loads(line)
+            report.add(entry.get("timings"))
+    return report
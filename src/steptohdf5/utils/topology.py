@@ -1,4 +1,21 @@
 from OCC.Core.TopAbs import (TopAbs_FORWARD, TopAbs_REVERSED, TopAbs_INTERNAL, TopAbs_EXTERNAL)
+from OCC.Core.TopAbs import (TopAbs_VERTEX, TopAbs_EDGE, TopAbs_FACE, TopAbs_WIRE,
+                             TopAbs_SHELL, TopAbs_SOLID, TopAbs_COMPOUND,
+                             TopAbs_COMPSOLID)
+from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopoDS import topods
+
+
+topology_factory = {
+    TopAbs_VERTEX: topods.Vertex,
+    TopAbs_EDGE: topods.Edge,
+    TopAbs_FACE: topods.Face,
+    TopAbs_WIRE: topods.Wire,
+    TopAbs_SHELL: topods.Shell,
+    TopAbs_SOLID: topods.Solid,
+    TopAbs_COMPOUND: topods.Compound,
+    TopAbs_COMPSOLID: topods.CompSolid
+}
 
 def orientation_to_sense(orientation):
     # I think the orientation flags might actually indicate
@@ -7,4 +24,34 @@ def orientation_to_sense(orientation):
     # TopAbs_INTERNAL = 2 	
     # TopAbs_EXTERNAL = 3
     assert orientation == TopAbs_FORWARD or orientation == TopAbs_REVERSED
-    return orientation == TopAbs_FORWARD
\ No newline at end of file
+    return orientation == TopAbs_FORWARD
+
+def shape_key(shape, ignore_orientation=True):
+    """
+    Key identifying a shape.  The hash only covers the TShape and
+    the location, so the orientation is added for oriented entities
+    such as halfedges
+    """
+    if ignore_orientation:
+        return hash(shape)
+    return (hash(shape), shape.Orientation())
+
+def unique_subshapes(shape, topology_type, ignore_orientation=True):
+    """
+    Return the sub-shapes of the given type in the order in which they 
+    are first found, without duplicates.  This gives the same sequence as
+    TopologyExplorer, but uses a hash set instead of comparing every new 
+    entity against all the entities found so far
+    """
+    factory = topology_factory[topology_type]
+    explorer = TopExp_Explorer(shape, topology_type)
+    keys = set()
+    subshapes = []
+    while explorer.More():
+        current = explorer.Current()
+        key = shape_key(current, ignore_orientation)
+        if not key in keys:
+            keys.add(key)
+            subshapes.append(factory(current))
+        explorer.Next()
+    return subshapes
@@ -0,0 +1,186 @@
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+# States of a file in the queue
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class WorkQueue:
+    """
+    A queue of files shared by many tasks through an SQLite database.
+    Tasks claim batches of files under a lease which they renew with
+    heartbeats; leases of dead tasks expire and their files are handed
+    out again.  Failed files are retried until max_attempts is reached.
+    Each claim is one short write transaction, so hundreds of tasks can
+    pull work without a lock file.  WAL mode needs shared memory between
+    the processes, on network file systems where that is not available
+    use journal_mode="delete"
+    """
+    def __init__(self, path, lease_time=3600.0, max_attempts=3, max_batch=64, journal_mode="wal", timeout=60.0):
+        self.path = str(path)
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self.max_batch = max_batch
+        self.journal_mode = journal_mode
+        self.timeout = timeout
+        with self.connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                       "owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT)")
+            db.execute("CREATE INDEX IF NOT EXISTS files_state ON files (state, lease_expires)")
+
+    def connect(self):
+        """
+        A new connection, each thread and process uses its own.  Closing
+        happens when the returned context manager exits
+        """
+        db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        db.execute("PRAGMA journal_mode=%s" % self.journal_mode)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return Connection(db)
+
+    def add(self, paths):
+        """
+        Add files to the queue, files already in it are left unchanged.
+        Returns the number of files added
+        """
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            before = db.total_changes
+            db.executemany("INSERT OR IGNORE INTO files (path, state) VALUES (?, ?)", ((str(p), STATE_PENDING) for p in paths))
+            db.execute("COMMIT")
+            return db.total_changes - before
+
+    def batch_size(self, db, now):
+        """
+        Hand out a share of the pending files proportional to the number
+        of active tasks, so batches shrink as the queue drains
+        """
+        pending = db.execute("SELECT COUNT(*) FROM files WHERE state = ?", (STATE_PENDING,)).fetchone()[0]
+        owners = db.execute("SELECT COUNT(DISTINCT owner) FROM files WHERE state = ? AND lease_expires > ?", (STATE_LEASED, now)).fetchone()[0]
+        return max(1, min(self.max_batch, math.ceil(pending / (2 * (owners + 1)))))
+
+    def reclaim(self, db, now):
+        """
+        Return the files of expired leases to the queue, or mark them
+        failed once they used up their attempts
+        """
+        db.execute("UPDATE files SET state = ?, owner = NULL, lease_expires = NULL, error = ? "
+                   "WHERE state = ? AND lease_expires <= ? AND attempts >= ?",
+                   (STATE_FAILED, "Lease expired", STATE_LEASED, now, self.max_attempts))
+        db.execute("UPDATE files SET state = ?, owner = NULL, lease_expires = NULL "
+                   "WHERE state = ? AND lease_expires <= ?", (STATE_PENDING, STATE_LEASED, now))
+
+    def claim(self, owner, batch_size=None, lease=True):
+        """
+        Atomically lease a batch of pending files to owner, by default
+        sized by batch_size().  Without lease the files are handed out
+        for good and marked done.  Returns the claimed paths, an empty
+        list once no file is pending
+        """
+        owner = str(owner)
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            self.reclaim(db, now)
+            if batch_size is None:
+                batch_size = self.batch_size(db, now)
+            paths = [row[0] for row in db.execute("SELECT path FROM files WHERE state = ? ORDER BY rowid LIMIT ?", (STATE_PENDING, batch_size))]
+            state, expires = (STATE_LEASED, now + self.lease_time) if lease else (STATE_DONE, None)
+            db.executemany("UPDATE files SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE path = ?",
+                           ((state, owner, expires, path) for path in paths))
+            db.execute("COMMIT")
+        return paths
+
+    def heartbeat(self, owner):
+        """
+        Renew the leases of all files claimed by owner
+        """
+        with self.connect() as db:
+            db.execute("UPDATE files SET lease_expires = ? WHERE state = ? AND owner = ?",
+                       (time.time() + self.lease_time, STATE_LEASED, str(owner)))
+
+    def complete(self, path, owner):
+        with self.connect() as db:
+            db.execute("UPDATE files SET state = ?, lease_expires = NULL, error = NULL WHERE path = ? AND owner = ? AND state = ?",
+                       (STATE_DONE, str(path), str(owner), STATE_LEASED))
+
+    def fail(self, path, owner, error=None):
+        """
+        Give a file back after a failed conversion, it is retried
+        until it failed max_attempts times
+        """
+        with self.connect() as db:
+            db.execute("UPDATE files SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, lease_expires = NULL, error = ? "
+                       "WHERE path = ? AND owner = ? AND state = ?",
+                       (self.max_attempts, STATE_FAILED, STATE_PENDING, error, str(path), str(owner), STATE_LEASED))
+
+    def counts(self):
+        """
+        Number of files per state
+        """
+        with self.connect() as db:
+            return dict(db.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall())
+
+
+class Connection:
+    """
+    Context manager closing an SQLite connection, and rolling back an
+    open transaction on errors
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.db.in_transaction:
+            self.db.execute("ROLLBACK")
+        self.db.close()
+        return False
+
+
+class Heartbeat:
+    """
+    Renew the leases of an owner from a background thread every
+    third of the lease time, while a batch is being converted
+    """
+    def __init__(self, queue, owner, interval=None):
+        self.queue = queue
+        self.owner = owner
+        self.interval = interval if interval is not None else queue.lease_time / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.owner)
+            except sqlite3.Error:
+                pass
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+        return False
+
+
+def default_owner():
+    """
+    Name of this task, the SLURM array task when run by SLURM
+    """
+    task = os.environ.get("SLURM_ARRAY_JOB_ID"), os.environ.get("SLURM_ARRAY_TASK_ID")
+    if task[1] is not None:
+        return "%s_%s" % task
+    return "%s_%i" % (socket.gethostname(), os.getpid())
@@ -0,0 +1,163 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+from collections import deque, namedtuple
+
+
+# Hard limits of a supervised worker.  timeout is the wall-clock limit
+# of one task in seconds, max_rss the resident memory limit of a worker
+# in bytes and max_tasks the number of tasks after which a worker is
+# replaced by a fresh process.  None disables a limit
+WorkerLimits = namedtuple("WorkerLimits", ["timeout", "max_rss", "max_tasks"], defaults=[None, None, None])
+
+# Outcomes of a task, besides success
+FAILURE_ERROR = "error"
+FAILURE_TIMEOUT = "timeout"
+FAILURE_MEMORY = "memory"
+FAILURE_CRASH = "crash"
+
+
+def process_rss(pid):
+    """
+    Resident memory of a process in bytes, None where /proc is not available
+    """
+    try:
+        with open("/proc/%i/statm" % pid, "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def worker_loop(connection, function):
+    """
+    Run tasks received from the supervisor until told to stop
+    """
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        index, args, kwargs = task
+        connection.send((index, function(*args, **kwargs)))
+    connection.close()
+
+
+class Worker:
+    """
+    A worker process and the task it is running
+    """
+    def __init__(self, context, function):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=worker_loop, args=(child_connection, function), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.task = None
+        self.start_time = None
+        self.nr_tasks = 0
+
+    def submit(self, task):
+        self.task = task
+        self.start_time = time.monotonic()
+        try:
+            self.connection.send(task)
+        except OSError:
+            # The worker died, the supervisor reports it as a crash
+            pass
+
+    def finish(self):
+        self.task = None
+        self.start_time = None
+        self.nr_tasks += 1
+
+    def stop(self, timeout=5.0):
+        try:
+            self.connection.send(None)
+        except (OSError, BrokenPipeError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class SupervisedPool:
+    """
+    A pool of worker processes which enforces WorkerLimits by killing
+    and respawning workers.  Unlike a thread based timeout, this also
+    stops tasks stuck inside OCC calls and returns their memory.
+    """
+    def __init__(self, function, n_workers, limits=None, mp_context="spawn", poll_interval=0.5):
+        self.function = function
+        self.n_workers = max(1, n_workers)
+        self.limits = limits if limits is not None else WorkerLimits()
+        self.context = multiprocessing.get_context(mp_context)
+        self.poll_interval = poll_interval
+
+    def map(self, arguments, kwargs=None, progress=None):
+        """
+        Call the function for each tuple of arguments.  Yields, in order
+        of completion, (arguments, result, failure kind, message) where
+        failure kind is None and result the return value on success
+        """
+        if kwargs is None:
+            kwargs = {}
+        pending = deque((index, args, kwargs) for index, args in enumerate(arguments))
+        workers = [None] * min(self.n_workers, len(pending))
+
+        try:
+            while pending or any(w is not None and w.task is not None for w in workers):
+                # Hand out tasks to idle workers, replacing used up ones
+                for i, worker in enumerate(workers):
+                    if not pending:
+                        break
+                    if worker is not None and worker.task is not None:
+                        continue
+                    if worker is not None and self.limits.max_tasks is not None and worker.nr_tasks >= self.limits.max_tasks:
+                        worker.stop()
+                        worker = None
+                    if worker is None or not worker.process.is_alive():
+                        worker = Worker(self.context, self.function)
+                        workers[i] = worker
+                    worker.submit(pending.popleft())
+
+                busy = [w for w in workers if w is not None and w.task is not None]
+                ready = multiprocessing.connection.wait([w.connection for w in busy], timeout=self.poll_interval)
+
+                for i, worker in enumerate(workers):
+                    if worker is None or worker.task is None:
+                        continue
+                    args = worker.task[1]
+                    outcome = None
+                    if worker.connection in ready:
+                        try:
+                            _, result = worker.connection.recv()
+                            outcome = (args, result, None, None)
+                            worker.finish()
+                        except (EOFError, OSError):
+                            worker.process.join(1.0)
+                            outcome = (args, None, FAILURE_CRASH, "Worker exited with code %s" % worker.process.exitcode)
+                    elif not worker.process.is_alive():
+                        outcome = (args, None, FAILURE_CRASH, "Worker exited with code %s" % worker.process.exitcode)
+                    elif self.limits.timeout is not None and time.monotonic() - worker.start_time > self.limits.timeout:
+                        outcome = (args, None, FAILURE_TIMEOUT, "Exceeded timeout of %.1f s" % self.limits.timeout)
+                    elif self.limits.max_rss is not None:
+                        rss = process_rss(worker.process.pid)
+                        if rss is not None and rss > self.limits.max_rss:
+                            outcome = (args, None, FAILURE_MEMORY, "RSS of %.0f MB exceeded limit of %.0f MB" % (rss / 1024**2, self.limits.max_rss / 1024**2))
+
+                    if outcome is None:
+                        continue
+                    if outcome[2] is not None:
+                        worker.kill()
+                        workers[i] = None
+                    if progress is not None:
+                        progress(1)
+                    yield outcome
+        finally:
+            for worker in workers:
+                if worker is not None:
+                    worker.stop()
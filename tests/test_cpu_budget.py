@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from steptohdf5.utils.cpu_budget import estimate_costs, load_recorded_times, plan_cpu_budget
+
+MB = 1024**2
+
+
+@pytest.fixture
+def make_file(tmp_path):
+    def make(name, size):
+        path = tmp_path / name
+        with open(path, "wb") as f:
+            f.truncate(size)
+        return path
+    return make
+
+
+def test_estimate_costs(make_file):
+    a, b, c = make_file("a.stp", 1000), make_file("b.stp", 2000), make_file("c.stp", 4000)
+    assert estimate_costs([a, b, c]) == {a: 1000, b: 2000, c: 4000}
+    # Unrecorded files cost their size times the median recorded time per byte
+    costs = estimate_costs([a, b, c], {str(a): 10.0, str(b): 40.0})
+    assert costs[a] == 10.0 and costs[b] == 40.0
+    assert costs[c] == pytest.approx(4000 * 0.02)
+
+
+def test_load_recorded_times(tmp_path):
+    manifest = tmp_path / "manifest.jsonl"
+    lines = [{"file": "a.stp", "wall_time": 1.0}, {"file": "a.stp", "wall_time": 2.0},
+             {"file": "b.stp", "wall_time": 5.0, "source": "cache"}, {"file": "c.stp", "error": "failed"}]
+    manifest.write_text("\n".join(json.dumps(line) for line in lines) + "\n{\"file\": \"d")
+    assert load_recorded_times(manifest) == {"a.stp": 2.0}
+    assert load_recorded_times(tmp_path / "missing.jsonl") == {}
+
+
+def test_small_files_fill_the_budget_left_by_large_ones(make_file):
+    large = make_file("large.stp", 30 * MB)
+    small = [make_file("small_%i.stp" % i, 1000 + i) for i in range(100)]
+    plan = plan_cpu_budget([large] + small, 64)
+    assert plan.files[0] == large
+    assert plan.files[1] == small[-1]
+    assert plan.threads[large] == 8
+    assert all(plan.threads[f] == 1 for f in small)
+    assert plan.n_jobs == 1 + 56
+
+
+@pytest.mark.parametrize("nr_large,nr_small,cpus,max_jobs,part_jobs", [
+    (1, 100, 64, None, 1), (3, 100, 16, None, 1), (20, 5, 8, None, 1), (4, 100, 64, 2, 1),
+    (1, 100, 64, None, 4), (2, 0, 8, None, 2), (0, 10, 4, None, 1), (0, 2, 8, None, 3),
+])
+def test_plan_stays_within_the_budget(make_file, nr_large, nr_small, cpus, max_jobs, part_jobs):
+    large = [make_file("large_%i.stp" % i, 30 * MB + i) for i in range(nr_large)]
+    small = [make_file("small_%i.stp" % i, 1000 + i) for i in range(nr_small)]
+    plan = plan_cpu_budget(large + small, cpus, max_jobs=max_jobs, part_jobs=part_jobs)
+    assert sorted(plan.files) == sorted(large + small)
+    assert plan.files[:nr_large] == large[::-1]
+    assert 1 <= plan.n_jobs <= (max_jobs or cpus)
+    # The pool hands out files in order, so the first n_jobs files are the most threads ever running at once
+    running = sum(plan.threads[f] for f in plan.files[:plan.n_jobs])
+    assert running * part_jobs <= max(cpus, part_jobs)
+
+
+def test_empty_plan():
+    plan = plan_cpu_budget([], 8)
+    assert plan.files == [] and plan.n_jobs == 0
@@ -0,0 +1,88 @@
+import h5py
+import numpy as np
+import pytest
+
+from steptohdf5.core.hdf5_converter import (convert_dict_to_hdf5, convert_topology_to_columnar_hdf5,
+                                            convert_meshes_to_hdf5, convert_meshes_to_concatenated_hdf5)
+from steptohdf5.reader import File
+
+
+def singularity(rank):
+    return {"rank": rank, "precision": 0.1 * rank, "uiso": True, "point3d": [1.0, 2.0, float(rank)], "first2d": [0.0, 1.0]}
+
+
+FACES = [
+    {"surface": 0, "surface_orientation": True, "loops": [0], "singularities": []},
+    {"surface": 1, "surface_orientation": False, "loops": [1, 2], "singularities": [singularity(1), singularity(2)]},
+    {"surface": 2, "surface_orientation": True, "loops": [3], "singularities": [singularity(1)]},
+]
+
+
+def mesh(offset):
+    return {"vertices": np.arange(12, dtype=np.float64).reshape(4, 3) + offset, "faces": np.array([[0, 1, 2], [0, 2, 3]])}
+
+
+def write_model(path, topology_layout, mesh_layout):
+    with h5py.File(path, "w") as f:
+        part = f.create_group("parts/part_001")
+        part.attrs["index"] = 0
+        if topology_layout == "columnar":
+            convert_topology_to_columnar_hdf5({"faces": FACES}, part.create_group("topology"))
+        else:
+            convert_dict_to_hdf5({"faces": FACES}, part.create_group("topology"))
+        meshes = [mesh(i) for i in range(len(FACES))]
+        if mesh_layout == "concatenated":
+            convert_meshes_to_concatenated_hdf5(meshes, part.create_group("mesh"))
+        else:
+            convert_meshes_to_hdf5(meshes, part.create_group("mesh"))
+
+
+@pytest.mark.parametrize("mesh_layout", ["faces", "concatenated"])
+def test_columnar_rows(tmp_path, mesh_layout):
+    path = tmp_path / "model.hdf5"
+    write_model(path, "columnar", mesh_layout)
+    with File(path) as f:
+        part = f.parts[0]
+        assert len(part) == 3
+        for index, expected in enumerate(FACES):
+            face = part.face(index).topology
+            assert face["surface"] == expected["surface"]
+            assert bool(face["surface_orientation"]) == expected["surface_orientation"]
+            np.testing.assert_array_equal(face["loops"], expected["loops"])
+
+        # A CSR column of dictionaries reads as a dict of field arrays
+        singularities = part.face(1).topology["singularities"]
+        np.testing.assert_array_equal(singularities["rank"], [1, 2])
+        np.testing.assert_allclose(singularities["precision"], [0.1, 0.2])
+        np.testing.assert_array_equal(singularities["point3d"][1], [1.0, 2.0, 2.0])
+        assert len(part.face(0).topology["singularities"]["rank"]) == 0
+        np.testing.assert_array_equal(part.face(2).topology["singularities"]["rank"], [1])
+
+
+@pytest.mark.parametrize("mesh_layout", ["faces", "concatenated"])
+def test_meshes(tmp_path, mesh_layout):
+    path = tmp_path / "model.hdf5"
+    write_model(path, "groups", mesh_layout)
+    with File(path) as f:
+        part = f.parts[0]
+        assert part.face(1).topology["loops"].tolist() == [1, 2]
+        points, triangles = part.face(2).mesh()
+        np.testing.assert_array_equal(points, mesh(2)["vertices"])
+        np.testing.assert_array_equal(triangles, mesh(2)["faces"])
+        points, triangles = part.mesh().arrays()
+        assert points.shape == (12, 3)
+        np.testing.assert_array_equal(triangles[2:4], mesh(1)["faces"] + 4)
+
+
+def test_cached_arrays_are_read_only(tmp_path):
+    path = tmp_path / "model.hdf5"
+    with h5py.File(path, "w") as f:
+        f.create_dataset("large", data=np.arange(4096, dtype=np.float64))
+        f.create_dataset("small", data=np.arange(4, dtype=np.int64))
+    with File(path) as f:
+        for name in ("large", "small"):
+            array = f.array(f.file[name])
+            assert array is f.array(f.file[name])
+            assert not array.flags.writeable
+        np.testing.assert_array_equal(f.array(f.file["large"]), np.arange(4096))
+        np.testing.assert_array_equal(f.rows(f.file["large"], 10, 13), [10, 11, 12])
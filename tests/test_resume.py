@@ -0,0 +1,76 @@
+import json
+
+import h5py
+
+from steptohdf5.core.compression import CompressionPolicy
+from steptohdf5.core.provenance import (conversion_options, hdf5_output_path, is_up_to_date, remeshed_options,
+                                        write_provenance)
+from steptohdf5.processing import record_result, resume_step_files
+
+
+def make_step_file(tmp_path, name="model"):
+    step_file = tmp_path / "input" / "a" / "b" / ("%s.stp" % name)
+    step_file.parent.mkdir(parents=True, exist_ok=True)
+    step_file.write_bytes(b"ISO-10303-21;")
+    return step_file
+
+
+def write_output(step_file, output_dir, options):
+    path = hdf5_output_path(step_file, output_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with h5py.File(path, "w") as f:
+        f.create_group("parts")
+        write_provenance(f, step_file, conversion_options(**options))
+    return path
+
+
+def test_conversion_options_are_stable():
+    options = conversion_options(compression=CompressionPolicy(level=6), mesh_deflection=[1e-3, 1e-2])
+    assert options == conversion_options(compression=CompressionPolicy(level=6), mesh_deflection=(1e-2, 1e-3), mesh_threads=8)
+    assert options != conversion_options(compression=CompressionPolicy(level=5), mesh_deflection=[1e-3, 1e-2])
+
+
+def test_resume_skips_up_to_date_outputs(tmp_path):
+    step_file = make_step_file(tmp_path)
+    output_dir = tmp_path / "output"
+    options = {"topology_layout": "columnar", "mesh_deflection": 1e-3}
+    write_output(step_file, output_dir, options)
+    assert is_up_to_date(step_file, output_dir, conversion_options(**options))
+
+    assert resume_step_files([step_file], output_dir, options) == ([], [(step_file, None, None)])
+    assert resume_step_files([step_file], output_dir, dict(options, mesh_deflection=1e-2)) == ([step_file], [])
+
+    # A changed input is converted again
+    step_file.write_bytes(b"ISO-10303-21; changed")
+    assert resume_step_files([step_file], output_dir, options) == ([step_file], [])
+
+
+def test_resume_remembers_failures(tmp_path):
+    step_file = make_step_file(tmp_path)
+    output_dir = tmp_path / "output"
+    options = {"mesh_deflection": 1e-3}
+    record_result(step_file, output_dir, options, "broken", "error")
+    assert resume_step_files([step_file], output_dir, options) == ([], [(step_file, "broken", "error")])
+    assert resume_step_files([step_file], output_dir, options, retry_failed=True) == ([step_file], [])
+    record_result(step_file, output_dir, options, None, None)
+    assert resume_step_files([step_file], output_dir, options) == ([step_file], [])
+
+
+def test_resume_remesh_compares_the_recorded_layouts(tmp_path):
+    step_file = make_step_file(tmp_path)
+    output_dir = tmp_path / "output"
+    written = {"topology_layout": "columnar", "geometry_layout": "columnar", "mesh_layout": "concatenated",
+               "compression": "fast", "mesh_deflection": 1e-3}
+    path = write_output(step_file, output_dir, written)
+    # Layout options as the command line passes them, which remesh ignores
+    remesh = {"topology_layout": "groups", "geometry_layout": "groups", "remesh": True, "mesh_threads": 4}
+
+    assert resume_step_files([step_file], output_dir, dict(remesh, mesh_deflection=1e-3))[0] == []
+    assert resume_step_files([step_file], output_dir, dict(remesh, mesh_deflection=1e-2))[0] == [step_file]
+    assert resume_step_files([step_file], output_dir, dict(remesh, mesh_deflection=1e-3, mesh_layout="faces"))[0] == [step_file]
+
+    # Once re-meshed the output records the new deflection
+    with h5py.File(path, "a") as f:
+        recorded = json.loads(f.attrs["options"])
+        f.attrs["options"] = conversion_options(**remeshed_options(recorded, mesh_deflection=1e-2))
+    assert resume_step_files([step_file], output_dir, dict(remesh, mesh_deflection=1e-2))[0] == []
@@ -0,0 +1,63 @@
+import io
+import json
+
+import h5py
+import numpy as np
+import pytest
+
+from steptohdf5.reader import open_model
+from steptohdf5.shards import (INDEX_NAME, ShardWriter, append_index_line, read_shard_index, shard_dir, share_image)
+
+
+def model_image(number):
+    image = io.BytesIO()
+    with h5py.File(image, "w") as f:
+        f.attrs["converter_version"] = "test"
+        f.attrs["options"] = json.dumps({"model": number})
+        f.attrs["input_size"] = 100 + number
+        part = f.create_group("parts/part_001")
+        part.create_dataset("data", data=np.full(1000, number, dtype=np.int64))
+    return image.getvalue()
+
+
+def test_shards_roll_over_and_are_indexed(tmp_path):
+    keys = ["a/b/model_%i" % i for i in range(3)]
+    with ShardWriter(tmp_path, shard_size=1, prefix="test") as writer:
+        for number, key in enumerate(keys):
+            writer.submit(key, *share_image(model_image(number)))
+    # Each shard is full after one model
+    assert sorted(writer.closed_models()) == keys
+    assert sorted(p.name for p in shard_dir(tmp_path).glob("*.hdf5")) == ["shard_test_%05i.hdf5" % i for i in range(3)]
+
+    models = read_shard_index(tmp_path)
+    assert sorted(models) == keys
+    assert models[keys[2]]["input_size"] == 102
+    assert json.loads(models[keys[2]]["options"]) == {"model": 2}
+    with open_model(tmp_path, keys[1]) as f:
+        assert f.options == {"model": 1}
+        np.testing.assert_array_equal(f.array(f.parts[0].group["data"]), np.full(1000, 1))
+    with pytest.raises(KeyError):
+        open_model(tmp_path, "a/b/missing")
+
+
+def test_later_runs_add_shards(tmp_path):
+    for run in range(2):
+        with ShardWriter(tmp_path, prefix="test") as writer:
+            writer.submit("a/b/model", *share_image(model_image(run)))
+    assert len(list(shard_dir(tmp_path).glob("*.hdf5"))) == 2
+    # The model written last wins
+    with open_model(tmp_path, "a/b/model") as f:
+        assert f.options == {"model": 1}
+
+
+def test_truncated_index_line(tmp_path):
+    directory = shard_dir(tmp_path)
+    directory.mkdir(parents=True)
+    index = directory / INDEX_NAME
+    append_index_line(index, json.dumps({"shard": "one.hdf5", "models": {"a": {"group": "models/000000"}}}))
+    with open(index, "a") as f:
+        f.write('{"shard": "two.hdf5", "mod')
+    append_index_line(index, json.dumps({"shard": "three.hdf5", "models": {"b": {"group": "models/000000"}}}))
+    models = read_shard_index(tmp_path)
+    assert sorted(models) == ["a", "b"]
+    assert models["b"]["shard"] == str(directory / "three.hdf5")
@@ -0,0 +1,55 @@
+import time
+
+from steptohdf5.work_queue import WorkQueue, STATE_DONE, STATE_FAILED, STATE_LEASED, STATE_PENDING
+
+
+def test_claim_and_complete(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db")
+    assert queue.add(["a", "b", "c"]) == 3
+    assert queue.add(["a", "d"]) == 1
+    first = queue.claim("task_1", batch_size=2)
+    second = queue.claim("task_2", batch_size=2)
+    assert first == ["a", "b"]
+    assert second == ["c", "d"]
+    assert queue.claim("task_3") == []
+    for path in first:
+        queue.complete(path, "task_1")
+    # Only the owner of a lease completes it
+    queue.complete("c", "task_1")
+    assert queue.counts() == {STATE_DONE: 2, STATE_LEASED: 2}
+
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", lease_time=0.05, max_attempts=2)
+    queue.add(["a"])
+    assert queue.claim("dead") == ["a"]
+    time.sleep(0.1)
+    assert queue.claim("alive") == ["a"]
+    # The dead task can no longer complete a file handed to another
+    queue.complete("a", "dead")
+    assert queue.counts() == {STATE_LEASED: 1}
+    time.sleep(0.1)
+    assert queue.claim("late") == []
+    assert queue.counts() == {STATE_FAILED: 1}
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", lease_time=0.2)
+    queue.add(["a"])
+    assert queue.claim("task") == ["a"]
+    for _ in range(3):
+        time.sleep(0.1)
+        queue.heartbeat("task")
+    assert queue.claim("other") == []
+
+
+def test_failed_files_are_retried(tmp_path):
+    queue = WorkQueue(tmp_path / "queue.db", max_attempts=2)
+    queue.add(["a"])
+    assert queue.claim("task") == ["a"]
+    queue.fail("a", "task", "error")
+    assert queue.counts() == {STATE_PENDING: 1}
+    assert queue.claim("task") == ["a"]
+    queue.fail("a", "task", "error")
+    assert queue.counts() == {STATE_FAILED: 1}
+    assert queue.claim("task") == []